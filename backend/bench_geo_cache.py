@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+地理信息缓存基准测试：使用离线模拟的百度地图服务器，比较无缓存、冷缓存和热缓存下的命中率与延迟
+用法: python bench_geo_cache.py [请求次数]
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from src.core.geo_cache import GeoCache
+from src.core.mcp_client import MCPClient
+from src.core.mcp_tools import TravelMcpTools
+
+LANDMARKS = [
+    "北京天安门", "北京故宫博物院", "北京颐和园", "北京八达岭长城", "上海外滩", "上海东方明珠",
+    "上海豫园", "杭州西湖", "杭州灵隐寺", "杭州西溪湿地", "西安兵马俑", "西安大雁塔",
+    "成都宽窄巷子", "成都大熊猫繁育研究基地", "广州塔", "深圳世界之窗",
+]
+
+
+def build_workload(count: int) -> list[tuple[str, dict]]:
+    """构造请求序列：热门地点出现频率更高，同一地址混用不同写法"""
+    rng = random.Random(42)
+    weights = [1 / (i + 1) for i in range(len(LANDMARKS))]
+    workload = []
+    for _ in range(count):
+        landmark = rng.choices(LANDMARKS, weights)[0]
+        kind = rng.random()
+        if kind < 0.5:
+            address = rng.choice([landmark, f" {landmark} ", f"中国{landmark}", f"{landmark}。"])
+            workload.append(("map_geocode", {"address": address}))
+        elif kind < 0.8:
+            workload.append(("map_search_places", {"query": landmark[2:], "region": landmark[:2]}))
+        else:
+            workload.append(("map_place_detail", {"uid": f"uid-{landmark}", "scope": "2"}))
+    return workload
+
+
+async def run(client: MCPClient, workload: list[tuple[str, dict]], cache: GeoCache | None) -> list[float]:
+    """依次执行请求，返回每次请求的延迟（毫秒）"""
+    latencies = []
+    for tool_name, arguments in workload:
+        start = time.perf_counter()
+        if cache is None:
+            await client.call_tool(tool_name, arguments)
+        else:
+            await cache.get_or_fetch(tool_name, arguments, lambda: client.call_tool(tool_name, arguments))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label: str, latencies: list[float], cache: GeoCache | None = None) -> None:
+    latencies = sorted(latencies)
+    line = (
+        f"{label:>10}: mean {statistics.mean(latencies):7.2f} ms | "
+        f"p50 {latencies[len(latencies) // 2]:7.2f} ms | "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.2f} ms"
+    )
+    if cache is not None:
+        stats = cache.get_stats()
+        line += f" | hit rate {stats['hit_rate']:.1%} | upstream {stats['misses']} | entries {stats['entries']}"
+    print(line)
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    workload = build_workload(count)
+
+    tool_info = TravelMcpTools.get_fake_baidu_maps_tool(in_process=True)
+    client = MCPClient(**tool_info.to_common_params())
+    await client.init()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "geo_cache.db")
+        try:
+            report("no cache", await run(client, workload, None))
+
+            cache = GeoCache(db_path, source="fake")
+            await cache.start()
+            report("cold", await run(client, workload, cache), cache)
+            await cache.close()
+
+            # 重新打开数据库，模拟服务重启后的持久缓存
+            cache = GeoCache(db_path, source="fake")
+            await cache.start()
+            report("warm", await run(client, workload, cache), cache)
+            await cache.close()
+
+            # 新鲜期为 0：所有条目均已过期，返回旧值并在后台刷新
+            cache = GeoCache(db_path, ttls={name: 0 for name in cache.ttls}, source="fake")
+            await cache.start()
+            report("stale", await run(client, workload, cache), cache)
+            await asyncio.sleep(0.5)
+            print(f"{'':>10}  background refreshes: {cache.get_stats()['refreshes']}")
+            await cache.close()
+        finally:
+            await client.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+比较 MCP 传输方式的单次调用延迟：stdio 子进程 vs 进程内内存流
+用法: python bench_mcp_transport.py [调用次数]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from src.core.mcp_client import MCPClient
+from src.core.mcp_tools import TravelMcpTools
+
+
+def build_plan_arguments(count: int = 30) -> dict:
+    """构造一个结果较大的 plan_itinerary 请求"""
+    destinations = [
+        {
+            "name": f"景点{i}",
+            "address": f"杭州市西湖区景点路{i}号",
+            "type": "文化古迹" if i % 2 else "自然风光",
+            "duration": 90,
+            "priority": i % 5 + 1,
+            "location": {"lat": 30.25 + i * 0.01, "lng": 120.15 + i * 0.01},
+        }
+        for i in range(count)
+    ]
+    return {
+        "destinations": destinations,
+        "travel_days": 7,
+        "start_date": datetime.now().strftime("%Y-%m-%d"),
+        "preferences": ["文化古迹", "自然风光"],
+    }
+
+
+async def bench(in_process: bool, calls: int) -> None:
+    """对一种传输方式执行基准测试"""
+    tool_info = TravelMcpTools.get_itinerary_tool(in_process=in_process)
+    client = MCPClient(**tool_info.to_common_params())
+    arguments = build_plan_arguments()
+
+    try:
+        start = time.perf_counter()
+        await client.init()
+        connect_ms = (time.perf_counter() - start) * 1000
+
+        # 预热
+        result = await client.call_tool("plan_itinerary", arguments)
+        payload_kb = len(result.content[0].text.encode("utf-8")) / 1024
+
+        latencies = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            await client.call_tool("plan_itinerary", arguments)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        await client.cleanup()
+
+    latencies.sort()
+    print(
+        f"{tool_info.transport:>6}: connect {connect_ms:8.1f} ms | "
+        f"mean {statistics.mean(latencies):6.2f} ms | "
+        f"p50 {latencies[len(latencies) // 2]:6.2f} ms | "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:6.2f} ms | "
+        f"payload {payload_kb:.1f} KB"
+    )
+
+
+async def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for in_process in (False, True):
+        await bench(in_process, calls)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,171 @@
+"""
+Session Event Queue for Travel Assistant
+单个 WebSocket 连接的有界事件队列：所有状态、流式数据和消息按产生顺序入队，由一个写入任务依次发送
+"""
+
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from src.api.stream_buffer import COALESCED_STREAM_TYPES, StreamBuffer
+from src.utils.info import STREAM_QUEUE_MAX_EVENTS
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[EventQueue]")
+
+# 最终状态：不会被后续状态取代，不能丢弃
+FINAL_STATUSES = ("completed", "error", "cancelled")
+
+# 队列元素：("stream", stream_type, data, seq) 或 ("message", message, droppable, None)
+Event = Tuple[str, Any, Any, Optional[int]]
+
+
+class SessionEventQueue:
+    """有界事件队列，队列已满时的处理策略：
+
+    - content / reasoning 增量与队尾同类型增量合并，保持顺序
+    - 其他流式数据在队列已满时等待写入任务腾出空间（对 Agent 形成背压）
+    - 中间状态可被丢弃：队列已满时丢弃最早的中间状态
+    - 最终消息（方案、错误、最终状态等）从不丢弃，必要时允许超出上限
+    """
+
+    def __init__(self, buffer: StreamBuffer, max_events: int = STREAM_QUEUE_MAX_EVENTS):
+        self.buffer = buffer
+        self.max_events = max(1, max_events)
+        self._events: Deque[Event] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._closed = False
+        self._writer: Optional[asyncio.Task] = None
+        self.max_depth = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.overflow = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._events)
+
+    def start(self) -> None:
+        """启动写入任务"""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+
+    async def put_stream(self, stream_type: str, data: Any, seq: Optional[int] = None) -> None:
+        """写入一条流式数据，队列已满时等待；合并后的增量使用最后一条的序号"""
+        if self._closed:
+            return
+        if stream_type in COALESCED_STREAM_TYPES and isinstance(data, str) and self._events:
+            kind, tail_type, tail_data, _ = self._events[-1]
+            if kind == "stream" and tail_type == stream_type:
+                self._events[-1] = (kind, tail_type, tail_data + data, seq)
+                self.coalesced += 1
+                return
+
+        while len(self._events) >= self.max_events and not self._closed:
+            self._space.clear()
+            await self._space.wait()
+        if not self._closed:
+            self._append(("stream", stream_type, data, seq))
+
+    def put_message(self, message: Dict[str, Any], final: bool = True) -> None:
+        """写入一条完整消息；final 为 False 的消息在队列已满时可以被丢弃"""
+        if self._closed:
+            return
+        if len(self._events) >= self.max_events and not self._drop_oldest_droppable():
+            if not final:
+                # 中间状态会被之后的状态取代，丢弃本条
+                self.dropped += 1
+                return
+            self.overflow += 1
+        self._append(("message", message, not final, None))
+
+    def put_urgent(self, message: Dict[str, Any]) -> None:
+        """插到队首的消息（如心跳响应），不等待之前排队的事件"""
+        if self._closed:
+            return
+        self._events.appendleft(("message", message, False, None))
+        self.max_depth = max(self.max_depth, len(self._events))
+        self._ready.set()
+
+    def put_status(self, status: str, details: str = "", seq: Optional[int] = None) -> None:
+        """写入状态更新，只有最终状态不可丢弃"""
+        message = {
+            "type": "status",
+            "status": status,
+            "details": details,
+            "timestamp": datetime.now().isoformat()
+        }
+        if seq is not None:
+            message["seq"] = seq
+        self.put_message(message, final=status in FINAL_STATUSES)
+
+    def put_replay(self, events: List[Dict[str, Any]]) -> None:
+        """写入重连时补发的事件（已带序号），相邻的同类型增量合并为一条，均不丢弃"""
+        merged: List[Dict[str, Any]] = []
+        for event in events:
+            tail = merged[-1] if merged else None
+            if (
+                tail is not None and event.get("type") == "stream" and tail.get("type") == "stream"
+                and event.get("stream_type") in COALESCED_STREAM_TYPES
+                and tail["stream_type"] == event["stream_type"]
+                and isinstance(tail["data"], str) and isinstance(event["data"], str)
+            ):
+                merged[-1] = {**event, "data": tail["data"] + event["data"]}
+                self.coalesced += 1
+            else:
+                merged.append(event)
+        for event in merged:
+            self.put_message(event)
+
+    def _append(self, event: Event) -> None:
+        self._events.append(event)
+        self.max_depth = max(self.max_depth, len(self._events))
+        self._ready.set()
+
+    def _drop_oldest_droppable(self) -> bool:
+        for index, (kind, _, droppable, _) in enumerate(self._events):
+            if kind == "message" and droppable:
+                del self._events[index]
+                self.dropped += 1
+                return True
+        return False
+
+    async def _drain(self) -> None:
+        while True:
+            try:
+                await self._ready.wait()
+                while self._events:
+                    kind, first, second, seq = self._events.popleft()
+                    self._space.set()
+                    if kind == "stream":
+                        await self.buffer.push(first, second, seq)
+                    else:
+                        await self.buffer.send(first)
+                self._ready.clear()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error sending queued event: {e}")
+
+    def discard(self) -> None:
+        """连接已断开：丢弃队列并停止写入任务，唤醒等待空间的生产者"""
+        self._closed = True
+        self._events.clear()
+        self._space.set()
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self.buffer.discard()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "overflow": self.overflow,
+            **self.buffer.get_stats(),
+        }
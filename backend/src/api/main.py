@@ -6,22 +6,32 @@ Travel Assistant FastAPI Application
 import asyncio
 import json
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
 
+from src.api.event_queue import SessionEventQueue
+from src.api.request_queue import RequestQueueFullError, SessionRequestQueue
+from src.api.stream_buffer import StreamBuffer
+from src.core.admission import AdmissionRejectedError
 from src.core.travel_agent import TravelAgent, UserProfile
-from src.core.mcp_client import MCPClient
+from src.core.mcp_pool import mcp_server_pool
+from src.core.mcp_supervisor import mcp_supervisor
 from src.core.mcp_tools import TravelMcpTools
-from src.core.session_manager import session_manager
+from src.core.session_manager import RESYNC_REQUIRED, session_manager
+from src.core.job_manager import job_manager
+from src.core.geo_cache import geo_cache
+from src.core.plan_cache import plan_cache
+from src.core.tool_cache import tool_result_cache
 from src.utils.info import (
-    HOST, PORT, CORS_ORIGINS, DEFAULT_MODEL_NAME
+    HOST, PORT, WORKERS, CORS_ORIGINS, DEFAULT_MODEL_NAME, BAIDU_MAP_FAKE, WS_RESUME_GRACE
 )
-from src.utils.pretty import ALogger
+from src.utils.pretty import LOG_WRITER, ALogger
 
 LOGGER = ALogger("[FastAPI]")
 
@@ -45,63 +55,183 @@ app.add_middleware(
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.queues: Dict[str, SessionEventQueue] = {}
+        self.requests: Dict[str, SessionRequestQueue] = {}
+        self._callbacks: Dict[str, Tuple[Callable, Callable]] = {}
+        self._closing: Dict[str, asyncio.Task] = {}  # 连接断开后等待重连的请求队列
 
-    async def connect(self, websocket: WebSocket, session_id: str):
+    async def connect(self, websocket: WebSocket, session_id: str, last_seq: Optional[int] = None):
         await websocket.accept()
+        # 客户端重连时服务端可能还没发现旧连接已断开，旧连接不再接收事件
+        self._detach(session_id)
         self.active_connections[session_id] = websocket
-        
+        # 每个连接一个有界事件队列，由单个写入任务按顺序发送；流式增量经输出缓冲合并
+        queue = SessionEventQueue(StreamBuffer(websocket.send_text))
+        queue.start()
+        self.queues[session_id] = queue
+        # 在等待期内重连时沿用原来的请求队列，正在处理的请求继续执行
+        closing = self._closing.pop(session_id, None)
+        if closing is not None:
+            closing.cancel()
+        if session_id not in self.requests:
+            # 旅行规划请求由单独的工作任务依次处理，接收循环不会被阻塞
+            requests = SessionRequestQueue(lambda request: self._run_travel_request(session_id, request))
+            requests.start()
+            self.requests[session_id] = requests
+        # 服务重启后首次连接时从会话存储恢复会话
+        await session_manager.load_session(session_id)
+
+        events, complete = [], True
+        if last_seq is not None:
+            events, complete = await session_manager.replay_events(session_id, last_seq)
+        if self.queues.get(session_id) is not queue:
+            # 等待期间已被同一会话的新连接取代
+            return
+
+        # 以下直到注册回调都不能 await：补发的事件之后紧接着实时事件，既不遗漏也不重复
+        if not complete:
+            queue.put_message({
+                "type": "resync",
+                "content": "部分事件已无法补发，请重新加载会话历史",
+                "last_seq": session_manager.event_log.last_seq(session_id),
+                "timestamp": datetime.now().isoformat()
+            })
+        if events:
+            queue.put_replay(events)
+
         # 添加状态回调
-        def status_callback(status: str, details: str):
-            asyncio.create_task(self.send_status(session_id, status, details))
+        def status_callback(status: str, details: str, seq: Optional[int]):
+            if status == RESYNC_REQUIRED:
+                # 转发事件有丢失，通知客户端重连补发（不可丢弃）
+                queue.put_message({
+                    "type": RESYNC_REQUIRED,
+                    "content": details,
+                    "last_seq": session_manager.event_log.last_seq(session_id),
+                    "timestamp": datetime.now().isoformat()
+                })
+                return
+            queue.put_status(status, details, seq)
         
-        # 添加流式回调
-        async def stream_callback(stream_type: str, data: Any):
-            await self.send_stream_data(session_id, stream_type, data)
+        # 添加流式回调（content / reasoning 增量会被合并，队列已满时等待）
+        async def stream_callback(stream_type: str, data: Any, seq: int):
+            await queue.put_stream(stream_type, data, seq)
         
         session_manager.add_status_callback(session_id, status_callback)
         session_manager.add_stream_callback(session_id, stream_callback)
+        self._callbacks[session_id] = (status_callback, stream_callback)
         LOGGER.info(f"WebSocket connected for session: {session_id}")
 
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
-            del self.active_connections[session_id]
-            LOGGER.info(f"WebSocket disconnected for session: {session_id}")
-
-    async def send_status(self, session_id: str, status: str, details: str = ""):
-        if session_id in self.active_connections:
-            try:
-                await self.active_connections[session_id].send_text(json.dumps({
-                    "type": "status",
-                    "status": status,
-                    "details": details,
-                    "timestamp": datetime.now().isoformat()
-                }))
-            except Exception as e:
-                LOGGER.error(f"Error sending status to {session_id}: {e}")
-
-    async def send_message(self, session_id: str, message: str, message_type: str = "message"):
-        if session_id in self.active_connections:
-            try:
-                await self.active_connections[session_id].send_text(json.dumps({
-                    "type": message_type,
-                    "content": message,
-                    "timestamp": datetime.now().isoformat()
-                }))
-            except Exception as e:
-                LOGGER.error(f"Error sending message to {session_id}: {e}")
-
-    async def send_stream_data(self, session_id: str, stream_type: str, data: Any):
-        """发送流式数据"""
-        if session_id in self.active_connections:
-            try:
-                await self.active_connections[session_id].send_text(json.dumps({
-                    "type": "stream",
-                    "stream_type": stream_type,
-                    "data": data,
-                    "timestamp": datetime.now().isoformat()
-                }))
-            except Exception as e:
-                LOGGER.error(f"Error sending stream data to {session_id}: {e}")
+    async def disconnect(self, session_id: str, websocket: WebSocket):
+        if self.active_connections.get(session_id) is not websocket:
+            # 已被同一会话的新连接取代
+            return
+        self._detach(session_id)
+        LOGGER.info(f"WebSocket disconnected for session: {session_id}")
+
+        requests = self.requests.get(session_id)
+        if requests is None:
+            return
+        if (requests.busy or requests.pending) and WS_RESUME_GRACE > 0:
+            # 保留正在处理的请求，等待客户端重连后补发错过的事件
+            self._closing[session_id] = asyncio.create_task(self._close_requests_later(session_id, requests))
+        else:
+            del self.requests[session_id]
+            await requests.close()
+
+    def _detach(self, session_id: str):
+        """移除连接的回调并丢弃其事件队列"""
+        callbacks = self._callbacks.pop(session_id, None)
+        if callbacks is not None:
+            session_manager.remove_status_callback(session_id, callbacks[0])
+            session_manager.remove_stream_callback(session_id, callbacks[1])
+        queue = self.queues.pop(session_id, None)
+        if queue is not None:
+            queue.discard()
+        self.active_connections.pop(session_id, None)
+
+    async def _close_requests_later(self, session_id: str, requests: SessionRequestQueue):
+        """等待期内没有重连：没有人接收结果，取消正在处理和排队的请求"""
+        await asyncio.sleep(WS_RESUME_GRACE)
+        if self._closing.get(session_id) is asyncio.current_task():
+            del self._closing[session_id]
+        if self.requests.get(session_id) is requests:
+            del self.requests[session_id]
+        if requests.busy or requests.pending:
+            LOGGER.info(f"Session {session_id} did not reconnect, cancelling its requests")
+        await requests.close()
+
+    def send_json(self, session_id: str, message: Dict[str, Any]):
+        """发送一条完整消息（不会被丢弃），排在之前的事件之后"""
+        queue = self.queues.get(session_id)
+        if queue is not None:
+            queue.put_message(message)
+
+    def send_urgent(self, session_id: str, message: Dict[str, Any]):
+        """立即发送一条消息（如心跳响应），插到排队事件之前"""
+        queue = self.queues.get(session_id)
+        if queue is not None:
+            queue.put_urgent(message)
+
+    def send_message(self, session_id: str, message: str, message_type: str = "message"):
+        self.send_json(session_id, {
+            "type": message_type,
+            "content": message,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def send_event(self, session_id: str, message: Dict[str, Any]):
+        """发送一条会话事件：记入事件日志（分配序号），断开期间产生的事件在重连时补发"""
+        self.send_json(session_id, session_manager.record_event(session_id, {
+            **message,
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def submit_request(self, session_id: str, request: str) -> int:
+        """提交旅行规划请求，返回前面还有几个请求；排队已满时抛出 RequestQueueFullError"""
+        return self.requests[session_id].submit(request)
+
+    def cancel_request(self, session_id: str, clear_pending: bool = False) -> bool:
+        """取消正在处理的请求，clear_pending 为 True 时同时丢弃排队的请求"""
+        requests = self.requests.get(session_id)
+        return requests is not None and requests.cancel(clear_pending)
+
+    async def _run_travel_request(self, session_id: str, request: str):
+        try:
+            # 发送开始状态
+            self.send_event(session_id, {
+                "type": "status", "status": "processing", "details": "开始处理您的旅行规划请求..."
+            })
+
+            # 处理请求
+            result = await session_manager.process_travel_request(session_id, request)
+
+            # 发送结果
+            self.send_event(session_id, {"type": "travel_plan", "content": result})
+
+        except AdmissionRejectedError as e:
+            self.send_event(session_id, {"type": "busy", "content": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            error_msg = f"处理请求时出错: {str(e)}"
+            LOGGER.error(f"Error in WebSocket request: {e}")
+            self.send_event(session_id, {"type": "error", "content": error_msg})
+            self.send_event(session_id, {"type": "status", "status": "error", "details": error_msg})
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接统计信息"""
+        queues = [queue.get_stats() for queue in self.queues.values()]
+        requests = [requests.get_stats() for requests in self.requests.values()]
+        return {
+            "connections": len(self.active_connections),
+            "frames": sum(q["frames"] for q in queues),
+            "deltas": sum(q["deltas"] for q in queues),
+            "queue_depth": sum(q["depth"] for q in queues),
+            "max_queue_depth": max((q["max_depth"] for q in queues), default=0),
+            "coalesced": sum(q["coalesced"] for q in queues),
+            "dropped": sum(q["dropped"] for q in queues),
+            "requests_running": sum(r["busy"] for r in requests),
+            "requests_pending": sum(r["pending"] for r in requests),
+            "awaiting_reconnect": len(self._closing),
+        }
 
 manager = ConnectionManager()
 
@@ -121,21 +251,21 @@ class UpdateProfileRequest(BaseModel):
     profile_updates: Dict[str, Any]
 
 
-# Agent 工厂函数
-def create_travel_agent() -> TravelAgent:
-    """创建旅行助手 Agent 实例"""
-    mcp_clients = []
-    
-    # 创建 MCP 客户端
-    tools = [
-        TravelMcpTools.get_baidu_maps_tool(),  # 使用百度地图
+def get_enabled_mcp_tools():
+    """获取启用的 MCP 工具配置"""
+    return [
+        # 使用百度地图（BAIDU_MAP_FAKE 为 true 时使用离线替身）
+        TravelMcpTools.get_fake_baidu_maps_tool() if BAIDU_MAP_FAKE else TravelMcpTools.get_baidu_maps_tool(),
         TravelMcpTools.get_weather_tool(),     # 天气工具
         TravelMcpTools.get_itinerary_tool()    # 行程规划工具
     ]
-    
-    for tool_info in tools:
-        mcp_client = MCPClient(**tool_info.to_common_params())
-        mcp_clients.append(mcp_client)
+
+
+# Agent 工厂函数
+def create_travel_agent() -> TravelAgent:
+    """创建旅行助手 Agent 实例"""
+    # 从共享服务器池租用 MCP 客户端，不再为每个会话启动新进程
+    mcp_clients = [mcp_server_pool.lease(tool_info) for tool_info in get_enabled_mcp_tools()]
     
     # 创建系统提示词
     system_prompt = """你是一个专业的旅行规划助手，擅长为用户制定详细的旅行计划。
@@ -158,6 +288,8 @@ def create_travel_agent() -> TravelAgent:
 - map_distance: 距离计算
 - get_current_weather: 当前天气
 - get_weather_forecast: 天气预报
+- get_weather_alerts: 天气提醒
+- get_weather_batch: 多城市批量天气预报（涉及多个城市时优先使用，一次调用替代多次 get_weather_forecast）
 - plan_itinerary: 行程规划
 - optimize_route: 路线优化
 
@@ -178,7 +310,9 @@ def create_travel_agent() -> TravelAgent:
     return TravelAgent(
         mcp_clients=mcp_clients,
         model=DEFAULT_MODEL_NAME,
-        system_prompt=system_prompt
+        system_prompt=system_prompt,
+        tool_cache=tool_result_cache,
+        geo_cache=geo_cache
     )
 
 
@@ -212,7 +346,7 @@ async def list_sessions():
 async def get_session(session_id: str):
     """获取会话信息"""
     try:
-        session_data = session_manager.get_session(session_id)
+        session_data = await session_manager.load_session(session_id)
         if not session_data:
             raise HTTPException(status_code=404, detail="Session not found")
         
@@ -228,7 +362,7 @@ async def get_session(session_id: str):
 async def delete_session(session_id: str, background_tasks: BackgroundTasks):
     """删除会话"""
     try:
-        session_data = session_manager.get_session(session_id)
+        session_data = await session_manager.load_session(session_id)
         if not session_data:
             raise HTTPException(status_code=404, detail="Session not found")
         
@@ -242,25 +376,99 @@ async def delete_session(session_id: str, background_tasks: BackgroundTasks):
 
 
 @app.post("/api/plan", response_model=Dict[str, str])
-async def plan_travel(request: TravelPlanRequest):
+async def plan_travel(request: TravelPlanRequest, http_request: Request):
     """规划旅行（REST API 方式）"""
+    task = asyncio.create_task(session_manager.process_travel_request(
+        session_id=request.session_id,
+        request=request.request
+    ))
     try:
-        result = await session_manager.process_travel_request(
-            session_id=request.session_id,
-            request=request.request
-        )
+        # 客户端断开连接后取消规划，不再继续调用 LLM 和工具
+        while not task.done():
+            await asyncio.wait({task}, timeout=1)
+            if not task.done() and await http_request.is_disconnected():
+                LOGGER.info(f"Client disconnected, cancelling travel request for session {request.session_id}")
+                task.cancel()
+        result = await task
         return {"result": result}
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         LOGGER.error(f"Error planning travel: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: TravelPlanRequest):
+    """提交后台规划任务，立即返回任务 ID"""
+    session_data = await session_manager.load_session(request.session_id)
+    if not session_data:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    try:
+        job = job_manager.submit(request.session_id, request.request)
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.job_id}",
+        "events_url": f"/api/jobs/{job.job_id}/events"
+    }
+
+
+@app.get("/api/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_job(job_id: str):
+    """查询任务状态和已生成的内容"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消任务"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"cancelled": job_manager.cancel(job_id)}
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, after: int = 0, last_event_id: Optional[str] = Header(None)):
+    """以 SSE 推送任务事件（与 WebSocket 消息格式相同），断线重连时从 Last-Event-ID 之后继续"""
+    if not job_manager.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def event_stream():
+        # 断开连接只停止推送，任务继续执行
+        async for item in job_manager.events(job_id, after):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            event_id, event = item
+            yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.put("/api/sessions/{session_id}/profile")
 async def update_profile(session_id: str, request: UpdateProfileRequest):
     """更新用户配置文件"""
     try:
+        await session_manager.load_session(session_id)
         session_manager.update_user_profile(session_id, request.profile_updates)
         return {"message": "Profile updated"}
     except ValueError as e:
@@ -274,6 +482,7 @@ async def update_profile(session_id: str, request: UpdateProfileRequest):
 async def get_chat_history(session_id: str, limit: int = 50):
     """获取聊天历史"""
     try:
+        await session_manager.load_session(session_id)
         history = session_manager.get_chat_history(session_id, limit)
         return history
     except Exception as e:
@@ -284,57 +493,73 @@ async def get_chat_history(session_id: str, limit: int = 50):
 @app.get("/api/health")
 async def health_check():
     """健康检查"""
+    mcp_status = mcp_supervisor.get_status()
     return {
-        "status": "healthy",
+        "status": "healthy" if mcp_status["ready"] else "degraded",
         "timestamp": datetime.now().isoformat(),
-        "active_sessions": len(session_manager.sessions)
+        "active_sessions": len(session_manager.sessions),
+        "mcp_ready": mcp_status["ready"],
+        "mcp_servers": mcp_status,
+        "mcp_pool": mcp_server_pool.get_stats(),
+        "tool_cache": tool_result_cache.get_stats() if tool_result_cache else None,
+        "geo_cache": geo_cache.get_stats() if geo_cache else None,
+        "plan_cache": plan_cache.get_stats() if plan_cache else None,
+        "session_store": session_manager.store.get_stats() if session_manager.store else None,
+        "event_bus": session_manager.event_bus.get_stats() if session_manager.event_bus else None,
+        "admission": session_manager.admission.get_stats(),
+        "event_log": session_manager.event_log.get_stats(),
+        "runs": session_manager.get_run_stats(),
+        "jobs": job_manager.get_stats(),
+        "websocket": manager.get_stats(),
+        "logging": LOG_WRITER.get_stats()
     }
 
 
 # WebSocket 路由
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    """WebSocket 连接端点"""
-    await manager.connect(websocket, session_id)
+async def websocket_endpoint(websocket: WebSocket, session_id: str, last_seq: Optional[int] = None):
+    """WebSocket 连接端点；重连时带上收到的最后一个事件序号 last_seq，先补发错过的事件"""
+    await manager.connect(websocket, session_id, last_seq)
     
     try:
         while True:
-            # 接收消息
+            # 接收消息（请求由工作任务处理，处理期间仍能响应心跳和取消消息）
             data = await websocket.receive_text()
             message_data = json.loads(data)
             
             if message_data.get("type") == "travel_request":
-                # 处理旅行规划请求
+                # 旅行规划请求进入队列，当前请求完成后依次处理
                 request = message_data.get("content", "")
                 if request:
                     try:
-                        # 发送开始状态
-                        await manager.send_status(session_id, "processing", "开始处理您的旅行规划请求...")
-                        
-                        # 处理请求
-                        result = await session_manager.process_travel_request(session_id, request)
-                        
-                        # 发送结果
-                        await manager.send_message(session_id, result, "travel_plan")
-                        
-                    except Exception as e:
-                        error_msg = f"处理请求时出错: {str(e)}"
-                        LOGGER.error(f"Error in WebSocket request: {e}")
-                        await manager.send_message(session_id, error_msg, "error")
-                        await manager.send_status(session_id, "error", error_msg)
+                        ahead = manager.submit_request(session_id, request)
+                    except RequestQueueFullError as e:
+                        manager.send_message(session_id, str(e), "error")
+                        continue
+                    if ahead:
+                        manager.send_json(session_id, {
+                            "type": "queued",
+                            "content": f"已加入队列，前面还有 {ahead} 个请求",
+                            "position": ahead,
+                            "timestamp": datetime.now().isoformat()
+                        })
+
+            elif message_data.get("type") == "cancel":
+                # 取消正在处理的请求，all 为 true 时同时取消排队的请求
+                manager.cancel_request(session_id, clear_pending=bool(message_data.get("all")))
             
             elif message_data.get("type") == "ping":
-                # 心跳检测
-                await websocket.send_text(json.dumps({
+                # 心跳检测：插到排队事件之前立即响应
+                manager.send_urgent(session_id, {
                     "type": "pong",
                     "timestamp": datetime.now().isoformat()
-                }))
+                })
     
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
+        await manager.disconnect(session_id, websocket)
     except Exception as e:
         LOGGER.error(f"WebSocket error for session {session_id}: {e}")
-        manager.disconnect(session_id)
+        await manager.disconnect(session_id, websocket)
 
 
 # 启动和关闭事件
@@ -348,6 +573,14 @@ async def startup_event():
     
     # 启动会话管理器
     await session_manager.start()
+    await job_manager.start()
+    if tool_result_cache:
+        await tool_result_cache.start()
+    if geo_cache:
+        await geo_cache.start()
+    
+    # 预热 MCP 服务器并启动健康检查
+    await mcp_supervisor.start(get_enabled_mcp_tools())
     
     LOGGER.success(f"Travel Assistant API started on {HOST}:{PORT}")
 
@@ -357,20 +590,34 @@ async def shutdown_event():
     """应用关闭事件"""
     LOGGER.title("SHUTTING DOWN TRAVEL ASSISTANT API")
     
-    # 停止会话管理器
+    # 取消未完成的后台任务，停止会话管理器
+    await job_manager.stop()
     await session_manager.stop()
     
+    # 停止健康检查并关闭共享的 MCP 服务器进程
+    await mcp_supervisor.stop()
+    await mcp_server_pool.shutdown()
+    
+    if tool_result_cache:
+        await tool_result_cache.close()
+    if geo_cache:
+        await geo_cache.close()
+    if plan_cache:
+        await plan_cache.close()
+    
     LOGGER.success("Travel Assistant API shutdown complete")
 
 
 # 主函数
 def main():
     """启动应用"""
+    # reload 与多 worker 不能同时使用
     uvicorn.run(
         "src.api.main:app",
         host=HOST,
         port=PORT,
-        reload=True,
+        reload=WORKERS == 1,
+        workers=WORKERS,
         log_level="info"
     )
 
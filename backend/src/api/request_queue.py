@@ -0,0 +1,108 @@
+"""
+Session Request Queue for Travel Assistant
+单个 WebSocket 连接的请求队列：接收循环只负责读取和分发消息，旅行规划请求由一个工作任务依次处理，
+处理期间心跳和取消等控制消息仍能立即响应
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from src.utils.info import WS_MAX_PENDING_REQUESTS
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[RequestQueue]")
+
+
+class RequestQueueFullError(RuntimeError):
+    """排队的后续请求已达上限"""
+
+
+class SessionRequestQueue:
+    """按提交顺序依次处理同一连接的旅行规划请求
+
+    正在处理的请求可以被取消，取消不影响之后排队的请求；
+    连接关闭时取消当前请求并丢弃排队的请求
+    """
+
+    def __init__(self, handler: Callable[[str], Awaitable[None]], max_pending: int = WS_MAX_PENDING_REQUESTS):
+        self.handler = handler
+        self.max_pending = max_pending
+        self._pending: Deque[str] = deque()
+        self._ready = asyncio.Event()
+        self._current: Optional[asyncio.Task] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.processed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    @property
+    def busy(self) -> bool:
+        return self._current is not None and not self._current.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        """启动工作任务"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+
+    def submit(self, request: str) -> int:
+        """提交请求，返回前面还有几个请求（0 表示立即开始处理）"""
+        if self.max_pending and len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise RequestQueueFullError(f"排队的请求过多（最多 {self.max_pending} 个），请等待当前请求完成")
+        ahead = len(self._pending) + (1 if self.busy else 0)
+        self._pending.append(request)
+        self._ready.set()
+        return ahead
+
+    def cancel(self, clear_pending: bool = False) -> bool:
+        """取消正在处理的请求，clear_pending 为 True 时同时丢弃排队的请求；返回是否有请求被取消"""
+        cancelled = False
+        if clear_pending and self._pending:
+            self.cancelled += len(self._pending)
+            self._pending.clear()
+            cancelled = True
+        if self.busy:
+            self._current.cancel()
+            cancelled = True
+        return cancelled
+
+    async def _work(self) -> None:
+        while True:
+            await self._ready.wait()
+            while self._pending:
+                request = self._pending.popleft()
+                self._current = asyncio.create_task(self.handler(request))
+                # 等待但不传播请求任务的取消：取消当前请求后继续处理下一个
+                await asyncio.wait({self._current})
+                if self._current.cancelled():
+                    self.cancelled += 1
+                elif self._current.exception() is not None:
+                    LOGGER.error(f"Error handling queued request: {self._current.exception()}")
+                else:
+                    self.processed += 1
+                self._current = None
+            self._ready.clear()
+
+    async def close(self) -> None:
+        """连接已断开：丢弃排队的请求，取消当前请求并停止工作任务"""
+        self._pending.clear()
+        tasks = [task for task in (self._current, self._worker) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._current = None
+        self._worker = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "busy": self.busy,
+            "pending": self.pending,
+            "processed": self.processed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
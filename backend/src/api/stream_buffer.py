@@ -0,0 +1,156 @@
+"""
+WebSocket Stream Buffer for Travel Assistant
+单个 WebSocket 连接的输出缓冲：合并同类型的流式增量，按时间间隔或字节数批量发送
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.utils.info import STREAM_FLUSH_INTERVAL_MS, STREAM_FLUSH_MAX_BYTES, STREAM_FLUSH_MAX_INTERVAL_MS
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[StreamBuffer]")
+
+# 可以合并的增量类型（数据为字符串，按顺序拼接）
+COALESCED_STREAM_TYPES = ("content", "reasoning")
+
+
+class StreamBuffer:
+    """合并流式增量的连接级输出缓冲
+
+    - 同一类型的连续增量合并为一帧，遇到其他类型或其他消息时先发送缓冲内容，保证顺序
+    - 缓冲超过 max_bytes 时立即发送，否则最多等待一个发送间隔
+    - 发送间隔随客户端的接收速度自适应：发送越慢，间隔越长、每帧越大
+    """
+
+    def __init__(
+        self,
+        send_text: Callable[[str], Awaitable[None]],
+        min_interval: float = STREAM_FLUSH_INTERVAL_MS / 1000,
+        max_interval: float = STREAM_FLUSH_MAX_INTERVAL_MS / 1000,
+        max_bytes: int = STREAM_FLUSH_MAX_BYTES,
+    ):
+        self._send_text = send_text
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.max_bytes = max_bytes
+        self.interval = min_interval
+        self._lock = asyncio.Lock()
+        self._pending: List[str] = []
+        self._pending_type: Optional[str] = None
+        self._pending_bytes = 0
+        self._pending_seq: Optional[int] = None  # 合并后的帧使用最后一个增量的序号
+        self._timer: Optional[asyncio.Task] = None
+        self._send_time = 0.0  # 单帧发送耗时的指数移动平均
+        self._closed = False
+        self.frames = 0
+        self.deltas = 0
+
+    async def push(self, stream_type: str, data: Any, seq: Optional[int] = None) -> None:
+        """写入一条流式数据"""
+        if self._closed:
+            return
+        if stream_type not in COALESCED_STREAM_TYPES or not isinstance(data, str):
+            await self.send(self._stream_frame(stream_type, data, seq))
+            return
+
+        if self._pending and self._pending_type != stream_type:
+            await self.flush()
+        self._pending_type = stream_type
+        self._pending_seq = seq
+        self._pending.append(data)
+        self._pending_bytes += len(data.encode("utf-8"))
+        self.deltas += 1
+
+        if self._pending_bytes >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        """发送一条完整消息，发送前先清空缓冲区"""
+        if self._closed:
+            return
+        async with self._lock:
+            await self._flush_pending()
+            await self._send(json.dumps(message))
+
+    async def flush(self) -> None:
+        """立即发送缓冲区中的内容"""
+        async with self._lock:
+            await self._flush_pending()
+
+    async def close(self) -> None:
+        """发送剩余内容并停止缓冲"""
+        if self._closed:
+            return
+        try:
+            await self.flush()
+        finally:
+            self.discard()
+
+    def discard(self) -> None:
+        """连接已断开时丢弃缓冲内容"""
+        self._closed = True
+        self._cancel_timer()
+        self._pending = []
+        self._pending_type = None
+        self._pending_bytes = 0
+        self._pending_seq = None
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            LOGGER.error(f"Error flushing stream buffer: {e}")
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _flush_pending(self) -> None:
+        self._cancel_timer()
+        if not self._pending:
+            return
+        stream_type, data, seq = self._pending_type, "".join(self._pending), self._pending_seq
+        self._pending = []
+        self._pending_type = None
+        self._pending_bytes = 0
+        self._pending_seq = None
+        await self._send(json.dumps(self._stream_frame(stream_type, data, seq)))
+
+    async def _send(self, text: str) -> None:
+        start = time.perf_counter()
+        await self._send_text(text)
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        # 客户端接收慢（发送阻塞在背压上）时拉长间隔，减少帧数
+        self._send_time = 0.8 * self._send_time + 0.2 * elapsed
+        self.interval = min(self.max_interval, max(self.min_interval, self._send_time * 4))
+
+    @staticmethod
+    def _stream_frame(stream_type: str, data: Any, seq: Optional[int] = None) -> Dict[str, Any]:
+        frame = {
+            "type": "stream",
+            "stream_type": stream_type,
+            "data": data,
+            "timestamp": datetime.now().isoformat()
+        }
+        if seq is not None:
+            frame["seq"] = seq
+        return frame
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓冲统计信息"""
+        return {
+            "frames": self.frames,
+            "deltas": self.deltas,
+            "pending_bytes": self._pending_bytes,
+            "interval_ms": round(self.interval * 1000, 1),
+        }
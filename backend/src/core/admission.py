@@ -0,0 +1,244 @@
+"""
+Admission Control for Travel Assistant
+请求准入控制：限制同时处理的请求数和对各上游（LLM、各 MCP 服务器）的并发调用数；
+排队的请求按会话轮转调度，队列已满或排队超时时立即拒绝并给出建议的重试时间
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from src.utils.info import (
+    ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT, LLM_MAX_CONCURRENCY, MAX_CONCURRENT_REQUESTS,
+    TOOL_UPSTREAM_CONCURRENCY, WORKERS
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[Admission]")
+
+# 当前请求所属的会话，上游限流按会话轮转
+current_session: ContextVar[str] = ContextVar("admission_session", default="")
+
+# 还没有完成过请求时用于估算重试时间的平均占用时长（秒）
+DEFAULT_HOLD_TIME = 10.0
+
+
+class AdmissionRejectedError(RuntimeError):
+    """服务繁忙：排队队列已满或排队超时"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Waiter:
+    key: str
+    future: asyncio.Future
+    on_position: Optional[Callable[[int, int], None]]
+    position: int = 0
+
+
+class FairLimiter:
+    """并发限制器：超出 limit 的调用按 key 轮转排队，同一 key 内先进先出
+
+    limit 为 0 表示不限制；max_queue 为 0 表示队列不设上限
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int = 0, queue_timeout: Optional[float] = None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        # 有排队请求的 key，按轮转顺序排列
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._hold_time = 0.0  # 单次占用时长的指数移动平均
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def acquire(
+        self, key: str = "", on_position: Optional[Callable[[int, int], None]] = None
+    ) -> AsyncIterator[None]:
+        """占用一个并发名额；排队期间通过 on_position(位置, 排队总数) 通知排队位置"""
+        await self._acquire(key, on_position)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            self._hold_time = held if not self._hold_time else 0.8 * self._hold_time + 0.2 * held
+            self._release()
+
+    def retry_after(self) -> int:
+        """估算排队请求全部开始处理所需的时间（秒）"""
+        hold_time = self._hold_time or DEFAULT_HOLD_TIME
+        return max(1, math.ceil(hold_time * (self.waiting + 1) / max(self.limit, 1)))
+
+    async def _acquire(self, key: str, on_position: Optional[Callable[[int, int], None]]) -> None:
+        if self.limit <= 0 or (self.active < self.limit and not self.waiting):
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if self.max_queue and self.waiting >= self.max_queue:
+            self.rejected += 1
+            retry_after = self.retry_after()
+            raise AdmissionRejectedError(f"服务繁忙，请 {retry_after} 秒后重试", retry_after)
+
+        waiter = _Waiter(key, asyncio.get_running_loop().create_future(), on_position)
+        self._queues.setdefault(key, deque()).append(waiter)
+        self.waiting += 1
+        self.queued += 1
+        self._notify_positions()
+        try:
+            if self.queue_timeout:
+                await asyncio.wait_for(waiter.future, self.queue_timeout)
+            else:
+                await waiter.future
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 名额已经分配给本请求，归还
+                self._release()
+            else:
+                self._remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                retry_after = self.retry_after()
+                raise AdmissionRejectedError(f"排队超时，请 {retry_after} 秒后重试", retry_after) from None
+            raise
+        self.admitted += 1
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """把空闲名额轮转分配给排队的 key"""
+        dispatched = False
+        while self._queues and self.active < self.limit:
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self.waiting -= 1
+            if waiter.future.done():
+                continue
+            waiter.future.set_result(None)
+            self.active += 1
+            dispatched = True
+        if dispatched:
+            self._notify_positions()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.key)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.key]
+        self.waiting -= 1
+        self._notify_positions()
+
+    def _notify_positions(self) -> None:
+        """按轮转顺序计算每个排队请求的位置，位置变化时通知"""
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        for depth in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if depth >= len(queue):
+                    continue
+                position += 1
+                waiter = queue[depth]
+                if waiter.position != position and waiter.on_position is not None:
+                    waiter.position = position
+                    try:
+                        waiter.on_position(position, self.waiting)
+                    except Exception as e:
+                        LOGGER.error(f"Error in queue position callback: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_hold_s": round(self._hold_time, 3),
+        }
+
+
+def per_worker(limit: int, workers: int) -> int:
+    """把所有 worker 共用的并发上限平均分给每个 worker（0 表示不限制，每个 worker 至少 1）"""
+    if limit <= 0 or workers <= 1:
+        return limit
+    return max(1, limit // workers)
+
+
+class AdmissionController:
+    """请求和上游调用的准入控制
+
+    限制器只在当前进程内计数：max_requests 和 llm_limit 是所有 worker 合计的上限，按 workers 平均分配；
+    排队上限和 MCP 服务器的并发数（每个 worker 有自己的服务器进程）按 worker 计算
+    """
+
+    def __init__(
+        self,
+        max_requests: int = MAX_CONCURRENT_REQUESTS,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        llm_limit: int = LLM_MAX_CONCURRENCY,
+        tool_limit: int = TOOL_UPSTREAM_CONCURRENCY,
+        workers: int = WORKERS,
+    ):
+        self.requests = FairLimiter("requests", per_worker(max_requests, workers), queue_size, queue_timeout)
+        self.llm_limit = per_worker(llm_limit, workers)
+        self.tool_limit = tool_limit
+        self.upstreams: Dict[str, FairLimiter] = {}
+
+    @asynccontextmanager
+    async def admit(
+        self, session_id: str, on_position: Optional[Callable[[int, int], None]] = None
+    ) -> AsyncIterator[None]:
+        """为会话的一次请求占用处理名额，队列已满时抛出 AdmissionRejectedError"""
+        async with self.requests.acquire(session_id, on_position):
+            token = current_session.set(session_id)
+            try:
+                yield
+            finally:
+                current_session.reset(token)
+
+    def upstream(self, name: str) -> FairLimiter:
+        """获取上游的限制器：llm 或 mcp:<服务器名>"""
+        limiter = self.upstreams.get(name)
+        if limiter is None:
+            limiter = FairLimiter(name, self.llm_limit if name == "llm" else self.tool_limit)
+            self.upstreams[name] = limiter
+        return limiter
+
+    def limit_upstream(self, name: str):
+        """占用一个上游调用名额，按当前会话轮转排队"""
+        return self.upstream(name).acquire(current_session.get())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests.get_stats(),
+            "upstreams": {name: limiter.get_stats() for name, limiter in self.upstreams.items()},
+        }
+
+
+# 全局准入控制实例
+admission_controller = AdmissionController()
@@ -4,6 +4,7 @@ Travel Assistant OpenAI Chat Client
 """
 
 import asyncio
+import json
 import os
 from mcp import Tool
 from openai import NOT_GIVEN, AsyncOpenAI
@@ -18,8 +19,10 @@ import dotenv
 from pydantic import BaseModel
 from rich import print as rprint
 
+from src.core.admission import admission_controller
+from src.core.context_compactor import CompactionReport, ConversationCompactor, estimate_text_tokens
 from src.utils import pretty
-from src.utils.info import DEFAULT_MODEL_NAME, OPENAI_API_KEY, OPENAI_BASE_URL
+from src.utils.info import DEFAULT_MODEL_NAME, LLM_STREAM_USAGE, OPENAI_API_KEY, OPENAI_BASE_URL
 
 LOGGER = pretty.ALogger("[ChatOpenAI]")
 
@@ -49,8 +52,18 @@ class AsyncChatOpenAI:
 
     system_prompt: str = ""
     context: str = ""
+    compactor: ConversationCompactor | None = field(default_factory=ConversationCompactor)
 
     llm: AsyncOpenAI = field(init=False)
+    last_compaction: CompactionReport | None = field(default=None, init=False)
+    last_usage: dict | None = field(default=None, init=False)
+    usage_totals: dict = field(default_factory=dict, init=False)
+    interrupted_chats: int = field(default=0, init=False)  # 被取消的 LLM 请求数（含排队中的）
+    _pinned_messages: int = field(default=0, init=False)
+    _context_index: int | None = field(default=None, init=False)
+    _tools_source: list[Tool] | None = field(default=None, init=False, repr=False)
+    _tools_definition: list[ChatCompletionToolParam] | None = field(default=None, init=False, repr=False)
+    _tools_tokens: int = field(default=0, init=False, repr=False)
 
     def __post_init__(self) -> None:
         # API 配置
@@ -69,40 +82,68 @@ class AsyncChatOpenAI:
         if self.system_prompt:
             self.messages.insert(0, {"role": "system", "content": self.system_prompt})
         if self.context:
+            self._context_index = len(self.messages)
             self.messages.append({"role": "user", "content": self.context})
+        # 系统提示和上下文不参与压缩
+        self._pinned_messages = len(self.messages)
+
+    def set_context(self, context: str) -> None:
+        """更新固定上下文；内容不变时不修改消息，保持请求前缀稳定"""
+        if context == self.context:
+            return
+        self.context = context
+        if self._context_index is None:
+            # 首次设置时插入到系统提示之后，成为固定前缀的一部分
+            self._context_index = 1 if self.messages and self.messages[0].get("role") == "system" else 0
+            self.messages.insert(self._context_index, {"role": "user", "content": context})
+            self._pinned_messages += 1
+        else:
+            self.messages[self._context_index] = {"role": "user", "content": context}
 
     async def chat(
         self, prompt: str = "", print_llm_output: bool = True,
-        stream_callback: callable = None, tool_call_callback: callable = None
+        stream_callback: callable = None, tool_call_callback: callable = None,
+        volatile_context: str = ""
     ) -> ChatOpenAIChatResponse:
         """发起聊天对话"""
         try:
-            return await self._chat(prompt, print_llm_output, stream_callback, tool_call_callback)
+            return await self._chat(prompt, print_llm_output, stream_callback, tool_call_callback, volatile_context)
+        except asyncio.CancelledError:
+            # 退出 stream 上下文时关闭 HTTP 连接，上游停止生成
+            self.interrupted_chats += 1
+            raise
         except Exception as e:
             LOGGER.error(f"Error during chat: {e}")
             raise
 
     async def _chat(
         self, prompt: str = "", print_llm_output: bool = True,
-        stream_callback: callable = None, tool_call_callback: callable = None
+        stream_callback: callable = None, tool_call_callback: callable = None,
+        volatile_context: str = ""
     ) -> ChatOpenAIChatResponse:
         LOGGER.title("CHAT")
         if prompt:
-            self.messages.append({"role": "user", "content": prompt})
+            # 时间等易变的上下文放在本轮用户消息中，不破坏前面的缓存前缀
+            user_content = f"{volatile_context.strip()}\n\n{prompt}" if volatile_context else prompt
+            self.messages.append({"role": "user", "content": user_content})
             LOGGER.info(f"User: {prompt}")
         content = ""
         tool_calls: list[ToolCall] = []
         printed_llm_output = False
         param_tools = self.get_tools_definition() or NOT_GIVEN
-        
-        async with await self.llm.chat.completions.create(
-            model=self.model,
-            messages=self.messages,
-            tools=param_tools,
-            stream=True,
-        ) as stream:
+        self.compact_messages(self._tools_tokens)
+
+        # 上游流由单独的任务在 LLM 名额内读取，回调（可能因客户端背压而等待）在名额之外执行
+        chunks: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(param_tools, chunks))
+        try:
             LOGGER.title("RESPONSE")
-            async for chunk in stream:
+            while (chunk := await chunks.get()) is not None:
+                if chunk.usage:
+                    self._record_usage(chunk.usage)
+                # 开启 include_usage 后最后一个 chunk 没有 choices
+                if not chunk.choices:
+                    continue
                 delta = chunk.choices[0].delta
                 # LOGGER.info(f"Delta: {delta}")
                 
@@ -148,7 +189,14 @@ class AsyncChatOpenAI:
                                     "arguments": tool_call.function.arguments if tool_call.function else None
                                 }
                             })
-        
+            # 读取任务出错时在这里抛出
+            await reader
+        finally:
+            if not reader.done():
+                # 取消时关闭上游 HTTP 连接，上游停止生成
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+
         if printed_llm_output:
             print()
             
@@ -175,19 +223,88 @@ class AsyncChatOpenAI:
             tool_calls=tool_calls,
         )
 
+    async def _read_stream(self, tools, chunks: asyncio.Queue) -> None:
+        """占用 LLM 名额打开并读完上游流，数据块放入 chunks（以 None 结束），读完即释放名额"""
+        try:
+            # 同时进行的 LLM 请求数受全局上限约束，多个会话之间轮转排队
+            async with admission_controller.limit_upstream("llm"):
+                async with await self.llm.chat.completions.create(
+                    model=self.model,
+                    messages=self.messages,
+                    tools=tools,
+                    stream=True,
+                    stream_options={"include_usage": True} if LLM_STREAM_USAGE else NOT_GIVEN,
+                ) as stream:
+                    async for chunk in stream:
+                        chunks.put_nowait(chunk)
+        finally:
+            chunks.put_nowait(None)
+
+    def set_tools(self, tools: list[Tool]) -> None:
+        """更新工具列表，工具集合变化时才重新生成工具定义"""
+        if self._tools_signature(tools) != self._tools_signature(self.tools):
+            self._tools_definition = None
+        self.tools = tools
+        self._tools_source = tools
+
+    @staticmethod
+    def _tools_signature(tools: list[Tool]) -> list[tuple]:
+        return sorted((t.name, t.description, json.dumps(t.inputSchema, sort_keys=True)) for t in tools)
+
     def get_tools_definition(self) -> list[ChatCompletionToolParam]:
-        """获取工具定义"""
-        return [
-            ChatCompletionToolParam(
-                type="function",
-                function=FunctionDefinition(
-                    name=t.name,
-                    description=t.description,
-                    parameters=t.inputSchema,
-                ),
+        """获取工具定义（按名称排序并缓存，保证每次请求的字节完全一致）"""
+        if self._tools_definition is None or self._tools_source is not self.tools:
+            self._tools_definition = [
+                ChatCompletionToolParam(
+                    type="function",
+                    function=FunctionDefinition(
+                        name=t.name,
+                        description=t.description,
+                        parameters=json.loads(json.dumps(t.inputSchema, sort_keys=True)),
+                    ),
+                )
+                for t in sorted(self.tools, key=lambda t: t.name)
+            ]
+            self._tools_source = self.tools
+            self._tools_tokens = sum(
+                estimate_text_tokens(f"{t.name}{t.description or ''}{json.dumps(t.inputSchema, ensure_ascii=False)}")
+                for t in self.tools
+            )
+        return self._tools_definition
+
+    def _record_usage(self, usage) -> None:
+        """记录 token 用量和提示缓存命中情况"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        self.last_usage = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": cached_tokens,
+        }
+        for key, value in self.last_usage.items():
+            self.usage_totals[key] = self.usage_totals.get(key, 0) + (value or 0)
+        self.usage_totals["requests"] = self.usage_totals.get("requests", 0) + 1
+        hit_rate = cached_tokens / usage.prompt_tokens if usage.prompt_tokens else 0.0
+        LOGGER.info(
+            f"Usage: prompt {usage.prompt_tokens} (cached {cached_tokens}, {hit_rate:.0%}), "
+            f"completion {usage.completion_tokens}"
+        )
+
+    def compact_messages(self, reserved_tokens: int = 0) -> CompactionReport | None:
+        """按 token 预算压缩消息历史，并记录压缩前后的 token 估算（reserved_tokens 为工具定义等固定开销）"""
+        if self.compactor is None:
+            return None
+        report = self.compactor.compact(self.messages, pinned=self._pinned_messages, reserved_tokens=reserved_tokens)
+        self.last_compaction = report
+        if report.changed:
+            LOGGER.info(
+                f"Prompt tokens (estimated): {report.tokens_before} -> {report.tokens_after} "
+                f"(superseded {report.superseded}, summarized {report.summarized}, "
+                f"dropped {report.dropped_turns} turn(s))"
             )
-            for t in self.tools
-        ]
+        else:
+            LOGGER.info(f"Prompt tokens (estimated): {report.tokens_before}")
+        return report
 
     def append_tool_result(self, tool_call_id: str, tool_output: str) -> None:
         """添加工具调用结果到消息历史"""
@@ -199,6 +316,22 @@ class AsyncChatOpenAI:
             }
         )
 
+    def repair_tool_calls(self, placeholder: str) -> int:
+        """为最后一轮中缺少结果的工具调用补上占位结果，保证 tool_calls 与 tool 消息成对，返回补齐的数量"""
+        for index in range(len(self.messages) - 1, -1, -1):
+            message = self.messages[index]
+            if message.get("role") == "user":
+                break
+            if message.get("role") == "assistant" and message.get("tool_calls"):
+                answered = {
+                    m.get("tool_call_id") for m in self.messages[index + 1:] if m.get("role") == "tool"
+                }
+                missing = [tc["id"] for tc in message["tool_calls"] if tc["id"] not in answered]
+                for tool_call_id in missing:
+                    self.append_tool_result(tool_call_id, placeholder)
+                return len(missing)
+        return 0
+
     def get_message_history(self) -> list[ChatCompletionMessageParam]:
         """获取消息历史"""
         return self.messages.copy()
@@ -0,0 +1,210 @@
+"""
+Conversation Compactor for Travel Assistant
+按 token 预算压缩对话历史：保留系统提示和最近几轮对话原文，
+依次标记被取代的工具结果、精简较早的工具输出、丢弃最早的完整轮次，
+始终保证 assistant.tool_calls 与 tool 消息成对出现
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from src.utils.info import CONTEXT_KEEP_RECENT_TURNS, CONTEXT_TOKEN_BUDGET, CONTEXT_TOOL_OUTPUT_MAX_CHARS
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[Compactor]")
+
+MESSAGE_OVERHEAD_TOKENS = 4
+SUPERSEDED_PLACEHOLDER = "[该工具结果已被后续相同调用的结果取代]"
+TRUNCATED_SUFFIX = "…[已截断 {} 字符]"
+TRUNCATED_SUFFIX_MAX_CHARS = 24  # 截断后的内容允许超出上限的长度，避免重复截断
+
+
+def estimate_text_tokens(text: str) -> int:
+    """粗略估算 token 数：非 ASCII 字符（主要是中文）按 1 个 token，其余按 4 个字符 1 个 token"""
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """估算单条消息的 token 数"""
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += estimate_text_tokens(content)
+    elif isinstance(content, list):
+        tokens += sum(estimate_text_tokens(part.get("text", "")) for part in content if isinstance(part, dict))
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        tokens += estimate_text_tokens(function.get("name", "")) + estimate_text_tokens(function.get("arguments", ""))
+    return tokens
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """估算消息列表的 token 数"""
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def summarize_tool_output(content: str, max_chars: int) -> str:
+    """精简工具输出：提取 CallToolResult 中的文本、压缩 JSON 空白，仍然过长时截断"""
+    text = content
+    try:
+        envelope = json.loads(content)
+        if isinstance(envelope, dict) and isinstance(envelope.get("content"), list):
+            text = "\n".join(
+                part.get("text", "") for part in envelope["content"] if isinstance(part, dict)
+            )
+            if envelope.get("isError"):
+                text = f"[error] {text}"
+    except ValueError:
+        pass
+
+    try:
+        text = json.dumps(json.loads(text), ensure_ascii=False, separators=(",", ":"))
+    except ValueError:
+        pass
+
+    if len(text) > max_chars:
+        text = text[:max_chars] + TRUNCATED_SUFFIX.format(len(text) - max_chars)
+    return text
+
+
+@dataclass
+class CompactionReport:
+    """单次压缩的结果"""
+    tokens_before: int = 0
+    tokens_after: int = 0
+    superseded: int = 0
+    summarized: int = 0
+    dropped_turns: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.superseded or self.summarized or self.dropped_turns)
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "superseded": self.superseded,
+            "summarized": self.summarized,
+            "dropped_turns": self.dropped_turns,
+        }
+
+
+class ConversationCompactor:
+    """按 token 预算原地压缩消息历史"""
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        keep_recent_turns: int = CONTEXT_KEEP_RECENT_TURNS,
+        tool_output_max_chars: int = CONTEXT_TOOL_OUTPUT_MAX_CHARS,
+    ):
+        self.token_budget = token_budget
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.tool_output_max_chars = tool_output_max_chars
+
+    def compact(
+        self, messages: List[Dict[str, Any]], pinned: int = 0, reserved_tokens: int = 0
+    ) -> CompactionReport:
+        """压缩 messages（原地修改）
+
+        pinned: 开头固定保留的消息数（系统提示、上下文）
+        reserved_tokens: 预算中留给工具定义等固定内容的 token 数
+        """
+        report = CompactionReport(tokens_before=estimate_tokens(messages) + reserved_tokens)
+        report.tokens_after = report.tokens_before
+        if self.token_budget <= 0 or report.tokens_before <= self.token_budget:
+            return report
+
+        turn_starts = [
+            i for i in range(pinned, len(messages)) if messages[i].get("role") == "user"
+        ]
+        if not turn_starts:
+            return report
+        # 最近几轮保持原文
+        recent_start = turn_starts[-min(self.keep_recent_turns, len(turn_starts))]
+
+        # 1. 标记被后续相同调用取代的工具结果
+        report.superseded = self._mark_superseded(messages, pinned, recent_start)
+
+        # 2. 精简较早的工具输出
+        tokens = estimate_tokens(messages) + reserved_tokens
+        if tokens > self.token_budget:
+            report.summarized = self._summarize_tool_outputs(messages, pinned, recent_start)
+            tokens = estimate_tokens(messages) + reserved_tokens
+
+        # 3. 从最早的轮次开始整轮丢弃（整轮删除不会破坏工具调用配对）
+        while tokens > self.token_budget:
+            turn_starts = [
+                i for i in range(pinned, len(messages)) if messages[i].get("role") == "user"
+            ]
+            if len(turn_starts) <= self.keep_recent_turns:
+                break
+            dropped = messages[turn_starts[0]:turn_starts[1]]
+            del messages[turn_starts[0]:turn_starts[1]]
+            tokens -= estimate_tokens(dropped)
+            report.dropped_turns += 1
+
+        # 4. 仍然超出预算时，精简除当前轮以外的最近几轮的工具输出
+        if tokens > self.token_budget:
+            turn_starts = [
+                i for i in range(pinned, len(messages)) if messages[i].get("role") == "user"
+            ]
+            report.summarized += self._summarize_tool_outputs(messages, pinned, turn_starts[-1])
+            tokens = estimate_tokens(messages) + reserved_tokens
+
+        report.tokens_after = tokens
+        if tokens > self.token_budget:
+            LOGGER.warning(
+                f"Current turn alone exceeds the token budget "
+                f"({tokens} > {self.token_budget})"
+            )
+        return report
+
+    @staticmethod
+    def _mark_superseded(messages: List[Dict[str, Any]], start: int, end: int) -> int:
+        """把 [start, end) 范围内、之后有相同工具和参数调用的工具结果替换为占位符"""
+        calls: Dict[str, Tuple[str, str]] = {}
+        latest: Dict[Tuple[str, str], str] = {}
+        for message in messages:
+            for tool_call in message.get("tool_calls") or []:
+                function = tool_call.get("function", {})
+                signature = (function.get("name", ""), _normalize_arguments(function.get("arguments", "")))
+                calls[tool_call.get("id", "")] = signature
+                latest[signature] = tool_call.get("id", "")
+
+        superseded = 0
+        for message in messages[start:end]:
+            if message.get("role") != "tool" or message.get("content") == SUPERSEDED_PLACEHOLDER:
+                continue
+            tool_call_id = message.get("tool_call_id", "")
+            signature = calls.get(tool_call_id)
+            if signature is not None and latest.get(signature) != tool_call_id:
+                message["content"] = SUPERSEDED_PLACEHOLDER
+                superseded += 1
+        return superseded
+
+    def _summarize_tool_outputs(self, messages: List[Dict[str, Any]], start: int, end: int) -> int:
+        """精简 [start, end) 范围内过长的工具输出"""
+        summarized = 0
+        for message in messages[start:end]:
+            if message.get("role") != "tool":
+                continue
+            content = message.get("content")
+            if not isinstance(content, str) or len(content) <= self.tool_output_max_chars + TRUNCATED_SUFFIX_MAX_CHARS:
+                continue
+            message["content"] = summarize_tool_output(content, self.tool_output_max_chars)
+            summarized += 1
+        return summarized
+
+
+def _normalize_arguments(arguments: str) -> str:
+    """参数按键排序，使等价的调用得到相同的签名"""
+    try:
+        return json.dumps(json.loads(arguments or "{}"), ensure_ascii=False, sort_keys=True)
+    except ValueError:
+        return arguments
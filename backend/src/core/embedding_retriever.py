@@ -0,0 +1,71 @@
+"""
+Embedding Retriever for Travel Assistant
+文本向量化与检索（移植自 augmented.embedding_retriever），复用 HTTP 连接
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+
+from src.core.vector_store import VectorStore, VectorStoreItem
+from src.utils.info import EMBEDDING_BASE_URL, EMBEDDING_KEY, EMBEDDING_TIMEOUT
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[Embedding]")
+
+
+@dataclass
+class EembeddingRetriever:
+    embedding_model: str
+    vector_store: VectorStore = field(default_factory=VectorStore)
+    _client: Optional[httpx.AsyncClient] = field(default=None, init=False, repr=False)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=EMBEDDING_BASE_URL,
+                headers={
+                    "Authorization": f"Bearer {EMBEDDING_KEY}",
+                    "Content-Type": "application/json",
+                },
+                timeout=EMBEDDING_TIMEOUT,
+            )
+        return self._client
+
+    async def _embed(self, text: str) -> list[float] | None:
+        data = {
+            "model": self.embedding_model,
+            "input": text,
+            "encoding_format": "float",
+        }
+        try:
+            response = await self._get_client().post("/embeddings", json=data)
+            response.raise_for_status()
+            return response.json()["data"][0]["embedding"]
+        except httpx.HTTPStatusError as http_err:
+            LOGGER.error(f"Embedding request failed: HTTP {http_err.response.status_code}")
+        except Exception as err:
+            LOGGER.error(f"Embedding request failed: {err!r}")
+        return None
+
+    async def embed_query(self, query: str) -> list[float] | None:
+        result = await self._embed(query)
+        return result
+
+    async def embed_documents(self, document: str, metadata: Optional[dict] = None) -> list[float] | None:
+        result = await self._embed(document)
+        if result is not None:
+            self.vector_store.add(VectorStoreItem(embedding=result, document=document, metadata=metadata or {}))
+        return result
+
+    async def retrieve(self, query: str, top_k: int = 5) -> list[VectorStoreItem]:
+        query_embedding = await self.embed_query(query)
+        if query_embedding is None:
+            return []
+        return self.vector_store.search(query_embedding, top_k)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
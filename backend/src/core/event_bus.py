@@ -0,0 +1,279 @@
+"""
+Event Bus for Travel Assistant
+多 worker 之间的会话事件总线：事件写入共享的 SQLite 数据库，各 worker 轮询读取其他 worker 发布的事件；
+同时记录 worker 心跳和会话归属，用于粘性会话模式下把请求转发给所属 worker
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.utils.info import (
+    EVENT_BUS, EVENT_BUS_DB_PATH, EVENT_BUS_POLL_INTERVAL_MS, EVENT_BUS_RETENTION, WORKER_HEARTBEAT_INTERVAL
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[EventBus]")
+
+# (session_id, kind, payload)
+EventHandler = Callable[[str, str, Dict[str, Any]], Awaitable[None]]
+
+
+class EventBus(ABC):
+    """会话事件总线接口
+
+    publish 只入队，不等待写入；本 worker 发布的事件不会投递给自己
+    """
+
+    worker_id: str
+
+    @abstractmethod
+    def set_handler(self, handler: EventHandler) -> None:
+        """设置接收其他 worker 事件的处理函数；处理函数应尽快返回，不等待客户端"""
+
+    async def start(self) -> None:
+        """启动后台轮询任务"""
+
+    @abstractmethod
+    def publish(self, session_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        """发布一条会话事件"""
+
+    async def claim(self, session_id: str) -> str:
+        """获取会话的所属 worker；没有存活的所属 worker 时由当前 worker 接管"""
+        return self.worker_id
+
+    async def flush(self) -> None:
+        """立即写入队列中的事件"""
+
+    async def close(self) -> None:
+        """停止轮询并注销当前 worker"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class SQLiteEventBus(EventBus):
+    """基于 SQLite 轮询的事件总线，适用于同一台机器上的多个 worker
+
+    数据库在 start 时打开，之前发布的事件留在队列中
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        worker_id: Optional[str] = None,
+        poll_interval: float = EVENT_BUS_POLL_INTERVAL_MS / 1000,
+        retention: float = EVENT_BUS_RETENTION,
+        heartbeat_interval: float = WORKER_HEARTBEAT_INTERVAL,
+    ):
+        self.db_path = db_path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._handler: Optional[EventHandler] = None
+        self._pending: List[Tuple[str, str, str, str, float]] = []
+        self._last_id = 0
+        self._last_prune = 0.0
+        self._poll_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.published = 0
+        self.received = 0
+        self.handler_errors = 0
+
+    def _open_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # 事件只用于实时转发，不需要每次提交都 fsync
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, origin TEXT NOT NULL, "
+            "kind TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_owners (session_id TEXT PRIMARY KEY, worker_id TEXT NOT NULL)"
+        )
+        db.commit()
+        return db
+
+    def set_handler(self, handler: EventHandler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        if self._poll_task is not None:
+            return
+        if self._db is None:
+            self._db = await asyncio.to_thread(self._open_db)
+        # 只接收启动之后发布的事件
+        self._last_id = await asyncio.to_thread(self._db_max_id)
+        await asyncio.to_thread(self._db_heartbeat)
+        self._poll_task = asyncio.create_task(self._poll_loop())
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        LOGGER.info(f"Event bus started: worker {self.worker_id}, {self.db_path}")
+
+    def publish(self, session_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        self._pending.append(
+            (session_id, self.worker_id, kind, json.dumps(payload, ensure_ascii=False, default=str), time.time())
+        )
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.poll_interval)
+                await self.flush()
+                await self._receive()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error in event bus poll loop: {e}")
+
+    async def _heartbeat_loop(self) -> None:
+        """独立于轮询任务更新心跳：事件处理变慢时其他 worker 不会误判本 worker 已退出"""
+        while True:
+            try:
+                await asyncio.sleep(self.heartbeat_interval)
+                await asyncio.to_thread(self._db_heartbeat)
+                now = time.time()
+                if now - self._last_prune >= self.retention:
+                    self._last_prune = now
+                    await asyncio.to_thread(self._db_prune, now - self.retention)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error in event bus heartbeat loop: {e}")
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if self._db is None or not self._pending:
+                return
+            events, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._db_insert, events)
+            except Exception:
+                self._pending[:0] = events
+                raise
+            self.published += len(events)
+
+    async def _receive(self) -> None:
+        rows = await asyncio.to_thread(self._db_fetch, self._last_id)
+        for event_id, session_id, kind, payload in rows:
+            self._last_id = event_id
+            self.received += 1
+            if self._handler is None:
+                continue
+            # 按发布顺序逐条处理，保证同一会话的流式增量有序；处理函数不能等待客户端，否则会阻塞所有会话
+            try:
+                await self._handler(session_id, kind, json.loads(payload))
+            except Exception as e:
+                self.handler_errors += 1
+                LOGGER.error(f"Error handling {kind} event for session {session_id}: {e}")
+
+    async def claim(self, session_id: str) -> str:
+        if self._db is None:
+            return self.worker_id
+        return await asyncio.to_thread(self._db_claim, session_id)
+
+    def _db_max_id(self) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def _db_insert(self, events: List[Tuple[str, str, str, str, float]]) -> None:
+        with self._db_lock, self._db:
+            self._db.executemany(
+                "INSERT INTO events (session_id, origin, kind, payload, created_at) VALUES (?, ?, ?, ?, ?)", events
+            )
+
+    def _db_fetch(self, after_id: int) -> List[Tuple[int, str, str, str]]:
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT id, session_id, kind, payload FROM events WHERE id > ? AND origin != ? ORDER BY id",
+                (after_id, self.worker_id),
+            ).fetchall()
+
+    def _db_heartbeat(self) -> None:
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)", (self.worker_id, time.time())
+            )
+
+    def _db_prune(self, before: float) -> None:
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM events WHERE created_at < ?", (before,))
+            self._db.execute(
+                "DELETE FROM workers WHERE heartbeat < ?", (time.time() - 3 * self.heartbeat_interval,)
+            )
+
+    def _db_claim(self, session_id: str) -> str:
+        alive_since = time.time() - 3 * self.heartbeat_interval
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO session_owners (session_id, worker_id) VALUES (?, ?)",
+                (session_id, self.worker_id),
+            )
+            # 所属 worker 已退出时接管会话
+            self._db.execute(
+                "UPDATE session_owners SET worker_id = ? WHERE session_id = ? AND worker_id NOT IN "
+                "(SELECT worker_id FROM workers WHERE heartbeat >= ?)",
+                (self.worker_id, session_id, alive_since),
+            )
+            return self._db.execute(
+                "SELECT worker_id FROM session_owners WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def _db_unregister(self) -> None:
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+            self._db.execute("DELETE FROM session_owners WHERE worker_id = ?", (self.worker_id,))
+
+    async def close(self) -> None:
+        tasks = [task for task in (self._poll_task, self._heartbeat_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._poll_task = None
+        self._heartbeat_task = None
+        if self._db is None:
+            return
+        try:
+            await self.flush()
+            # 注销后其他 worker 可以立即接管本 worker 的会话
+            await asyncio.to_thread(self._db_unregister)
+        except Exception as e:
+            LOGGER.error(f"Failed to unregister worker {self.worker_id}: {e}")
+        with self._db_lock:
+            self._db.close()
+        self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "worker_id": self.worker_id,
+            "pending": len(self._pending),
+            "published": self.published,
+            "received": self.received,
+            "handler_errors": self.handler_errors,
+        }
+
+
+def create_event_bus(kind: str = EVENT_BUS) -> Optional[EventBus]:
+    """按配置创建事件总线，none 表示单进程运行"""
+    if kind == "sqlite":
+        return SQLiteEventBus(EVENT_BUS_DB_PATH)
+    if kind != "none":
+        LOGGER.warning(f"Unknown event bus {kind!r}, events will not be shared between workers")
+    return None
+
+
+# 全局事件总线实例
+event_bus = create_event_bus()
@@ -0,0 +1,234 @@
+"""
+Session Event Log for Travel Assistant
+会话事件日志：每个会话的状态、流式数据和结果事件带有递增序号，最近的事件保存在内存环形缓冲区中，
+被挤出缓冲区的较早事件写入磁盘；客户端重连时按 last_seq 补发缺失的事件
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from src.utils.info import EVENT_REPLAY_BUFFER, EVENT_SPILL, EVENT_SPILL_MAX_EVENTS, MAX_SESSIONS
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[EventLog]")
+
+# 溢出事件批量写入磁盘的间隔（秒）
+SPILL_FLUSH_INTERVAL = 1.0
+
+
+class _SessionLog:
+    """单个会话的事件缓冲"""
+
+    __slots__ = ("events", "next_seq", "disk_first")
+
+    def __init__(self):
+        self.events: Deque[Dict[str, Any]] = deque()
+        self.next_seq = 1
+        self.disk_first = 0  # 磁盘上仍保留的最早序号，0 表示没有溢出过
+
+    def first_seq(self) -> int:
+        return self.events[0]["seq"] if self.events else self.next_seq
+
+
+class EventLog:
+    """按会话记录事件的环形缓冲区
+
+    - record 为事件分配序号并写入缓冲区：同一会话的序号在本进程内连续递增；
+      其他 worker 转发的事件只在原序号正好是下一个序号时沿用，否则（本 worker 已为其他事件分配过该序号）重新编号
+    - 缓冲区超过 capacity 时最早的事件溢出到临时 SQLite 文件，每个会话最多保留 spill_max 个
+    - 最多保留 max_sessions 个会话的日志，超出时丢弃最久没有事件的会话
+    - 溢出文件只属于当前进程，重启后序号从头开始，客户端需要重新同步
+    """
+
+    def __init__(
+        self,
+        capacity: int = EVENT_REPLAY_BUFFER,
+        spill: bool = EVENT_SPILL,
+        spill_max: int = EVENT_SPILL_MAX_EVENTS,
+        max_sessions: int = MAX_SESSIONS,
+    ):
+        self.capacity = max(1, capacity)
+        self.spill = spill
+        self.spill_max = spill_max
+        self.max_sessions = max(1, max_sessions)
+        self._logs: "OrderedDict[str, _SessionLog]" = OrderedDict()
+        self._pending: List[Tuple[str, int, str]] = []
+        self._dropped_sessions: set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path: Optional[str] = None
+        self._db_lock = threading.Lock()
+        self.recorded = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.gaps = 0
+        self.renumbered = 0
+
+    async def start(self) -> None:
+        if not self.spill or self._writer_task is not None:
+            return
+        fd, self._db_path = tempfile.mkstemp(prefix="event_log_", suffix=".db")
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+        # 临时文件只用于补发，不需要 fsync
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE events (session_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, seq))"
+        )
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    def record(self, session_id: str, event: Dict[str, Any], seq: Optional[int] = None) -> Dict[str, Any]:
+        """记录一条事件，返回带 seq 的事件"""
+        log = self._logs.get(session_id)
+        if log is None:
+            if len(self._logs) >= self.max_sessions:
+                self.drop(next(iter(self._logs)))
+            log = self._logs[session_id] = _SessionLog()
+        else:
+            self._logs.move_to_end(session_id)
+        if seq is not None and seq != log.next_seq:
+            # 序号由多个 worker 分别分配时会重复或跳跃，按本地顺序重新编号，保证补发不遗漏
+            self.renumbered += 1
+        seq = log.next_seq
+        log.next_seq += 1
+        event = {**event, "seq": seq}
+
+        if len(log.events) >= self.capacity:
+            evicted = log.events.popleft()
+            if self._db is not None:
+                self._pending.append((session_id, evicted["seq"], json.dumps(evicted, ensure_ascii=False)))
+                if not log.disk_first:
+                    log.disk_first = evicted["seq"]
+                # 超出磁盘保留数量的事件视为已丢弃
+                log.disk_first = max(log.disk_first, evicted["seq"] - self.spill_max + 1)
+        log.events.append(event)
+        self.recorded += 1
+        return event
+
+    def last_seq(self, session_id: str) -> int:
+        """会话最近一条事件的序号，没有事件时为 0"""
+        log = self._logs.get(session_id)
+        return log.next_seq - 1 if log else 0
+
+    async def since(self, session_id: str, last_seq: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """返回序号大于 last_seq 的事件和是否完整（中间没有缺失）
+
+        最后一部分事件从内存中同步读取：调用方在返回后不 await 就注册实时回调时，补发与实时事件之间没有遗漏
+        """
+        log = self._logs.get(session_id)
+        if log is None:
+            return [], last_seq <= 0
+        if last_seq >= log.next_seq:
+            # 序号比当前记录的还大：服务已重启，序号重新开始
+            self.gaps += 1
+            return [], False
+
+        events: List[Dict[str, Any]] = []
+        cursor = last_seq
+        complete = True
+        while cursor + 1 < log.first_seq():
+            if self._db is None or not log.disk_first or cursor + 1 < log.disk_first:
+                complete = False
+                break
+            # 读取磁盘期间内存中的事件可能继续溢出，读完后重新检查
+            upper = log.first_seq()
+            await self.flush()
+            rows = await asyncio.to_thread(self._db_range, session_id, cursor, upper)
+            if not rows:
+                complete = False
+                break
+            if rows[0]["seq"] > cursor + 1:
+                complete = False
+            events.extend(rows)
+            cursor = rows[-1]["seq"]
+        if not complete:
+            self.gaps += 1
+        events.extend(event for event in log.events if event["seq"] > cursor)
+        self.replayed += len(events)
+        return events, complete
+
+    def drop(self, session_id: str) -> None:
+        """会话已删除或移出内存"""
+        log = self._logs.pop(session_id, None)
+        if log is not None and log.disk_first:
+            self._pending = [item for item in self._pending if item[0] != session_id]
+            self._dropped_sessions.add(session_id)
+
+    async def _writer_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(SPILL_FLUSH_INTERVAL)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error spilling events to disk: {e}")
+
+    async def flush(self) -> None:
+        """把溢出的事件写入磁盘"""
+        async with self._flush_lock:
+            if self._db is None or not (self._pending or self._dropped_sessions):
+                return
+            pending, self._pending = self._pending, []
+            dropped, self._dropped_sessions = self._dropped_sessions, set()
+            trim = {
+                session_id: log.disk_first
+                for session_id, log in self._logs.items() if log.disk_first and session_id not in dropped
+            }
+            await asyncio.to_thread(self._db_write, pending, dropped, trim)
+            self.spilled += len(pending)
+
+    def _db_write(self, pending: List[Tuple[str, int, str]], dropped: set[str], trim: Dict[str, int]) -> None:
+        with self._db_lock, self._db:
+            for session_id in dropped:
+                self._db.execute("DELETE FROM events WHERE session_id = ?", (session_id,))
+            self._db.executemany("INSERT OR REPLACE INTO events (session_id, seq, event) VALUES (?, ?, ?)", pending)
+            for session_id in {session_id for session_id, _, _ in pending} & trim.keys():
+                self._db.execute(
+                    "DELETE FROM events WHERE session_id = ? AND seq < ?", (session_id, trim[session_id])
+                )
+
+    def _db_range(self, session_id: str, after: int, before: int) -> List[Dict[str, Any]]:
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT event FROM events WHERE session_id = ? AND seq > ? AND seq < ? ORDER BY seq",
+                (session_id, after, before),
+            ).fetchall()
+        return [json.loads(event) for (event,) in rows]
+
+    async def close(self) -> None:
+        if self._writer_task:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+            try:
+                os.remove(self._db_path)
+            except OSError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._logs),
+            "buffered": sum(len(log.events) for log in self._logs.values()),
+            "recorded": self.recorded,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "gaps": self.gaps,
+            "renumbered": self.renumbered,
+        }
+
+
+# 全局会话事件日志实例
+event_log = EventLog()
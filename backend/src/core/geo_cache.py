@@ -0,0 +1,356 @@
+"""
+Geo Cache for Travel Assistant
+百度地图地理编码 / 地点检索结果的 SQLite 持久缓存：
+规范化地址作为键，经纬度建索引，过期条目先返回旧值再后台刷新（stale-while-revalidate）；
+条目按数据来源（真实接口 / 离线替身）区分，替身生成的数据不会被当作真实结果返回
+"""
+
+import asyncio
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from mcp.types import CallToolResult
+
+from src.utils.info import (
+    BAIDU_MAP_FAKE, GEO_CACHE_DB_PATH, GEO_CACHE_ENABLED, GEO_CACHE_GEOCODE_TTL, GEO_CACHE_PLACE_TTL,
+    GEO_CACHE_REVERSE_RADIUS, GEO_CACHE_SEARCH_TTL, GEO_CACHE_STALE_TTL
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[GeoCache]")
+
+# 各工具的新鲜期（秒），超过新鲜期但仍在可用期内的条目会在后台刷新
+DEFAULT_GEO_TTLS: Dict[str, float] = {
+    "map_geocode": GEO_CACHE_GEOCODE_TTL,
+    "map_reverse_geocode": GEO_CACHE_GEOCODE_TTL,
+    "map_place_detail": GEO_CACHE_PLACE_TTL,
+    "map_search_places": GEO_CACHE_SEARCH_TTL,
+}
+
+METERS_PER_DEGREE = 111_320
+
+
+def normalize_address(text: Any) -> str:
+    """规范化地址：全角转半角、统一大小写、去除空白和标点"""
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    text = re.sub(r"[\W_]+", "", text)
+    return text[2:] if text.startswith("中国") else text
+
+
+def parse_location(value: Any) -> Optional[Tuple[float, float]]:
+    """解析 "lat,lng" 字符串或 {"lat": .., "lng": ..} 字典"""
+    try:
+        if isinstance(value, dict):
+            return float(value["lat"]), float(value["lng"])
+        if isinstance(value, str) and value:
+            lat, lng = value.replace("，", ",").split(",")
+            return float(lat), float(lng)
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+
+class GeoCache:
+    """地理信息持久缓存
+
+    数据库在 start 时打开，之前的请求直接访问上游；source 标识数据来源，
+    不同来源的条目互不可见
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttls: Optional[Dict[str, float]] = None,
+        stale_ttl: float = GEO_CACHE_STALE_TTL,
+        reverse_radius: float = GEO_CACHE_REVERSE_RADIUS,
+        source: str = "baidu",
+    ):
+        self.db_path = db_path
+        self.source = source
+        self.ttls = dict(DEFAULT_GEO_TTLS if ttls is None else ttls)
+        self.stale_ttl = stale_ttl
+        self.reverse_radius = reverse_radius
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._entry_count = 0  # 当前来源的条目数，由写入线程维护，统计时不查询数据库
+        self.hits = 0
+        self.stale_hits = 0
+        self.nearby_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    async def start(self) -> None:
+        """打开数据库并清理不再使用的条目"""
+        if self._db is None:
+            self._db = await asyncio.to_thread(self._open_db)
+            LOGGER.info(f"Geo cache enabled: {self.db_path} (source: {self.source})")
+
+    def _open_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in db.execute("PRAGMA table_info(geo_cache)")}
+        if columns and "source" not in columns:
+            # 旧版本的表不区分数据来源，可能混有离线替身的数据，直接重建
+            db.execute("DROP TABLE geo_cache")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS geo_cache ("
+            "key TEXT PRIMARY KEY, source TEXT NOT NULL, tool TEXT NOT NULL, query TEXT NOT NULL, "
+            "lat REAL, lng REAL, payload TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_geo_cache_location ON geo_cache (source, tool, lat, lng)")
+        # 超过可用期的条目不会再被使用
+        oldest = time.time() - max(self.ttls.values(), default=0) - self.stale_ttl
+        db.execute("DELETE FROM geo_cache WHERE fetched_at <= ?", (oldest,))
+        db.commit()
+        self._entry_count = db.execute(
+            "SELECT COUNT(*) FROM geo_cache WHERE source = ?", (self.source,)
+        ).fetchone()[0]
+        return db
+
+    def handles(self, tool_name: str) -> bool:
+        """是否缓存该工具"""
+        return tool_name in self.ttls
+
+    @staticmethod
+    def make_query(tool_name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """生成规范化的查询键，参数不完整时返回 None（不缓存）"""
+        if tool_name == "map_geocode":
+            address = normalize_address(arguments.get("address"))
+            return address or None
+
+        if tool_name == "map_reverse_geocode":
+            location = parse_location({"lat": arguments.get("latitude"), "lng": arguments.get("longitude")})
+            return f"{location[0]:.5f},{location[1]:.5f}" if location else None
+
+        if tool_name == "map_place_detail":
+            uid = str(arguments.get("uid") or "").strip()
+            return f"{uid}|{arguments.get('scope') or '1'}" if uid else None
+
+        if tool_name == "map_search_places":
+            query = normalize_address(arguments.get("query"))
+            if not query:
+                return None
+            location = parse_location(arguments.get("location"))
+            return "|".join([
+                query,
+                normalize_address(arguments.get("tag")),
+                normalize_address(arguments.get("region")),
+                f"{location[0]:.4f},{location[1]:.4f}" if location else "",
+                str(arguments.get("radius") or ""),
+            ])
+
+        return None
+
+    async def get_or_fetch(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        fetch: Callable[[], Awaitable[CallToolResult]],
+        refresh: Optional[Callable[[], Awaitable[CallToolResult]]] = None,
+    ) -> Tuple[CallToolResult, bool]:
+        """读取缓存，未命中时调用 fetch；返回 (结果, 是否来自缓存)
+
+        后台刷新可能在本次请求结束后才执行，使用 refresh 请求上游（不能依赖调用方会话的资源）；
+        没有 refresh 时过期条目按未命中处理
+        """
+        query = self.make_query(tool_name, arguments)
+        if query is None or self._db is None:
+            return await fetch(), False
+
+        key = f"{self.source}:{tool_name}:{query}"
+        row = await asyncio.to_thread(self._db_get, key)
+        if row is None and tool_name == "map_reverse_geocode":
+            row = await asyncio.to_thread(
+                self._db_get_nearby, tool_name, float(arguments["latitude"]), float(arguments["longitude"])
+            )
+            if row is not None:
+                self.nearby_hits += 1
+
+        if row is not None:
+            payload, fetched_at = row
+            age = time.time() - fetched_at
+            ttl = self.ttls[tool_name]
+            if age < ttl:
+                self.hits += 1
+                return CallToolResult.model_validate_json(payload), True
+            if age < ttl + self.stale_ttl and refresh is not None:
+                self.stale_hits += 1
+                self._schedule_refresh(key, tool_name, query, arguments, refresh)
+                return CallToolResult.model_validate_json(payload), True
+
+        # 同一键的并发未命中只请求一次上游
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, tool_name, query, arguments, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task), False
+
+    def _schedule_refresh(
+        self,
+        key: str,
+        tool_name: str,
+        query: str,
+        arguments: Dict[str, Any],
+        fetch: Callable[[], Awaitable[CallToolResult]],
+    ) -> None:
+        """后台刷新过期条目，同一键同时只有一个刷新任务"""
+        if key in self._refreshing or key in self._inflight:
+            return
+        task = asyncio.create_task(self._refresh(key, tool_name, query, arguments, fetch))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(
+        self,
+        key: str,
+        tool_name: str,
+        query: str,
+        arguments: Dict[str, Any],
+        fetch: Callable[[], Awaitable[CallToolResult]],
+    ) -> None:
+        try:
+            await self._fetch_and_store(key, tool_name, query, arguments, fetch)
+            self.refreshes += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 刷新失败时继续使用旧值，下次访问会再次尝试
+            self.refresh_errors += 1
+            LOGGER.warning(f"Failed to refresh {key}: {e}")
+
+    async def _fetch_and_store(
+        self,
+        key: str,
+        tool_name: str,
+        query: str,
+        arguments: Dict[str, Any],
+        fetch: Callable[[], Awaitable[CallToolResult]],
+    ) -> CallToolResult:
+        result = await fetch()
+        data = self._parse_result(result)
+        if data is not None:
+            if tool_name == "map_reverse_geocode":
+                location = (float(arguments["latitude"]), float(arguments["longitude"]))
+            else:
+                location = self._extract_location(data)
+            await asyncio.to_thread(self._db_put, key, tool_name, query, location, result.model_dump_json())
+        return result
+
+    @staticmethod
+    def _parse_result(result: CallToolResult) -> Optional[Any]:
+        """解析工具返回的 JSON；错误结果、非 JSON 文本和百度接口的非零状态都不缓存"""
+        if result.isError or not result.content or result.content[0].type != "text":
+            return None
+        try:
+            data = json.loads(result.content[0].text)
+        except ValueError:
+            return None
+        if isinstance(data, dict) and data.get("status") not in (None, 0, "0"):
+            return None
+        return data
+
+    @staticmethod
+    def _extract_location(data: Any) -> Optional[Tuple[float, float]]:
+        """从百度接口返回中提取坐标，用于建立经纬度索引"""
+        if not isinstance(data, dict):
+            return None
+        candidates = [data.get("location"), (data.get("result") or {}).get("location")]
+        results = data.get("results")
+        if isinstance(results, list) and results and isinstance(results[0], dict):
+            candidates.append(results[0].get("location"))
+        for candidate in candidates:
+            location = parse_location(candidate)
+            if location is not None:
+                return location
+        return None
+
+    def _db_get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT payload, fetched_at FROM geo_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _db_get_nearby(self, tool_name: str, lat: float, lng: float) -> Optional[Tuple[str, float]]:
+        """在经纬度索引上查找半径内最近的条目"""
+        d_lat = self.reverse_radius / METERS_PER_DEGREE
+        d_lng = d_lat / max(math.cos(math.radians(lat)), 0.01)
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT payload, fetched_at, lat, lng FROM geo_cache "
+                "WHERE source = ? AND tool = ? AND lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?",
+                (self.source, tool_name, lat - d_lat, lat + d_lat, lng - d_lng, lng + d_lng),
+            ).fetchall()
+        if not rows:
+            return None
+        nearest = min(rows, key=lambda r: (r[2] - lat) ** 2 + ((r[3] - lng) * math.cos(math.radians(lat))) ** 2)
+        return nearest[0], nearest[1]
+
+    def _db_put(
+        self, key: str, tool_name: str, query: str, location: Optional[Tuple[float, float]], payload: str
+    ) -> None:
+        lat, lng = location if location else (None, None)
+        with self._db_lock:
+            exists = self._db.execute("SELECT 1 FROM geo_cache WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO geo_cache (key, source, tool, query, lat, lng, payload, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, self.source, tool_name, query, lat, lng, payload, time.time()),
+            )
+            self._db.commit()
+            if exists is None:
+                self._entry_count += 1
+
+    def clear(self) -> None:
+        """清空当前来源的缓存"""
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute("DELETE FROM geo_cache WHERE source = ?", (self.source,))
+            self._db.commit()
+            self._entry_count = 0
+
+    async def close(self) -> None:
+        """取消后台刷新任务并关闭数据库"""
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        # nearby_hits 已同时计入 hits 或 stale_hits
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": self._entry_count if self._db is not None else 0,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "nearby_hits": self.nearby_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+
+# 全局地理信息缓存实例（数据库在应用启动时打开）
+geo_cache = GeoCache(GEO_CACHE_DB_PATH, source="fake" if BAIDU_MAP_FAKE else "baidu") if GEO_CACHE_ENABLED else None
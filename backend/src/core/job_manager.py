@@ -0,0 +1,312 @@
+"""
+Job Manager for Travel Assistant
+异步任务：提交规划请求后立即返回任务 ID，规划在后台执行，不占用 HTTP 连接；
+任务记录与 WebSocket 相同的事件，供轮询和 SSE 读取，完成后保留一段时间
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from src.core.admission import AdmissionRejectedError
+from src.core.session_manager import SessionManager, session_manager
+from src.utils.info import (
+    JOB_MAX_EVENTS, JOB_RETENTION, MAX_JOBS, MAX_PENDING_JOBS, MAX_PENDING_JOBS_PER_SESSION, SSE_HEARTBEAT_INTERVAL
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[JobManager]")
+
+# 任务结束状态
+FINISHED_JOB_STATUSES = ("completed", "error", "busy", "cancelled")
+
+# 可以合并的流式增量类型
+MERGED_STREAM_TYPES = ("content", "reasoning")
+
+
+@dataclass
+class Job:
+    """一次后台规划任务"""
+    job_id: str
+    session_id: str
+    request: str
+    status: str = "pending"  # pending, running, completed, error, busy, cancelled
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    retry_after: Optional[int] = None
+    max_events: int = JOB_MAX_EVENTS
+    events: List[Dict[str, Any]] = field(default_factory=list, repr=False)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    truncated: bool = False
+    _read: int = field(default=0, init=False, repr=False)  # 读取方已经取走的事件数
+    _updated: asyncio.Event = field(default_factory=asyncio.Event, init=False, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_JOB_STATUSES
+
+    @property
+    def output(self) -> str:
+        """已收到的正文增量"""
+        return "".join(
+            event["data"] for event in self.events
+            if event.get("type") == "stream" and event.get("stream_type") == "content" and isinstance(event["data"], str)
+        )
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        """记录一条事件：还没有被读取的同类型增量合并为一条；
+        事件数达到 max_events 后不再记录流式事件，结果仍在最后的 travel_plan 事件中"""
+        tail = self.events[-1] if len(self.events) > self._read else None
+        if (
+            tail is not None and event.get("type") == "stream" and tail.get("type") == "stream"
+            and event.get("stream_type") in MERGED_STREAM_TYPES and tail["stream_type"] == event["stream_type"]
+            and isinstance(tail["data"], str) and isinstance(event["data"], str)
+        ):
+            self.events[-1] = {**event, "data": tail["data"] + event["data"]}
+        elif event.get("type") == "stream" and self.max_events and len(self.events) >= self.max_events:
+            if self.truncated:
+                return
+            self.truncated = True
+            self.events.append({"type": "events_truncated", "timestamp": event.get("timestamp")})
+        else:
+            self.events.append(event)
+        # 唤醒所有等待新事件的读取方
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def mark_read(self, count: int) -> None:
+        """读取方已经取走前 count 个事件，这些事件之后不再修改"""
+        self._read = max(self._read, count)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "request": self.request,
+            "status": self.status,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+            "output": self.output,
+            "result": self.result,
+            "error": self.error,
+            "retry_after": self.retry_after,
+            "events": len(self.events),
+            "events_truncated": self.truncated,
+        }
+
+
+class JobManager:
+    """后台规划任务管理器
+
+    同一会话的任务按提交顺序依次执行，事件按会话回调收集，不会混入同一会话的其他任务；
+    未结束的任务总数和每个会话的任务数有上限，超出时拒绝提交（AdmissionRejectedError）；
+    已结束的任务保留 retention 秒，最多保留 max_jobs 个。
+    任务只保存在当前进程的内存中，WORKERS > 1 时查询和事件流需要路由到提交任务的 worker
+    """
+
+    def __init__(
+        self,
+        sessions: SessionManager = session_manager,
+        retention: float = JOB_RETENTION,
+        max_jobs: int = MAX_JOBS,
+        max_pending: int = MAX_PENDING_JOBS,
+        max_pending_per_session: int = MAX_PENDING_JOBS_PER_SESSION,
+    ):
+        self.sessions = sessions
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self.max_pending_per_session = max_pending_per_session
+        self._pending: Dict[str, int] = {}  # 每个会话未结束的任务数
+        self.pending = 0
+        self.rejected = 0
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()  # 按提交顺序
+        self._session_tails: Dict[str, Job] = {}  # 每个会话最后提交的任务
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.expired = 0
+
+    async def start(self):
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def stop(self):
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            await asyncio.gather(self._cleanup_task, return_exceptions=True)
+            self._cleanup_task = None
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, session_id: str, request: str) -> Job:
+        """提交任务并立即返回；未结束的任务过多时抛出 AdmissionRejectedError"""
+        if self.max_pending and self.pending >= self.max_pending:
+            self._reject("任务过多")
+        if self.max_pending_per_session and self._pending.get(session_id, 0) >= self.max_pending_per_session:
+            self._reject("该会话未完成的任务过多")
+
+        job = Job(job_id=str(uuid.uuid4()), session_id=session_id, request=request)
+        previous = self._session_tails.get(session_id)
+        self._session_tails[session_id] = job
+        self.jobs[job.job_id] = job
+        self.submitted += 1
+        job.task = asyncio.create_task(self._run(job, previous))
+        # 在任务结束回调中计数：任务开始执行前被取消时 _run 不会运行
+        self.pending += 1
+        self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        job.task.add_done_callback(lambda _: self._job_done(job))
+        self._prune()
+        LOGGER.info(f"Submitted job {job.job_id} for session {session_id}")
+        return job
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        retry_after = self.sessions.admission.requests.retry_after()
+        raise AdmissionRejectedError(f"{reason}，请 {retry_after} 秒后重试", retry_after)
+
+    def _job_done(self, job: Job):
+        if not job.finished:
+            # 开始执行前就被取消
+            self._finish(job, "cancelled")
+            if self._session_tails.get(job.session_id) is job:
+                del self._session_tails[job.session_id]
+        self.pending -= 1
+        count = self._pending.get(job.session_id, 0) - 1
+        if count > 0:
+            self._pending[job.session_id] = count
+        else:
+            self._pending.pop(job.session_id, None)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消未结束的任务，返回是否取消"""
+        job = self.jobs.get(job_id)
+        if job is None or job.finished or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    async def _run(self, job: Job, previous: Optional[Job]):
+        def on_status(status: str, details: str, seq: int):
+            job.add_event({
+                "type": "status",
+                "status": status,
+                "details": details,
+                "timestamp": datetime.now().isoformat(),
+                "seq": seq
+            })
+
+        async def on_stream(stream_type: str, data: Any, seq: int):
+            job.add_event({
+                "type": "stream",
+                "stream_type": stream_type,
+                "data": data,
+                "timestamp": datetime.now().isoformat(),
+                "seq": seq
+            })
+
+        try:
+            # 等待同一会话之前的任务结束
+            if previous is not None and previous.task is not None:
+                await asyncio.wait({previous.task})
+
+            job.status = "running"
+            self.sessions.add_status_callback(job.session_id, on_status)
+            self.sessions.add_stream_callback(job.session_id, on_stream)
+            try:
+                job.result = await self.sessions.process_travel_request(job.session_id, job.request)
+            finally:
+                self.sessions.remove_status_callback(job.session_id, on_status)
+                self.sessions.remove_stream_callback(job.session_id, on_stream)
+            self._finish(job, "completed", {"type": "travel_plan", "content": job.result})
+
+        except asyncio.CancelledError:
+            self._finish(job, "cancelled")
+        except AdmissionRejectedError as e:
+            job.error = str(e)
+            job.retry_after = e.retry_after
+            self._finish(job, "busy", {"type": "busy", "content": job.error, "retry_after": e.retry_after})
+        except Exception as e:
+            job.error = f"处理请求时出错: {str(e)}"
+            LOGGER.error(f"Error in job {job.job_id}: {e}")
+            self._finish(job, "error", {"type": "error", "content": job.error})
+        finally:
+            if self._session_tails.get(job.session_id) is job:
+                del self._session_tails[job.session_id]
+
+    @staticmethod
+    def _finish(job: Job, status: str, message: Optional[Dict[str, Any]] = None):
+        job.status = status
+        job.finished_at = time.time()
+        if message is not None:
+            job.add_event({**message, "timestamp": datetime.now().isoformat()})
+        else:
+            job.add_event({"type": "job_finished", "status": status, "timestamp": datetime.now().isoformat()})
+
+    async def events(
+        self, job_id: str, after: int = 0, heartbeat: float = SSE_HEARTBEAT_INTERVAL
+    ) -> AsyncIterator[Optional[Tuple[int, Dict[str, Any]]]]:
+        """依次产出任务的 (序号, 事件)，从第 after 个事件之后开始；
+        等待超过 heartbeat 秒没有新事件时产出 None，任务结束且事件读完后停止"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        index = max(0, after)
+        while True:
+            while index < len(job.events):
+                index += 1
+                job.mark_read(index)
+                yield index, job.events[index - 1]
+            if job.finished:
+                return
+            try:
+                await asyncio.wait_for(job._updated.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+    def _prune(self):
+        """清理超过保留时间的已结束任务，任务数超过上限时从最早的已结束任务开始清理"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if not job.finished:
+                continue
+            if len(self.jobs) > self.max_jobs or now - job.finished_at >= self.retention:
+                del self.jobs[job_id]
+                self.expired += 1
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(min(self.retention, 60))
+                self._prune()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error in job cleanup loop: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "jobs": len(self.jobs),
+            "statuses": statuses,
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+
+# 全局任务管理器实例
+job_manager = JobManager()
@@ -4,18 +4,21 @@ Travel Assistant MCP Client
 """
 
 import asyncio
+import importlib
 import os
-from typing import Any, Optional, Dict
+from typing import Any, Callable, Optional, Dict
 from contextlib import AsyncExitStack
 
+import anyio
 from mcp import ClientSession, StdioServerParameters, Tool
 from mcp.client.stdio import stdio_client
+from mcp.shared.memory import create_client_server_memory_streams
 
 from rich import print as rprint
 
 from dotenv import load_dotenv
 
-from src.utils.pretty import RICH_CONSOLE, ALogger
+from src.utils.pretty import ALogger
 
 load_dotenv()
 
@@ -30,6 +33,8 @@ class MCPClient:
         args: list[str],
         env: Dict[str, str] = None,
         version: str = "0.0.1",
+        transport: str = "stdio",
+        server_module: str = "",
     ) -> None:
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
@@ -38,7 +43,10 @@ class MCPClient:
         self.command = command
         self.args = args
         self.env = env or {}
+        self.transport = transport  # stdio: 子进程; memory: 进程内
+        self.server_module = server_module
         self.tools: list[Tool] = []
+        self._tools_listeners: list[Callable[[], None]] = []
 
     async def init(self) -> None:
         """初始化 MCP 客户端"""
@@ -51,15 +59,75 @@ class MCPClient:
             LOGGER.title(f"CLEANUP MCP CLIENT: {self.name}")
             await self.exit_stack.aclose()
         except Exception as e:
-            LOGGER.error(f"Error during MCP client cleanup: {e}")
-            RICH_CONSOLE.print_exception()
+            LOGGER.exception(f"Error during MCP client cleanup: {e}")
 
     def get_tools(self) -> list[Tool]:
         """获取可用工具列表"""
         return self.tools
 
+    def add_tools_listener(self, listener: Callable[[], None]) -> None:
+        """添加工具列表变更（如重新连接）监听器"""
+        self._tools_listeners.append(listener)
+
+    def remove_tools_listener(self, listener: Callable[[], None]) -> None:
+        """移除工具列表变更监听器"""
+        try:
+            self._tools_listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def _notify_tools_changed(self) -> None:
+        """通知监听器工具列表已变更"""
+        for listener in list(self._tools_listeners):
+            try:
+                listener()
+            except Exception as e:
+                LOGGER.error(f"Error in tools listener: {e}")
+
     async def _connect_to_server(self) -> None:
         """连接到 MCP 服务器"""
+        try:
+            if self.transport == "memory":
+                self.stdio, self.write = await self._open_in_process_transport()
+            else:
+                self.stdio, self.write = await self._open_stdio_transport()
+            self.session = await self.exit_stack.enter_async_context(
+                ClientSession(self.stdio, self.write)
+            )
+
+            await self.session.initialize()
+
+            # 列出可用工具
+            response = await self.session.list_tools()
+            self.tools = response.tools
+            LOGGER.success(f"Connected to {self.name} with tools: {[tool.name for tool in self.tools]}")
+            self._notify_tools_changed()
+        
+        except Exception as e:
+            LOGGER.error(f"Failed to connect to MCP server {self.name}: {e}")
+            raise
+
+    async def _open_in_process_transport(self):
+        """在当前进程内挂载 MCP Server，通过内存流通信，无需子进程和管道"""
+        module = importlib.import_module(self.server_module)
+        server = module.server
+
+        client_streams, server_streams = await self.exit_stack.enter_async_context(
+            create_client_server_memory_streams()
+        )
+        task_group = await self.exit_stack.enter_async_context(anyio.create_task_group())
+        task_group.start_soon(
+            server.run,
+            server_streams[0],
+            server_streams[1],
+            server.create_initialization_options(),
+        )
+        # 退出时先停止服务器任务，再关闭内存流
+        self.exit_stack.callback(task_group.cancel_scope.cancel)
+        return client_streams
+
+    async def _open_stdio_transport(self):
+        """启动 MCP Server 子进程，通过 stdio 通信"""
         # 准备环境变量
         server_env = os.environ.copy()
         
@@ -82,26 +150,9 @@ class MCPClient:
             args=self.args,
             env=server_env
         )
-
-        try:
-            stdio_transport = await self.exit_stack.enter_async_context(
-                stdio_client(server_params),
-            )
-            self.stdio, self.write = stdio_transport
-            self.session = await self.exit_stack.enter_async_context(
-                ClientSession(self.stdio, self.write)
-            )
-
-            await self.session.initialize()
-
-            # 列出可用工具
-            response = await self.session.list_tools()
-            self.tools = response.tools
-            LOGGER.success(f"Connected to {self.name} with tools: {[tool.name for tool in self.tools]}")
-        
-        except Exception as e:
-            LOGGER.error(f"Failed to connect to MCP server {self.name}: {e}")
-            raise
+        return await self.exit_stack.enter_async_context(
+            stdio_client(server_params),
+        )
 
     async def call_tool(self, name: str, params: dict[str, Any]):
         """调用指定的工具"""
@@ -109,7 +160,7 @@ class MCPClient:
             raise ValueError("MCP session not initialized")
         
         try:
-            LOGGER.tool_call(name, str(params))
+            LOGGER.tool_call(name, params)
             result = await self.session.call_tool(name, params)
             LOGGER.success(f"Tool {name} executed successfully")
             return result
@@ -0,0 +1,392 @@
+"""
+MCP Server Pool for Travel Assistant
+进程级共享的 MCP 服务器池，所有会话复用长期运行的服务器进程
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+from mcp import Tool
+from mcp.shared.exceptions import McpError
+
+from src.core.mcp_client import MCPClient
+from src.core.mcp_tools import McpToolInfo
+from src.utils.info import MCP_POOL_SIZE, MCP_POOL_MAX_CONCURRENCY
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[MCPServerPool]")
+
+
+class MCPServerUnavailableError(RuntimeError):
+    """MCP 服务器不可用（启动中、重启中或已失效）"""
+
+
+class PooledServer:
+    """池中的单个长期运行的 MCP 服务器进程"""
+
+    # 服务器状态：stopped, starting, ready, failed, restarting
+    STOP_TIMEOUT = 10
+
+    def __init__(self, tool_info: McpToolInfo, index: int):
+        self.tool_info = tool_info
+        self.index = index
+        self.client = MCPClient(**tool_info.to_common_params())
+        self.state = "stopped"
+        self.last_error: Optional[str] = None
+        self.restarts = 0
+        self.leases = 0
+        self.in_flight = 0
+        self.total_calls = 0
+        self.failed_calls = 0
+        self.on_down: Optional[Callable[["PooledServer"], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._down = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._lifecycle_lock = asyncio.Lock()
+        self._tools_listeners: list[Callable[[], None]] = []
+
+    @property
+    def is_running(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self) -> None:
+        """启动服务器进程（幂等），已失效的旧连接会先被关闭"""
+        async with self._lifecycle_lock:
+            if self.state == "ready":
+                return
+            await self._shutdown_task()
+
+            self.state = "starting"
+            self.client = MCPClient(**self.tool_info.to_common_params())
+            # 进程重新连接后通知租户刷新工具列表
+            for listener in self._tools_listeners:
+                self.client.add_tools_listener(listener)
+            self._error = None
+            self._ready = asyncio.Event()
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            await self._ready.wait()
+
+            if self._error is not None:
+                self._task = None
+                self.state = "failed"
+                self.last_error = str(self._error)
+                raise self._error
+
+            self._down = asyncio.Event()
+            self.state = "ready"
+
+    async def stop(self) -> None:
+        """停止服务器进程"""
+        async with self._lifecycle_lock:
+            await self._shutdown_task()
+            self.state = "stopped"
+
+    def mark_down(self, reason: str) -> None:
+        """标记服务器失效，正在进行的调用会立即失败"""
+        if self.state != "ready":
+            return
+        LOGGER.warning(f"MCP server {self.tool_info.name}#{self.index} is down: {reason}")
+        self.state = "failed"
+        self.last_error = reason
+        self._down.set()
+        if self.on_down:
+            self.on_down(self)
+
+    async def call_tool(self, name: str, params: dict[str, Any]):
+        """调用工具；服务器在调用期间失效时立即失败，而不是等待超时"""
+        if self.state != "ready":
+            raise MCPServerUnavailableError(f"MCP server {self.tool_info.name} is {self.state}")
+
+        call_task = asyncio.ensure_future(self.client.call_tool(name, params))
+        down_task = asyncio.ensure_future(self._down.wait())
+        try:
+            done, _ = await asyncio.wait({call_task, down_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            down_task.cancel()
+            if not call_task.done():
+                call_task.cancel()
+
+        if call_task not in done:
+            raise MCPServerUnavailableError(f"MCP server {self.tool_info.name} went down: {self.last_error}")
+        try:
+            return call_task.result()
+        except McpError:
+            # 服务器返回的错误响应，连接本身仍然正常
+            raise
+        except Exception as e:
+            self.mark_down(f"call {name} failed: {e!r}")
+            raise
+
+    def add_tools_listener(self, listener: Callable[[], None]) -> None:
+        """添加工具列表变更监听器"""
+        self._tools_listeners.append(listener)
+        self.client.add_tools_listener(listener)
+
+    def remove_tools_listener(self, listener: Callable[[], None]) -> None:
+        """移除工具列表变更监听器"""
+        try:
+            self._tools_listeners.remove(listener)
+        except ValueError:
+            pass
+        self.client.remove_tools_listener(listener)
+
+    async def _shutdown_task(self) -> None:
+        """关闭持有连接的任务"""
+        if self._task is None:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=self.STOP_TIMEOUT)
+        except Exception as e:
+            LOGGER.warning(f"Error stopping MCP server {self.tool_info.name}#{self.index}: {e}")
+        finally:
+            self._task = None
+
+    async def _run(self) -> None:
+        # stdio_client 内部使用 anyio 的 cancel scope，进入和退出必须在同一个任务中，
+        # 因此由专门的任务持有连接，直到收到停止信号
+        try:
+            await self.client.init()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            await self.client.cleanup()
+            return
+
+        self._ready.set()
+        await self._stop.wait()
+        await self.client.cleanup()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取服务器统计信息"""
+        return {
+            "index": self.index,
+            "state": self.state,
+            "running": self.is_running,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+            "leases": self.leases,
+            "in_flight": self.in_flight,
+            "total_calls": self.total_calls,
+            "failed_calls": self.failed_calls,
+        }
+
+
+class ServerPool:
+    """同一 MCP 工具配置下的一组服务器进程"""
+
+    def __init__(
+        self,
+        tool_info: McpToolInfo,
+        size: int,
+        max_concurrency: int,
+        on_server_down: Optional[Callable[[PooledServer], None]] = None,
+    ):
+        self.tool_info = tool_info
+        self.name = tool_info.name
+        self.max_concurrency = max_concurrency
+        self.servers = [PooledServer(tool_info, i) for i in range(max(1, size))]
+        for server in self.servers:
+            server.on_down = on_server_down
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def is_ready(self) -> bool:
+        return all(server.is_running for server in self.servers)
+
+    async def start(self) -> None:
+        """启动池中尚未运行的服务器进程（重启中的进程由监督器负责）"""
+        pending = [server for server in self.servers if server.state in ("stopped", "failed")]
+        if not pending:
+            return
+        LOGGER.info(f"Starting {len(pending)} server(s) for {self.name}")
+        results = await asyncio.gather(*(server.start() for server in pending), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+
+    async def stop(self) -> None:
+        """停止池中所有服务器进程"""
+        for server in self.servers:
+            try:
+                await server.stop()
+            except Exception as e:
+                LOGGER.error(f"Error stopping server {self.name}#{server.index}: {e}")
+
+    async def acquire(self) -> PooledServer:
+        """租用负载最低的服务器进程，部分进程不可用时优先选择可用进程"""
+        try:
+            await self.start()
+        except Exception as e:
+            LOGGER.error(f"Failed to start MCP server pool {self.name}: {e}")
+        candidates = [server for server in self.servers if server.is_running] or self.servers
+        server = min(candidates, key=lambda s: (s.leases, s.in_flight))
+        server.leases += 1
+        return server
+
+    def release(self, server: PooledServer) -> None:
+        """归还租用的服务器进程"""
+        server.leases = max(0, server.leases - 1)
+
+    async def call_tool(self, server: PooledServer, name: str, params: dict[str, Any]):
+        """在并发限制内调用工具，租用的进程不可用时转到池中其他可用进程"""
+        if not server.is_running:
+            fallback = [s for s in self.servers if s.is_running]
+            if not fallback:
+                raise MCPServerUnavailableError(f"MCP server {self.name} is {server.state}, please retry later")
+            server = min(fallback, key=lambda s: s.in_flight)
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        server.in_flight += 1
+        try:
+            return await server.call_tool(name, params)
+        except Exception:
+            server.failed_calls += 1
+            raise
+        finally:
+            server.in_flight -= 1
+            server.total_calls += 1
+            self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取池统计信息"""
+        servers = [server.get_stats() for server in self.servers]
+        return {
+            "ready": self.is_ready,
+            "size": len(self.servers),
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "leases": sum(s["leases"] for s in servers),
+            "in_flight": sum(s["in_flight"] for s in servers),
+            "total_calls": sum(s["total_calls"] for s in servers),
+            "failed_calls": sum(s["failed_calls"] for s in servers),
+            "servers": servers,
+        }
+
+
+class MCPClientLease:
+    """会话对池中服务器的租约，对外提供与 MCPClient 相同的接口"""
+
+    def __init__(self, pool: ServerPool):
+        self.pool = pool
+        self.name = pool.name
+        self.server: Optional[PooledServer] = None
+        self._tools_listeners: list[Callable[[], None]] = []
+
+    async def init(self) -> None:
+        """租用服务器进程"""
+        if self.server is None:
+            self.server = await self.pool.acquire()
+            for listener in self._tools_listeners:
+                self.server.add_tools_listener(listener)
+
+    async def cleanup(self) -> None:
+        """归还服务器进程（进程本身由池负责关闭）"""
+        if self.server is not None:
+            for listener in self._tools_listeners:
+                self.server.remove_tools_listener(listener)
+            self.pool.release(self.server)
+            self.server = None
+
+    def get_tools(self) -> list[Tool]:
+        """获取可用工具列表"""
+        if self.server is None:
+            return []
+        return self.server.client.get_tools()
+
+    def add_tools_listener(self, listener: Callable[[], None]) -> None:
+        """添加工具列表变更（如服务器重新连接）监听器"""
+        self._tools_listeners.append(listener)
+        if self.server is not None:
+            self.server.add_tools_listener(listener)
+
+    def remove_tools_listener(self, listener: Callable[[], None]) -> None:
+        """移除工具列表变更监听器"""
+        try:
+            self._tools_listeners.remove(listener)
+        except ValueError:
+            pass
+        if self.server is not None:
+            self.server.remove_tools_listener(listener)
+
+    async def call_tool(self, name: str, params: dict[str, Any]):
+        """调用指定的工具"""
+        if self.server is None:
+            raise ValueError("MCP lease not initialized")
+        return await self.pool.call_tool(self.server, name, params)
+
+
+class MCPServerPool:
+    """进程级 MCP 服务器池"""
+
+    def __init__(self, size: int = MCP_POOL_SIZE, max_concurrency: int = MCP_POOL_MAX_CONCURRENCY):
+        self.size = size
+        self.max_concurrency = max_concurrency
+        self.pools: Dict[str, ServerPool] = {}
+        self._server_down_listeners: list[Callable[[ServerPool, PooledServer], None]] = []
+
+    def add_server_down_listener(self, listener: Callable[[ServerPool, PooledServer], None]) -> None:
+        """添加服务器失效监听器"""
+        self._server_down_listeners.append(listener)
+
+    def _notify_server_down(self, pool: ServerPool, server: PooledServer) -> None:
+        for listener in list(self._server_down_listeners):
+            try:
+                listener(pool, server)
+            except Exception as e:
+                LOGGER.error(f"Error in server down listener: {e}")
+
+    def get_pool(self, tool_info: McpToolInfo) -> ServerPool:
+        """获取（或创建）指定工具配置的服务器池"""
+        pool = self.pools.get(tool_info.name)
+        if pool is None:
+            pool = ServerPool(
+                tool_info,
+                size=tool_info.pool_size or self.size,
+                max_concurrency=tool_info.max_concurrency or self.max_concurrency,
+                on_server_down=lambda server: self._notify_server_down(self.pools[tool_info.name], server),
+            )
+            self.pools[tool_info.name] = pool
+        return pool
+
+    def lease(self, tool_info: McpToolInfo) -> MCPClientLease:
+        """为会话创建服务器租约"""
+        return MCPClientLease(self.get_pool(tool_info))
+
+    async def start(self, tool_infos: List[McpToolInfo]) -> None:
+        """预先启动指定工具的服务器进程"""
+        LOGGER.title("START MCP SERVER POOL")
+        results = await asyncio.gather(
+            *(self.get_pool(tool_info).start() for tool_info in tool_infos),
+            return_exceptions=True,
+        )
+        for tool_info, result in zip(tool_infos, results):
+            if isinstance(result, Exception):
+                LOGGER.error(f"Failed to start MCP server pool {tool_info.name}: {result}")
+
+    async def shutdown(self) -> None:
+        """关闭所有服务器进程"""
+        LOGGER.title("SHUTDOWN MCP SERVER POOL")
+        for pool in self.pools.values():
+            await pool.stop()
+
+    def is_ready(self) -> bool:
+        """所有服务器进程是否均可用"""
+        return bool(self.pools) and all(pool.is_ready for pool in self.pools.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取所有池的统计信息"""
+        return {name: pool.get_stats() for name, pool in self.pools.items()}
+
+
+# 全局 MCP 服务器池实例
+mcp_server_pool = MCPServerPool()
@@ -0,0 +1,151 @@
+"""
+MCP Server Supervisor for Travel Assistant
+MCP 服务器监督器：启动预热、定期健康检查、崩溃后指数退避重启
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.core.mcp_pool import MCPServerPool, PooledServer, ServerPool, mcp_server_pool
+from src.core.mcp_tools import McpToolInfo
+from src.utils.info import (
+    MCP_HEALTH_CHECK_INTERVAL, MCP_PING_TIMEOUT, MCP_RESTART_BASE_BACKOFF, MCP_RESTART_MAX_BACKOFF
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[MCPSupervisor]")
+
+
+class MCPServerSupervisor:
+    """监督服务器池中的所有 MCP 服务器进程"""
+
+    def __init__(
+        self,
+        pool: MCPServerPool,
+        check_interval: float = MCP_HEALTH_CHECK_INTERVAL,
+        ping_timeout: float = MCP_PING_TIMEOUT,
+        base_backoff: float = MCP_RESTART_BASE_BACKOFF,
+        max_backoff: float = MCP_RESTART_MAX_BACKOFF,
+    ):
+        self.pool = pool
+        self.check_interval = check_interval
+        self.ping_timeout = ping_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._restart_tasks: Dict[Tuple[str, int], asyncio.Task] = {}
+        self.pool.add_server_down_listener(self._on_server_down)
+
+    async def start(self, tool_infos: List[McpToolInfo]) -> None:
+        """预热服务器进程并启动健康检查"""
+        LOGGER.title("START MCP SUPERVISOR")
+        await self.pool.start(tool_infos)
+
+        # 预热失败的进程立即进入重启流程
+        for server_pool in self.pool.pools.values():
+            for server in server_pool.servers:
+                if server.state == "failed":
+                    self._schedule_restart(server_pool, server)
+
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def stop(self) -> None:
+        """停止健康检查和所有重启任务"""
+        LOGGER.title("STOP MCP SUPERVISOR")
+        tasks = list(self._restart_tasks.values())
+        if self._monitor_task:
+            tasks.append(self._monitor_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._monitor_task = None
+        self._restart_tasks.clear()
+
+    def is_ready(self) -> bool:
+        """所有服务器进程是否均可用"""
+        return self.pool.is_ready()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取服务器就绪状态"""
+        return {
+            "ready": self.is_ready(),
+            "restarting": sorted(
+                f"{name}#{index}" for (name, index), task in self._restart_tasks.items() if not task.done()
+            ),
+            "servers": {
+                name: [
+                    {
+                        "index": server.index,
+                        "state": server.state,
+                        "restarts": server.restarts,
+                        "last_error": server.last_error,
+                    }
+                    for server in server_pool.servers
+                ]
+                for name, server_pool in self.pool.pools.items()
+            },
+        }
+
+    def _on_server_down(self, server_pool: ServerPool, server: PooledServer) -> None:
+        """服务器失效时立即安排重启"""
+        self._schedule_restart(server_pool, server)
+
+    def _schedule_restart(self, server_pool: ServerPool, server: PooledServer) -> None:
+        key = (server_pool.name, server.index)
+        task = self._restart_tasks.get(key)
+        if task is not None and not task.done():
+            return
+        self._restart_tasks[key] = asyncio.create_task(self._restart(server_pool, server))
+
+    async def _restart(self, server_pool: ServerPool, server: PooledServer) -> None:
+        """按指数退避重启服务器进程，直到成功"""
+        attempt = 0
+        while True:
+            # 重启期间保持不可用状态，调用方会立即失败
+            server.state = "restarting"
+            if attempt:
+                delay = min(self.base_backoff * 2 ** (attempt - 1), self.max_backoff)
+                LOGGER.info(f"Restarting {server_pool.name}#{server.index} in {delay:.1f}s (attempt {attempt + 1})")
+                await asyncio.sleep(delay)
+            try:
+                await server.start()
+                server.restarts += 1
+                LOGGER.success(f"MCP server {server_pool.name}#{server.index} restarted")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempt += 1
+                LOGGER.error(f"Failed to restart MCP server {server_pool.name}#{server.index}: {e}")
+
+    async def _monitor(self) -> None:
+        """定期检查所有服务器进程"""
+        while True:
+            try:
+                await asyncio.sleep(self.check_interval)
+                checks = [
+                    self._check(server_pool, server)
+                    for server_pool in list(self.pool.pools.values())
+                    for server in server_pool.servers
+                ]
+                await asyncio.gather(*checks)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error in health check task: {e}")
+
+    async def _check(self, server_pool: ServerPool, server: PooledServer) -> None:
+        """对单个服务器进程执行健康检查"""
+        if server.state == "failed":
+            self._schedule_restart(server_pool, server)
+            return
+        if server.state != "ready" or server.client.session is None:
+            return
+        try:
+            await asyncio.wait_for(server.client.session.send_ping(), timeout=self.ping_timeout)
+        except Exception as e:
+            server.mark_down(f"health check failed: {e!r}")
+
+
+# 全局 MCP 服务器监督器实例
+mcp_supervisor = MCPServerSupervisor(mcp_server_pool)
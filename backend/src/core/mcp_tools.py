@@ -4,10 +4,12 @@ MCP Tools Configuration for Travel Assistant
 """
 
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 import sys
 
+from src.utils.info import MCP_IN_PROCESS
+
 @dataclass
 class McpToolInfo:
     """MCP 工具信息"""
@@ -16,6 +18,10 @@ class McpToolInfo:
     args: List[str]
     env: Dict[str, str]
     description: str = ""
+    transport: str = "stdio"  # stdio: 子进程; memory: 进程内挂载（仅限本项目的 Python Server）
+    server_module: str = ""  # transport 为 memory 时导入的模块路径
+    pool_size: Optional[int] = None  # 服务器进程数，None 表示使用全局默认值
+    max_concurrency: Optional[int] = None  # 最大并发调用数，None 表示使用全局默认值
 
     def to_common_params(self) -> Dict[str, Any]:
         """转换为通用参数格式"""
@@ -23,7 +29,9 @@ class McpToolInfo:
             "name": self.name,
             "command": self.command,
             "args": self.args,
-            "env": self.env
+            "env": self.env,
+            "transport": self.transport,
+            "server_module": self.server_module
         }
 
 
@@ -41,8 +49,24 @@ class TravelMcpTools:
             description="百度地图 MCP Server，提供地理编码、地点检索、路线规划等功能"
         )
     
+    @classmethod
+    def get_fake_baidu_maps_tool(cls, in_process: bool = MCP_IN_PROCESS) -> McpToolInfo:
+        """离线模拟的百度地图工具配置（与百度地图同名，用于测试和基准测试）"""
+        project_root = Path(__file__).parent.parent.parent
+        fake_server_path = project_root / "src" / "tools" / "fake_baidu_mcp_server.py"
+        
+        return McpToolInfo(
+            name="baidu-maps",
+            command=sys.executable,
+            args=[str(fake_server_path)],
+            env={},
+            description="百度地图 MCP Server 的离线替身，返回确定性的模拟数据",
+            transport="memory" if in_process else "stdio",
+            server_module="src.tools.fake_baidu_mcp_server"
+        )
+    
     @classmethod  
-    def get_weather_tool(cls) -> McpToolInfo:
+    def get_weather_tool(cls, in_process: bool = MCP_IN_PROCESS) -> McpToolInfo:
         """天气工具配置"""
         project_root = Path(__file__).parent.parent.parent
         weather_server_path = project_root / "src" / "tools" / "weather_mcp_server.py"
@@ -52,11 +76,13 @@ class TravelMcpTools:
             command=sys.executable,
             args=[str(weather_server_path)],
             env={"WEATHER_API_KEY": "${WEATHER_API_KEY}"},
-            description="天气查询工具，提供当前天气、天气预报和天气提醒"
+            description="天气查询工具，提供当前天气、天气预报和天气提醒",
+            transport="memory" if in_process else "stdio",
+            server_module="src.tools.weather_mcp_server"
         )
     
     @classmethod
-    def get_itinerary_tool(cls) -> McpToolInfo:
+    def get_itinerary_tool(cls, in_process: bool = MCP_IN_PROCESS) -> McpToolInfo:
         """行程规划工具配置"""
         project_root = Path(__file__).parent.parent.parent
         itinerary_server_path = project_root / "src" / "tools" / "itinerary_mcp_server.py"
@@ -66,7 +92,9 @@ class TravelMcpTools:
             command=sys.executable,
             args=[str(itinerary_server_path)],
             env={},
-            description="行程规划工具，提供多日行程规划、路线优化、活动推荐和预算估算"
+            description="行程规划工具，提供多日行程规划、路线优化、活动推荐和预算估算",
+            transport="memory" if in_process else "stdio",
+            server_module="src.tools.itinerary_mcp_server"
         )
 
     # 兼容性属性（保持向后兼容）
@@ -0,0 +1,229 @@
+"""
+Plan Cache for Travel Assistant
+整份旅行方案的语义缓存：相同用户配置、相同目的地下语义相近的首轮请求直接返回已完成的方案
+"""
+
+import re
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from src.core.embedding_retriever import EembeddingRetriever
+from src.core.travel_agent import KNOWN_DESTINATIONS, UserProfile
+from src.core.vector_store import VectorStoreItem
+from src.utils.info import (
+    EMBEDDING_MODEL, PLAN_CACHE_ENABLED, PLAN_CACHE_MAX_ENTRIES, PLAN_CACHE_SIMILARITY_THRESHOLD,
+    PLAN_CACHE_TTL, PLAN_CACHE_WEATHER_TTL
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[PlanCache]")
+
+# 使用过这些工具的方案依赖实时天气，缓存时间更短
+WEATHER_TOOLS = frozenset({
+    "get_current_weather", "get_weather_forecast", "get_weather_alerts", "get_weather_batch", "map_weather"
+})
+
+# 相对日期：方案只在生成当天有效
+RELATIVE_DATE_PATTERN = re.compile(r"今天|今日|明天|明日|后天|大后天|本周|这周|周末|下周|下个?月|这个?月|近期|最近")
+# 绝对日期、天数、人数等约束：必须完全一致，语义相似度无法可靠区分“三日游”和“五日游”
+CONSTRAINT_PATTERN = re.compile(
+    r"\d{4}[-/年]\d{1,2}[-/月]\d{1,2}日?"
+    r"|\d{1,2}月\d{1,2}[日号]?"
+    r"|[\d一二两三四五六七八九十半]+\s*个?(?:天|日|晚|夜|人|位|大人|小孩|孩子|老人|岁|元|块|万)"
+)
+CHINESE_DIGITS = {"一": "1", "二": "2", "两": "2", "三": "3", "四": "4", "五": "5",
+                  "六": "6", "七": "7", "八": "8", "九": "9", "十": "10", "半": "0.5"}
+
+
+def normalize_request(request: str) -> str:
+    """规范化请求文本：去除空白和标点"""
+    return re.sub(r"[\W_]+", "", request).lower()
+
+
+def extract_constraints(request: str) -> FrozenSet[str]:
+    """提取日期、天数、人数、金额等硬性约束"""
+    constraints = set()
+    for match in CONSTRAINT_PATTERN.findall(request):
+        token = "".join(CHINESE_DIGITS.get(ch, ch) for ch in re.sub(r"\s+|个", "", match))
+        # “三日”和“3天”视为相同的天数约束
+        if "月" not in token and "年" not in token:
+            token = token.replace("日", "天")
+        constraints.add(token)
+    return frozenset(constraints)
+
+
+def extract_destinations(request: str) -> FrozenSet[str]:
+    """提取请求中的已知目的地；目的地不同的方案不能复用，不依赖语义相似度区分“北京”和“上海”"""
+    return frozenset(city for city in KNOWN_DESTINATIONS if city in request)
+
+
+def profile_signature(profile: Optional[UserProfile]) -> str:
+    """与方案内容相关的用户配置字段（不含姓名）"""
+    if profile is None:
+        profile = UserProfile()
+    return "|".join([
+        profile.home_location,
+        ",".join(sorted(profile.preferences or [])),
+        profile.budget_range,
+        profile.travel_style,
+    ])
+
+
+@dataclass
+class CachedPlan:
+    """缓存命中的方案"""
+    plan: str
+    request: str
+    similarity: float
+    age: float
+
+
+class PlanCache:
+    """整份方案的语义缓存"""
+
+    def __init__(
+        self,
+        retriever: Optional[EembeddingRetriever] = None,
+        threshold: float = PLAN_CACHE_SIMILARITY_THRESHOLD,
+        ttl: float = PLAN_CACHE_TTL,
+        weather_ttl: float = PLAN_CACHE_WEATHER_TTL,
+        max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+    ):
+        self.retriever = retriever or EembeddingRetriever(EMBEDDING_MODEL)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.weather_ttl = weather_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.embedding_errors = 0
+
+    @property
+    def store(self):
+        return self.retriever.vector_store
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        today = date.today().isoformat()
+        self.store.remove(
+            lambda item: item.metadata["expires_at"] <= now
+            or (item.metadata["valid_on"] is not None and item.metadata["valid_on"] != today)
+        )
+
+    def _matches(
+        self, item: VectorStoreItem, signature: str, constraints: FrozenSet[str], destinations: FrozenSet[str]
+    ) -> bool:
+        return (
+            item.metadata["profile"] == signature
+            and item.metadata["constraints"] == constraints
+            and item.metadata["destinations"] == destinations
+        )
+
+    async def lookup(self, request: str, profile: Optional[UserProfile]) -> Optional[CachedPlan]:
+        """查找可复用的方案"""
+        self._evict_expired()
+        signature = profile_signature(profile)
+        constraints = extract_constraints(request)
+        destinations = extract_destinations(request)
+        normalized = normalize_request(request)
+
+        def matches(item: VectorStoreItem) -> bool:
+            return self._matches(item, signature, constraints, destinations)
+
+        # 完全相同的请求不需要向量化
+        for item in self.store.items:
+            if matches(item) and item.metadata["normalized"] == normalized:
+                self.hits += 1
+                self.exact_hits += 1
+                return self._to_cached_plan(item, 1.0)
+
+        # 识别不出目的地时无法确认是同一个地方，只复用完全相同的请求
+        if not destinations or not any(matches(item) for item in self.store.items):
+            self.misses += 1
+            return None
+
+        embedding = await self.retriever.embed_query(request)
+        if embedding is None:
+            self.embedding_errors += 1
+            self.misses += 1
+            return None
+
+        results = self.store.search_with_scores(embedding, top_k=1, where=matches)
+        if results and results[0][1] >= self.threshold:
+            item, similarity = results[0]
+            self.hits += 1
+            LOGGER.info(f"Plan cache hit ({similarity:.3f}): {request!r} ~ {item.document!r}")
+            return self._to_cached_plan(item, similarity)
+
+        self.misses += 1
+        return None
+
+    async def put(
+        self, request: str, profile: Optional[UserProfile], plan: str, tool_names: Iterable[str] = ()
+    ) -> bool:
+        """缓存已完成的方案"""
+        if not plan:
+            return False
+        embedding = await self.retriever.embed_query(request)
+        if embedding is None:
+            self.embedding_errors += 1
+            return False
+
+        tool_names = set(tool_names)
+        ttl = self.weather_ttl if tool_names & WEATHER_TOOLS else self.ttl
+        self.store.add(VectorStoreItem(
+            embedding=embedding,
+            document=request,
+            metadata={
+                "plan": plan,
+                "profile": profile_signature(profile),
+                "constraints": extract_constraints(request),
+                "destinations": extract_destinations(request),
+                "normalized": normalize_request(request),
+                "created_at": time.time(),
+                "expires_at": time.time() + ttl,
+                # 含相对日期的请求（如“明天”“这周末”）只在当天有效
+                "valid_on": date.today().isoformat() if RELATIVE_DATE_PATTERN.search(request) else None,
+            },
+        ))
+        self.stores += 1
+
+        self._evict_expired()
+        overflow = len(self.store.items) - self.max_entries
+        if overflow > 0:
+            del self.store.items[:overflow]
+        return True
+
+    @staticmethod
+    def _to_cached_plan(item: VectorStoreItem, similarity: float) -> CachedPlan:
+        return CachedPlan(
+            plan=item.metadata["plan"],
+            request=item.document,
+            similarity=similarity,
+            age=time.time() - item.metadata["created_at"],
+        )
+
+    async def close(self) -> None:
+        await self.retriever.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.store.items),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "exact_hits": self.exact_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "embedding_errors": self.embedding_errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# 全局方案缓存实例
+plan_cache = PlanCache() if PLAN_CACHE_ENABLED else None
@@ -6,17 +6,29 @@ Session Manager for Travel Assistant
 import asyncio
 import json
 import uuid
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Callable
-from dataclasses import dataclass, asdict
+from typing import Deque, Dict, List, Optional, Any, Callable, Tuple
+from dataclasses import dataclass, asdict, replace
 import weakref
 
+from src.api.stream_buffer import COALESCED_STREAM_TYPES
+from src.core.admission import AdmissionController, AdmissionRejectedError, admission_controller
+from src.core.event_bus import EventBus, event_bus
+from src.core.event_log import EventLog, event_log
+from src.core.plan_cache import PlanCache, plan_cache
+from src.core.session_store import SessionStore, session_store
 from src.core.travel_agent import TravelAgent, UserProfile, SessionContext
 from src.utils.pretty import ALogger
-from src.utils.info import MAX_SESSIONS, SESSION_TIMEOUT
+from src.utils.info import (
+    EVENT_BUS_DELIVERY_QUEUE, MAX_SESSIONS, SESSION_TIMEOUT, STICKY_FORWARD_TIMEOUT, STICKY_SESSIONS
+)
 
 LOGGER = ALogger("[SessionManager]")
 
+# 转发事件因本地客户端太慢被丢弃时投递给回调的状态，客户端收到后带上 last_seq 重连补发
+RESYNC_REQUIRED = "resync_required"
+
 
 @dataclass
 class SessionData:
@@ -26,37 +38,108 @@ class SessionData:
     chat_history: List[Dict[str, Any]]
     created_at: datetime
     last_activity: datetime
-    status: str = "active"  # active, thinking, processing, completed, error
+    status: str = "active"  # active, queued, thinking, processing, completed, cancelled, error
     current_request: str = ""
     agent_instance: Optional[TravelAgent] = None
 
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
-        data = asdict(self)
-        data['created_at'] = self.created_at.isoformat()
-        data['last_activity'] = self.last_activity.isoformat()
-        # 不序列化 agent_instance
-        data.pop('agent_instance', None)
-        return data
+        # 不使用 asdict 直接转换：它会递归深拷贝 agent_instance
+        return {
+            'session_id': self.session_id,
+            'user_profile': asdict(self.user_profile),
+            'chat_history': list(self.chat_history),
+            'created_at': self.created_at.isoformat(),
+            'last_activity': self.last_activity.isoformat(),
+            'status': self.status,
+            'current_request': self.current_request,
+        }
+
+    def to_meta(self) -> Dict[str, Any]:
+        """持久化的会话元数据（聊天记录单独追加写入）"""
+        return {
+            'user_profile': asdict(self.user_profile),
+            'created_at': self.created_at.isoformat(),
+            'last_activity': self.last_activity.isoformat(),
+            'status': self.status,
+            'current_request': self.current_request,
+        }
+
+    @classmethod
+    def from_stored(cls, session_id: str, meta: Dict[str, Any], chat_history: List[Dict[str, Any]]) -> "SessionData":
+        """从会话存储恢复会话数据"""
+        profile = {
+            key: value for key, value in meta.get('user_profile', {}).items()
+            if key in UserProfile.__dataclass_fields__
+        }
+        return cls(
+            session_id=session_id,
+            user_profile=UserProfile(**profile),
+            chat_history=chat_history,
+            created_at=datetime.fromisoformat(meta['created_at']),
+            last_activity=datetime.fromisoformat(meta['last_activity']),
+            status=meta.get('status', 'active'),
+            current_request=meta.get('current_request', ''),
+        )
 
     def update_activity(self):
         """更新最后活动时间"""
         self.last_activity = datetime.now()
 
+    def expires_at(self) -> datetime:
+        """会话过期时间"""
+        return self.last_activity + timedelta(seconds=SESSION_TIMEOUT)
+
     def is_expired(self) -> bool:
         """检查会话是否过期"""
-        return (datetime.now() - self.last_activity).total_seconds() > SESSION_TIMEOUT
+        return datetime.now() > self.expires_at()
 
 
 class SessionManager:
-    """会话管理器"""
+    """会话管理器
+
+    sessions 按最后活动时间排序（最久未活动的在前）。所有会话的超时时间相同，
+    因此队首就是最早过期的会话：淘汰和过期检查只需查看队首，清理任务睡眠到队首的过期时间
+
+    配置了会话存储时，sessions 只是存储的内存缓存：被淘汰的会话在下次访问时从存储中恢复
+
+    多 worker 部署时，状态和流式事件经事件总线转发给其他 worker 上的 WebSocket 连接；
+    会话更新后通知其他 worker 丢弃缓存。粘性模式下每个会话的请求都转发给所属 worker 处理
+    """
     
     def __init__(self):
-        self.sessions: Dict[str, SessionData] = {}
+        self.sessions: "OrderedDict[str, SessionData]" = OrderedDict()
         self.status_callbacks: Dict[str, List[Callable]] = {}
         self.stream_callbacks: Dict[str, List[Callable]] = {}
         self._cleanup_task: Optional[asyncio.Task] = None
+        self._cleanup_wakeup = asyncio.Event()
         self._agent_factory: Optional[Callable[[], TravelAgent]] = None
+        self.plan_cache: Optional[PlanCache] = plan_cache
+        self.store: Optional[SessionStore] = session_store
+        self.event_bus: Optional[EventBus] = event_bus
+        self.event_log: EventLog = event_log
+        self.admission: AdmissionController = admission_controller
+        self.sticky = STICKY_SESSIONS and event_bus is not None
+        self._running: set[str] = set()
+        self._stale: set[str] = set()
+        self._forwarded: Dict[str, asyncio.Future] = {}
+        self._forwarded_runs: Dict[str, asyncio.Task] = {}
+        # 其他 worker 转发来的事件按会话排队，由各会话自己的任务交给本地连接，慢客户端不阻塞事件总线
+        self._bus_deliveries: Dict[str, Deque[Tuple[str, str, Any, Optional[int]]]] = {}
+        self._bus_delivery_tasks: Dict[str, asyncio.Task] = {}
+        self.bus_deliveries_coalesced = 0
+        self.bus_deliveries_dropped = 0
+        self.bus_deliveries_overflow = 0
+        # 每个会话当前正在执行的请求任务，用于取消
+        self._runs: Dict[str, asyncio.Task] = {}
+        self.run_stats: Dict[str, int] = {
+            "completed": 0,
+            "cancelled": 0,
+            "completion_tokens": 0,
+            "llm_calls_cancelled": 0,
+            "tool_calls_cancelled": 0,
+            "completion_tokens_avoided": 0,  # 估算值：已完成请求的平均输出 token 数减去被取消请求已产生的部分
+        }
 
     def set_agent_factory(self, factory: Callable[[], TravelAgent]):
         """设置 Agent 工厂函数"""
@@ -65,6 +148,17 @@ class SessionManager:
     async def start(self):
         """启动会话管理器"""
         LOGGER.title("START SESSION MANAGER")
+        await self.event_log.start()
+        if self.store:
+            await self.store.start()
+            purged = await self.store.purge_expired(datetime.now().timestamp() - SESSION_TIMEOUT)
+            if purged:
+                LOGGER.info(f"Purged {purged} expired sessions from session store")
+        if self.event_bus:
+            if self.store is None:
+                LOGGER.warning("Event bus enabled without a session store, sessions are not shared between workers")
+            self.event_bus.set_handler(self._on_bus_event)
+            await self.event_bus.start()
         # 启动清理任务
         self._cleanup_task = asyncio.create_task(self._cleanup_expired_sessions())
 
@@ -81,17 +175,18 @@ class SessionManager:
 
         # 清理所有会话
         await self._cleanup_all_sessions()
+        await self.event_log.close()
+        if self.event_bus:
+            await self.event_bus.close()
+        tasks = list(self._bus_delivery_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.store:
+            await self.store.close()
 
     def create_session(self, user_profile: UserProfile = None) -> str:
         """创建新会话"""
-        if len(self.sessions) >= MAX_SESSIONS:
-            # 清理最旧的会话
-            oldest_session_id = min(
-                self.sessions.keys(),
-                key=lambda sid: self.sessions[sid].last_activity
-            )
-            asyncio.create_task(self.delete_session(oldest_session_id))
-
         session_id = str(uuid.uuid4())
         if user_profile is None:
             user_profile = UserProfile()
@@ -104,65 +199,151 @@ class SessionManager:
             last_activity=datetime.now()
         )
 
-        self.sessions[session_id] = session_data
-        self.status_callbacks[session_id] = []
-        self.stream_callbacks[session_id] = []
+        self._register(session_data)
+        self._persist_meta(session_data)
 
         LOGGER.success(f"Created session: {session_id}")
         return session_id
 
-    async def delete_session(self, session_id: str):
-        """删除会话"""
+    def _register(self, session_data: SessionData):
+        """把会话加入注册表，超出 MAX_SESSIONS 时淘汰最久未活动的空闲会话"""
+        while self.sessions and len(self.sessions) >= MAX_SESSIONS:
+            # 从队首开始跳过有连接或正在处理请求的会话；有会话存储时只释放内存，之后仍可恢复
+            idle_session_id = next((sid for sid in self.sessions if self._is_idle(sid)), None)
+            if idle_session_id is None:
+                # 没有可淘汰的会话，暂时超出上限
+                LOGGER.warning(f"All {len(self.sessions)} sessions are busy, exceeding MAX_SESSIONS")
+                break
+            self._schedule_agent_cleanup(idle_session_id, self._remove_session(idle_session_id))
+
+        session_id = session_data.session_id
+        self.sessions[session_id] = session_data
+        self.sessions.move_to_end(session_id)
+        self.status_callbacks.setdefault(session_id, [])
+        self.stream_callbacks.setdefault(session_id, [])
+        if len(self.sessions) == 1:
+            # 清理任务在没有会话时最多等待 SESSION_TIMEOUT，需要唤醒以按新会话计算过期时间
+            self._cleanup_wakeup.set()
+
+    def _persist_meta(self, session_data: SessionData):
+        """写入会话元数据（批量提交）"""
+        if self.store:
+            self.store.save_session(
+                session_data.session_id, session_data.to_meta(), session_data.last_activity.timestamp()
+            )
+
+    def _append_history(self, session_data: SessionData, message: Dict[str, Any]):
+        """追加聊天记录并写入会话存储"""
+        session_data.chat_history.append(message)
+        if self.store:
+            self.store.append_message(session_data.session_id, message)
+            self._persist_meta(session_data)
+
+    async def load_session(self, session_id: str) -> Optional[SessionData]:
+        """获取会话数据，不在内存中时从会话存储恢复"""
+        session_data = self.get_session(session_id)
+        if session_data is not None or self.store is None:
+            return session_data
+
+        try:
+            stored = await self.store.load_session(session_id)
+        except Exception as e:
+            LOGGER.error(f"Failed to load session {session_id} from store: {e}")
+            return None
+        if stored is None:
+            return None
+        # 等待读取期间可能已被其他请求恢复
         if session_id in self.sessions:
-            session_data = self.sessions[session_id]
-            
-            # 清理 Agent 实例
-            if session_data.agent_instance:
-                try:
-                    await session_data.agent_instance.cleanup()
-                except Exception as e:
-                    LOGGER.error(f"Error cleaning up agent for session {session_id}: {e}")
+            return self.get_session(session_id)
+
+        session_data = SessionData.from_stored(session_id, *stored)
+        if session_data.is_expired():
+            self.store.delete_session(session_id)
+            return None
+
+        self._register(session_data)
+        self._touch(session_data)
+        LOGGER.info(f"Restored session {session_id} with {len(session_data.chat_history)} messages")
+        return session_data
+
+    def _is_idle(self, session_id: str) -> bool:
+        """会话没有正在处理的请求，也没有注册回调（连接）"""
+        return (
+            session_id not in self._running
+            and not self.status_callbacks.get(session_id)
+            and not self.stream_callbacks.get(session_id)
+        )
 
-            # 删除会话数据
-            del self.sessions[session_id]
-            
-            # 清理状态回调
-            if session_id in self.status_callbacks:
-                del self.status_callbacks[session_id]
-                
-            # 清理流式回调
-            if session_id in self.stream_callbacks:
-                del self.stream_callbacks[session_id]
+    def _remove_session(self, session_id: str) -> Optional[SessionData]:
+        """从注册表中移除会话及其回调，返回被移除的会话"""
+        session_data = self.sessions.pop(session_id, None)
+        self.status_callbacks.pop(session_id, None)
+        self.stream_callbacks.pop(session_id, None)
+        self.event_log.drop(session_id)
+        return session_data
+
+    async def _cleanup_agent(self, session_id: str, session_data: Optional[SessionData]):
+        """清理会话的 Agent 实例"""
+        if session_data and session_data.agent_instance:
+            try:
+                await session_data.agent_instance.cleanup()
+            except Exception as e:
+                LOGGER.error(f"Error cleaning up agent for session {session_id}: {e}")
+
+    def _schedule_agent_cleanup(self, session_id: str, session_data: Optional[SessionData]):
+        """在后台清理 Agent 实例，没有 Agent 时不创建任务"""
+        if session_data and session_data.agent_instance:
+            asyncio.create_task(self._cleanup_agent(session_id, session_data))
+        if session_data:
+            LOGGER.info(f"Deleted session: {session_id}")
 
+    async def delete_session(self, session_id: str):
+        """删除会话"""
+        if self.store:
+            self.store.delete_session(session_id)
+        if self.event_bus:
+            self.event_bus.publish(session_id, "deleted", {})
+        session_data = self._remove_session(session_id)
+        if session_data:
+            await self._cleanup_agent(session_id, session_data)
             LOGGER.info(f"Deleted session: {session_id}")
 
+    def _touch(self, session_data: SessionData):
+        """更新活动时间并移到队尾，保持按最后活动时间排序"""
+        session_data.update_activity()
+        self.sessions.move_to_end(session_data.session_id)
+
     def get_session(self, session_id: str) -> Optional[SessionData]:
         """获取会话数据"""
-        if session_id in self.sessions:
-            session = self.sessions[session_id]
+        session = self.sessions.get(session_id)
+        if session is not None:
             if not session.is_expired():
-                session.update_activity()
+                self._touch(session)
                 return session
             else:
-                # 会话已过期，异步删除
-                asyncio.create_task(self.delete_session(session_id))
+                # 会话已过期，立即移出注册表，Agent 在后台清理
+                if self.store:
+                    self.store.delete_session(session_id)
+                self._schedule_agent_cleanup(session_id, self._remove_session(session_id))
         return None
 
     def list_sessions(self) -> List[Dict[str, Any]]:
-        """列出所有活跃会话"""
+        """列出所有活跃会话（最近活动的在前）"""
         active_sessions = []
-        for session_id, session_data in self.sessions.items():
-            if not session_data.is_expired():
-                active_sessions.append(session_data.to_dict())
+        for session_data in reversed(self.sessions.values()):
+            # 从队尾向前遍历，遇到第一个过期会话时其余会话也都已过期
+            if session_data.is_expired():
+                break
+            active_sessions.append(session_data.to_dict())
         return active_sessions
 
-    def add_status_callback(self, session_id: str, callback: Callable[[str, str], None]):
+    def add_status_callback(self, session_id: str, callback: Callable[[str, str, int], None]):
         """添加状态回调函数"""
         if session_id not in self.status_callbacks:
             self.status_callbacks[session_id] = []
         self.status_callbacks[session_id].append(callback)
 
-    def remove_status_callback(self, session_id: str, callback: Callable[[str, str], None]):
+    def remove_status_callback(self, session_id: str, callback: Callable[[str, str, int], None]):
         """移除状态回调函数"""
         if session_id in self.status_callbacks:
             try:
@@ -170,13 +351,13 @@ class SessionManager:
             except ValueError:
                 pass
 
-    def add_stream_callback(self, session_id: str, callback: Callable[[str, Any], None]):
+    def add_stream_callback(self, session_id: str, callback: Callable[[str, Any, int], None]):
         """添加流式回调函数"""
         if session_id not in self.stream_callbacks:
             self.stream_callbacks[session_id] = []
         self.stream_callbacks[session_id].append(callback)
 
-    def remove_stream_callback(self, session_id: str, callback: Callable[[str, Any], None]):
+    def remove_stream_callback(self, session_id: str, callback: Callable[[str, Any, int], None]):
         """移除流式回调函数"""
         if session_id in self.stream_callbacks:
             try:
@@ -186,26 +367,207 @@ class SessionManager:
 
     def _emit_status(self, session_id: str, status: str, details: str = ""):
         """发送状态更新到所有回调"""
-        if session_id in self.sessions:
-            self.sessions[session_id].status = status
-            self.sessions[session_id].update_activity()
-
+        session_data = self.sessions.get(session_id)
+        if session_data is not None:
+            session_data.status = status
+            self._touch(session_data)
+
+        seq = self._record_status(session_id, status, details)
+        self._deliver_status(session_id, status, details, seq)
+        if self.event_bus:
+            self.event_bus.publish(session_id, "status", {"status": status, "details": details, "seq": seq})
+
+    def _deliver_status(self, session_id: str, status: str, details: str, seq: Optional[int]):
+        """把状态更新交给本 worker 上的回调"""
         if session_id in self.status_callbacks:
             for callback in self.status_callbacks[session_id]:
                 try:
-                    callback(status, details)
+                    callback(status, details, seq)
                 except Exception as e:
                     LOGGER.error(f"Error in status callback: {e}")
 
     async def _emit_stream(self, session_id: str, stream_type: str, data: Any):
         """发送流式数据到所有回调"""
+        seq = self._record_stream(session_id, stream_type, data)
+        if self.event_bus:
+            self.event_bus.publish(session_id, "stream", {"stream_type": stream_type, "data": data, "seq": seq})
+        await self._deliver_stream(session_id, stream_type, data, seq)
+
+    async def _deliver_stream(self, session_id: str, stream_type: str, data: Any, seq: int):
+        """把流式数据交给本 worker 上的回调"""
         if session_id in self.stream_callbacks:
             for callback in self.stream_callbacks[session_id]:
                 try:
-                    await callback(stream_type, data)
+                    await callback(stream_type, data, seq)
                 except Exception as e:
                     LOGGER.error(f"Error in stream callback: {e}")
 
+    def _record_status(self, session_id: str, status: str, details: str, seq: Optional[int] = None) -> int:
+        return self.record_event(session_id, {
+            "type": "status",
+            "status": status,
+            "details": details,
+            "timestamp": datetime.now().isoformat()
+        }, seq)["seq"]
+
+    def _record_stream(self, session_id: str, stream_type: str, data: Any, seq: Optional[int] = None) -> int:
+        return self.record_event(session_id, {
+            "type": "stream",
+            "stream_type": stream_type,
+            "data": data,
+            "timestamp": datetime.now().isoformat()
+        }, seq)["seq"]
+
+    def record_event(self, session_id: str, message: Dict[str, Any], seq: Optional[int] = None) -> Dict[str, Any]:
+        """把发给客户端的消息记入会话事件日志，返回带序号的消息"""
+        return self.event_log.record(session_id, message, seq)
+
+    async def replay_events(self, session_id: str, last_seq: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """获取序号大于 last_seq 的事件，以及中间是否没有缺失"""
+        return await self.event_log.since(session_id, last_seq)
+
+    async def _on_bus_event(self, session_id: str, kind: str, payload: Dict[str, Any]):
+        """处理其他 worker 发布的事件；在事件总线的轮询任务中执行，不等待客户端"""
+        if kind == "status":
+            # 与本 worker 的序号不冲突时沿用发布方的序号，否则由事件日志重新编号；投递使用记录后的序号
+            seq = self._record_status(session_id, payload["status"], payload["details"], payload.get("seq"))
+            self._hand_off(session_id, ("status", payload["status"], payload["details"], seq))
+        elif kind == "stream":
+            seq = self._record_stream(session_id, payload["stream_type"], payload["data"], payload.get("seq"))
+            self._hand_off(session_id, ("stream", payload["stream_type"], payload["data"], seq))
+        elif kind == "updated":
+            self._release_session(session_id)
+        elif kind == "deleted":
+            self._schedule_agent_cleanup(session_id, self._remove_session(session_id))
+        elif kind == "forward":
+            if payload["owner"] == self.event_bus.worker_id:
+                request_id = payload["request_id"]
+                task = asyncio.create_task(self._handle_forwarded(session_id, payload))
+                self._forwarded_runs[request_id] = task
+                task.add_done_callback(lambda _: self._forwarded_runs.pop(request_id, None))
+        elif kind == "cancel_forward":
+            task = self._forwarded_runs.get(payload["request_id"])
+            if task is not None:
+                task.cancel()
+        elif kind == "forward_result":
+            future = self._forwarded.get(payload["request_id"])
+            if future is not None and not future.done():
+                future.set_result(payload)
+
+    def _hand_off(self, session_id: str, event: Tuple[str, str, Any, int]):
+        """把转发来的事件放入会话的投递队列，队列已满（本地客户端读取太慢）时：
+
+        - content / reasoning 增量与队尾同类型增量合并（使用最后一条的序号）
+        - 状态更新从不丢弃，必要时允许超出上限
+        - 其他流式数据被丢弃（已记入事件日志），并在队列中放入一条 resync_required 标记，
+          客户端收到后带上 last_seq 重连补发；合并增量本身会造成 seq 跳跃，不能靠它发现丢失
+        """
+        if session_id not in self.status_callbacks and session_id not in self.stream_callbacks:
+            return
+        lane = self._bus_deliveries.get(session_id)
+        if lane is None:
+            lane = self._bus_deliveries[session_id] = deque()
+            task = asyncio.create_task(self._drain_bus_deliveries(session_id, lane))
+            self._bus_delivery_tasks[session_id] = task
+
+        kind, name, data, seq = event
+        if kind == "stream" and name in COALESCED_STREAM_TYPES and isinstance(data, str) and lane:
+            tail_kind, tail_name, tail_data, _ = lane[-1]
+            if tail_kind == "stream" and tail_name == name and isinstance(tail_data, str):
+                lane[-1] = (kind, name, tail_data + data, seq)
+                self.bus_deliveries_coalesced += 1
+                return
+        if len(lane) >= EVENT_BUS_DELIVERY_QUEUE:
+            if kind == "stream":
+                self.bus_deliveries_dropped += 1
+                if not any(queued[0] == RESYNC_REQUIRED for queued in lane):
+                    lane.append((RESYNC_REQUIRED, "", "", None))
+                return
+            self.bus_deliveries_overflow += 1
+        lane.append(event)
+
+    async def _drain_bus_deliveries(self, session_id: str, lane: Deque[Tuple[str, str, Any, Optional[int]]]):
+        """依次投递会话队列中的事件，队列为空时结束"""
+        try:
+            while lane:
+                kind, name, data, seq = lane.popleft()
+                if kind == "status":
+                    self._deliver_status(session_id, name, data, seq)
+                elif kind == RESYNC_REQUIRED:
+                    self._deliver_status(session_id, RESYNC_REQUIRED, "部分转发事件未能送达，请带上 last_seq 重连补发", None)
+                else:
+                    await self._deliver_stream(session_id, name, data, seq)
+        finally:
+            if self._bus_deliveries.get(session_id) is lane:
+                del self._bus_deliveries[session_id]
+                del self._bus_delivery_tasks[session_id]
+
+    def _release_session(self, session_id: str):
+        """会话在其他 worker 上被修改：丢弃本地缓存（保留回调），下次访问时从存储重新加载"""
+        if session_id in self._running:
+            # 正在处理请求，结束后再丢弃
+            self._stale.add(session_id)
+            return
+        session_data = self.sessions.pop(session_id, None)
+        if session_data and session_data.agent_instance:
+            asyncio.create_task(self._cleanup_agent(session_id, session_data))
+
+    async def _publish_session_update(self, session_id: str):
+        """会话写入存储后通知其他 worker 丢弃缓存"""
+        if session_id in self._stale:
+            self._stale.discard(session_id)
+            self._release_session(session_id)
+        if not self.event_bus:
+            return
+        try:
+            if self.store:
+                await self.store.flush()
+            self.event_bus.publish(session_id, "updated", {})
+            await self.event_bus.flush()
+        except Exception as e:
+            LOGGER.error(f"Failed to publish update for session {session_id}: {e}")
+
+    async def _forward_request(self, session_id: str, owner: str, request: str) -> str:
+        """把请求转发给会话所属的 worker，并等待结果（状态和流式数据经事件总线返回）"""
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._forwarded[request_id] = future
+        LOGGER.info(f"Forwarding request for session {session_id} to worker {owner}")
+        try:
+            self.event_bus.publish(session_id, "forward", {
+                "request_id": request_id, "owner": owner, "request": request
+            })
+            result = await asyncio.wait_for(future, STICKY_FORWARD_TIMEOUT)
+        except asyncio.CancelledError:
+            # 请求方已取消，通知所属 worker 停止处理
+            self.event_bus.publish(session_id, "cancel_forward", {"request_id": request_id})
+            raise
+        finally:
+            self._forwarded.pop(request_id, None)
+        # 本 worker 上的缓存已过期
+        self._release_session(session_id)
+
+        if "error" in result:
+            if "retry_after" in result:
+                raise AdmissionRejectedError(result["error"], result["retry_after"])
+            if result.get("not_found"):
+                raise ValueError(result["error"])
+            raise RuntimeError(result["error"])
+        return result["result"]
+
+    async def _handle_forwarded(self, session_id: str, payload: Dict[str, Any]):
+        """处理其他 worker 转发来的请求"""
+        response: Dict[str, Any] = {"request_id": payload["request_id"]}
+        try:
+            response["result"] = await self.process_travel_request(session_id, payload["request"])
+        except ValueError as e:
+            response.update(error=str(e), not_found=True)
+        except AdmissionRejectedError as e:
+            response.update(error=str(e), retry_after=e.retry_after)
+        except Exception as e:
+            response["error"] = str(e)
+        self.event_bus.publish(session_id, "forward_result", response)
+
     async def _get_or_create_agent(self, session_id: str) -> TravelAgent:
         """获取或创建 Agent 实例"""
         session_data = self.get_session(session_id)
@@ -223,20 +585,121 @@ class SessionManager:
             agent.set_status_callback(lambda status, details: self._emit_status(session_id, status, details))
             
             # 设置流式回调
-            agent.set_stream_callback(lambda stream_type, data: asyncio.create_task(self._emit_stream(session_id, stream_type, data)))
+            # Agent 会等待回调完成：事件按顺序进入连接的有界队列，队列已满时形成背压
+            agent.set_stream_callback(lambda stream_type, data: self._emit_stream(session_id, stream_type, data))
             
             # 初始化 Agent
             await agent.init()
+            self._seed_agent_history(agent, session_data)
             session_data.agent_instance = agent
 
         return session_data.agent_instance
 
+    @staticmethod
+    def _seed_agent_history(agent: TravelAgent, session_data: SessionData):
+        """把 Agent 创建之前的对话（如命中方案缓存的轮次）写入模型的消息历史，最后一条为当前请求，不写入"""
+        for message in session_data.chat_history[:-1]:
+            if message.get("role") in ("user", "assistant"):
+                agent.llm.messages.append({"role": message["role"], "content": message["content"]})
+
+    async def _serve_cached_plan(self, session_id: str, session_data: SessionData, request: str) -> Optional[str]:
+        """查找可复用的方案，命中时一次性推送完整方案"""
+        try:
+            cached = await self.plan_cache.lookup(request, session_data.user_profile)
+        except Exception as e:
+            LOGGER.error(f"Plan cache lookup failed: {e}")
+            return None
+        if cached is None:
+            return None
+
+        LOGGER.success(f"Serving cached plan for session {session_id} (similarity {cached.similarity:.3f})")
+        await self._emit_stream(session_id, "reasoning", "找到了相似需求的已生成方案，直接返回\n")
+        await self._emit_stream(session_id, "content", cached.plan)
+        self._append_history(session_data, {
+            "role": "assistant",
+            "content": cached.plan,
+            "timestamp": datetime.now().isoformat(),
+            "cached": True
+        })
+        self._emit_status(session_id, "completed", "旅行规划完成（使用缓存方案）")
+        return cached.plan
+
+    async def _store_plan(self, request: str, user_profile: UserProfile, plan: str, tool_names: set[str]):
+        try:
+            await self.plan_cache.put(request, user_profile, plan, tool_names)
+        except Exception as e:
+            LOGGER.error(f"Failed to cache plan: {e}")
+
     async def process_travel_request(self, session_id: str, request: str) -> str:
         """处理旅行规划请求"""
-        session_data = self.get_session(session_id)
+        session_data = await self.load_session(session_id)
         if not session_data:
             raise ValueError(f"Session {session_id} not found")
 
+        task = asyncio.current_task()
+        self._runs[session_id] = task
+        try:
+            if self.sticky:
+                owner = await self.event_bus.claim(session_id)
+                if owner != self.event_bus.worker_id:
+                    return await self._forward_request(session_id, owner, request)
+
+            def on_queue_position(position: int, total: int):
+                self._emit_status(session_id, "queued", f"当前请求较多，正在排队：第 {position} 位（共 {total} 位）")
+
+            self._running.add(session_id)
+            try:
+                # 超出并发上限时按会话轮转排队，队列已满时抛出 AdmissionRejectedError
+                async with self.admission.admit(session_id, on_queue_position):
+                    return await self._process_travel_request(session_id, session_data, request)
+            finally:
+                self._running.discard(session_id)
+                await self._publish_session_update(session_id)
+        except asyncio.CancelledError:
+            self.run_stats["cancelled"] += 1
+            raise
+        finally:
+            if self._runs.get(session_id) is task:
+                del self._runs[session_id]
+
+    def cancel_run(self, session_id: str) -> bool:
+        """取消会话当前正在执行的请求，返回是否有请求被取消"""
+        task = self._runs.get(session_id)
+        if task is None or task.done():
+            return False
+        LOGGER.info(f"Cancelling travel request for session {session_id}")
+        task.cancel()
+        return True
+
+    @staticmethod
+    def _run_counters(agent: TravelAgent) -> Dict[str, int]:
+        return {
+            "completion_tokens": agent.llm.usage_totals.get("completion_tokens", 0) if agent.llm else 0,
+            "llm_calls_cancelled": agent.llm.interrupted_chats if agent.llm else 0,
+            "tool_calls_cancelled": agent.interrupted_tool_calls,
+        }
+
+    def _record_run(self, agent: TravelAgent, before: Dict[str, int], cancelled: bool):
+        """累计单次请求的 token 用量以及取消时避免的 LLM / 工具调用"""
+        delta = {key: value - before[key] for key, value in self._run_counters(agent).items()}
+        if not cancelled:
+            self.run_stats["completed"] += 1
+            self.run_stats["completion_tokens"] += delta["completion_tokens"]
+            return
+        self.run_stats["llm_calls_cancelled"] += delta["llm_calls_cancelled"]
+        self.run_stats["tool_calls_cancelled"] += delta["tool_calls_cancelled"]
+        if self.run_stats["completed"]:
+            average = self.run_stats["completion_tokens"] / self.run_stats["completed"]
+            self.run_stats["completion_tokens_avoided"] += max(0, round(average - delta["completion_tokens"]))
+
+    async def _process_travel_request(self, session_id: str, session_data: SessionData, request: str) -> str:
+        # 方案缓存只用于会话的首轮请求，后续请求依赖之前的对话内容
+        use_plan_cache = self.plan_cache is not None and not any(
+            message.get("role") == "assistant" for message in session_data.chat_history
+        )
+        agent: Optional[TravelAgent] = None
+        counters: Dict[str, int] = {}
+
         try:
             # 添加用户消息到历史
             user_message = {
@@ -244,11 +707,17 @@ class SessionManager:
                 "content": request,
                 "timestamp": datetime.now().isoformat()
             }
-            session_data.chat_history.append(user_message)
             session_data.current_request = request
+            self._append_history(session_data, user_message)
+
+            if use_plan_cache:
+                cached_plan = await self._serve_cached_plan(session_id, session_data, request)
+                if cached_plan is not None:
+                    return cached_plan
 
             # 获取 Agent 实例
             agent = await self._get_or_create_agent(session_id)
+            counters = self._run_counters(agent)
 
             # 执行旅行规划
             self._emit_status(session_id, "processing", "开始处理您的旅行规划请求...")
@@ -265,11 +734,33 @@ class SessionManager:
                 "content": result,
                 "timestamp": datetime.now().isoformat()
             }
-            session_data.chat_history.append(assistant_message)
+            self._append_history(session_data, assistant_message)
+            self._record_run(agent, counters, cancelled=False)
+
+            if use_plan_cache:
+                # 向量化在后台完成，不延迟本次响应
+                asyncio.create_task(self._store_plan(
+                    request, replace(session_data.user_profile), result, set(agent.used_tools)
+                ))
 
             self._emit_status(session_id, "completed", "旅行规划完成")
             return result
 
+        except asyncio.CancelledError:
+            LOGGER.info(f"Travel request cancelled for session {session_id}")
+            if agent is not None and counters:
+                # 被中断的工具调用写入占位结果，下一轮请求的消息历史仍然合法
+                agent.repair_after_cancel()
+                self._record_run(agent, counters, cancelled=True)
+            self._append_history(session_data, {
+                "role": "system",
+                "content": "请求已取消",
+                "timestamp": datetime.now().isoformat(),
+                "cancelled": True
+            })
+            self._emit_status(session_id, "cancelled", "请求已取消")
+            raise
+
         except Exception as e:
             error_msg = f"处理请求时出错: {str(e)}"
             LOGGER.error(f"Error processing travel request for session {session_id}: {e}")
@@ -280,7 +771,7 @@ class SessionManager:
                 "content": error_msg,
                 "timestamp": datetime.now().isoformat()
             }
-            session_data.chat_history.append(error_message)
+            self._append_history(session_data, error_message)
             
             self._emit_status(session_id, "error", error_msg)
             raise
@@ -295,6 +786,9 @@ class SessionManager:
         for key, value in profile_updates.items():
             if hasattr(session_data.user_profile, key):
                 setattr(session_data.user_profile, key, value)
+        self._persist_meta(session_data)
+        if self.event_bus:
+            asyncio.create_task(self._publish_session_update(session_id))
 
         LOGGER.info(f"Updated user profile for session {session_id}")
 
@@ -306,31 +800,64 @@ class SessionManager:
 
         return session_data.chat_history[-limit:] if limit else session_data.chat_history
 
+    def get_run_stats(self) -> Dict[str, Any]:
+        """获取请求处理和取消统计"""
+        return {
+            "running": len(self._runs),
+            **self.run_stats,
+            "bus_deliveries_pending": sum(len(lane) for lane in self._bus_deliveries.values()),
+            "bus_deliveries_coalesced": self.bus_deliveries_coalesced,
+            "bus_deliveries_dropped": self.bus_deliveries_dropped,
+            "bus_deliveries_overflow": self.bus_deliveries_overflow,
+        }
+
     async def _cleanup_expired_sessions(self):
-        """定期清理过期会话"""
+        """在队首会话的过期时间清理过期会话"""
         while True:
             try:
-                await asyncio.sleep(60)  # 每分钟检查一次
-                
-                expired_sessions = []
-                for session_id, session_data in self.sessions.items():
-                    if session_data.is_expired():
-                        expired_sessions.append(session_id)
-
-                for session_id in expired_sessions:
+                self._cleanup_wakeup.clear()
+                if self.sessions:
+                    oldest = next(iter(self.sessions.values()))
+                    delay = (oldest.expires_at() - datetime.now()).total_seconds()
+                    if delay > 0:
+                        # 队首被访问后会移到队尾，醒来后重新计算即可
+                        await asyncio.sleep(delay + 0.01)
+                        continue
+                else:
+                    # 内存中没有会话时仍要定期清理会话存储中过期的会话
+                    try:
+                        await asyncio.wait_for(self._cleanup_wakeup.wait(), SESSION_TIMEOUT)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+
+                # 过期会话都在队首，遇到第一个未过期的会话即停止
+                while self.sessions:
+                    session_id, session_data = next(iter(self.sessions.items()))
+                    if not session_data.is_expired():
+                        break
                     await self.delete_session(session_id)
                     LOGGER.info(f"Cleaned up expired session: {session_id}")
 
+                if self.store:
+                    # 已被淘汰出内存的会话只存在于存储中，一并清理
+                    await self.store.purge_expired(datetime.now().timestamp() - SESSION_TIMEOUT)
+
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 LOGGER.error(f"Error in cleanup task: {e}")
 
     async def _cleanup_all_sessions(self):
-        """清理所有会话"""
+        """清理所有会话（有会话存储时只释放内存，会话在重启后恢复）"""
         session_ids = list(self.sessions.keys())
         for session_id in session_ids:
-            await self.delete_session(session_id)
+            if self.store:
+                session_data = self._remove_session(session_id)
+                self._persist_meta(session_data)
+                await self._cleanup_agent(session_id, session_data)
+            else:
+                await self.delete_session(session_id)
 
 
 # 全局会话管理器实例
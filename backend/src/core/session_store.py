@@ -0,0 +1,273 @@
+"""
+Session Store for Travel Assistant
+会话持久化存储：会话元数据按会话覆盖写入，聊天记录只追加写入；
+写操作先进入内存队列，由后台任务批量提交（每批一次事务、一次 fsync）
+"""
+
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.info import (
+    SESSION_DB_PATH, SESSION_STORE, SESSION_STORE_FLUSH_BATCH, SESSION_STORE_FLUSH_INTERVAL_MS
+)
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[SessionStore]")
+
+
+class SessionStore(ABC):
+    """会话存储接口
+
+    写方法（save_session / append_message / delete_session）只入队，不等待落盘；
+    读方法在读取前会先提交队列中的写操作
+    """
+
+    async def start(self) -> None:
+        """打开存储并启动后台写入任务"""
+
+    @abstractmethod
+    def save_session(self, session_id: str, meta: Dict[str, Any], last_activity: float) -> None:
+        """写入会话元数据（同一会话的多次写入只保留最后一次），last_activity 用于清理过期会话"""
+
+    @abstractmethod
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> None:
+        """追加一条聊天记录"""
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> None:
+        """删除会话及其聊天记录"""
+
+    @abstractmethod
+    async def load_session(self, session_id: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """读取会话元数据和聊天记录，不存在时返回 None"""
+
+    async def purge_expired(self, before: float) -> int:
+        """删除最后活动时间早于 before 的会话，返回删除的数量"""
+        return 0
+
+    async def flush(self) -> None:
+        """立即提交队列中的写操作"""
+
+    async def close(self) -> None:
+        """提交剩余写操作并关闭存储"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于 SQLite 的会话存储"""
+
+    def __init__(
+        self,
+        db_path: str,
+        flush_interval: float = SESSION_STORE_FLUSH_INTERVAL_MS / 1000,
+        flush_batch: int = SESSION_STORE_FLUSH_BATCH,
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending_meta: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._pending_messages: List[Tuple[str, str, float]] = []
+        self._pending_deletes: set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages_written = 0
+        self.loads = 0
+        self.write_errors = 0
+        self._session_count = 0  # 已落盘的会话数，由写入线程维护，避免统计时扫描整表
+
+    def _open_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # 每次提交都 fsync，写操作按批提交以分摊开销
+        db.execute("PRAGMA synchronous=FULL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, meta TEXT NOT NULL, last_activity REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "message TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_session_messages_session ON session_messages (session_id, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions (last_activity)")
+        db.commit()
+        self._session_count = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return db
+
+    async def start(self) -> None:
+        # 数据库在启动时打开，导入模块时不创建文件
+        if self._db is None:
+            self._db = await asyncio.to_thread(self._open_db)
+            LOGGER.info(f"Session store enabled: {self.db_path}")
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer_loop())
+
+    def save_session(self, session_id: str, meta: Dict[str, Any], last_activity: float) -> None:
+        self._pending_deletes.discard(session_id)
+        self._pending_meta[session_id] = (meta, last_activity)
+        self._notify()
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> None:
+        self._pending_messages.append((session_id, json.dumps(message, ensure_ascii=False), time.time()))
+        self._notify()
+
+    def delete_session(self, session_id: str) -> None:
+        self._pending_meta.pop(session_id, None)
+        self._pending_messages = [item for item in self._pending_messages if item[0] != session_id]
+        self._pending_deletes.add(session_id)
+        self._notify()
+
+    def _notify(self) -> None:
+        if len(self._pending_meta) + len(self._pending_messages) >= self.flush_batch:
+            self._wakeup.set()
+
+    async def _writer_loop(self) -> None:
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                LOGGER.error(f"Error in session store writer: {e}")
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            # 启动前的写操作留在队列中，启动后提交
+            if self._db is None or not (self._pending_meta or self._pending_messages or self._pending_deletes):
+                return
+            meta, messages, deletes = self._pending_meta, self._pending_messages, self._pending_deletes
+            self._pending_meta, self._pending_messages, self._pending_deletes = {}, [], set()
+            try:
+                await asyncio.to_thread(self._db_write, meta, messages, deletes)
+            except Exception:
+                # 写入失败时放回队列，下一批重试；写入期间的新操作优先：
+                # 之后被删除的会话丢弃旧的元数据和聊天记录，之后重新保存的会话不再恢复旧的删除
+                self.write_errors += 1
+                resaved, deleted = set(self._pending_meta), set(self._pending_deletes)
+                for session_id, value in meta.items():
+                    if session_id not in deleted:
+                        self._pending_meta.setdefault(session_id, value)
+                self._pending_messages[:0] = [item for item in messages if item[0] not in deleted]
+                self._pending_deletes |= deletes - resaved
+                raise
+            self.batches += 1
+            self.messages_written += len(messages)
+
+    def _db_write(
+        self, meta: Dict[str, Tuple[Dict[str, Any], float]], messages: List[Tuple[str, str, float]], deletes: set[str]
+    ) -> None:
+        with self._db_lock, self._db:
+            added = 0
+            for session_id, (value, last_activity) in meta.items():
+                serialized = json.dumps(value, ensure_ascii=False)
+                updated = self._db.execute(
+                    "UPDATE sessions SET meta = ?, last_activity = ? WHERE session_id = ?",
+                    (serialized, last_activity, session_id),
+                ).rowcount
+                if not updated:
+                    self._db.execute(
+                        "INSERT INTO sessions (session_id, meta, last_activity) VALUES (?, ?, ?)",
+                        (session_id, serialized, last_activity),
+                    )
+                    added += 1
+            self._db.executemany(
+                "INSERT INTO session_messages (session_id, message, created_at) VALUES (?, ?, ?)", messages
+            )
+            for session_id in deletes:
+                added -= self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+                self._db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+        # 事务提交后才更新计数
+        self._session_count += added
+
+    async def load_session(self, session_id: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        if self._db is None:
+            return None
+        await self.flush()
+        row = await asyncio.to_thread(self._db_load, session_id)
+        if row is None:
+            return None
+        self.loads += 1
+        meta, messages = row
+        return json.loads(meta), [json.loads(message) for message in messages]
+
+    def _db_load(self, session_id: str) -> Optional[Tuple[str, List[str]]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT meta FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            messages = self._db.execute(
+                "SELECT message FROM session_messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+        return row[0], [message for (message,) in messages]
+
+    async def purge_expired(self, before: float) -> int:
+        if self._db is None:
+            return 0
+        await self.flush()
+        return await asyncio.to_thread(self._db_purge, before)
+
+    def _db_purge(self, before: float) -> int:
+        with self._db_lock, self._db:
+            self._db.execute(
+                "DELETE FROM session_messages WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE last_activity < ?)",
+                (before,),
+            )
+            purged = self._db.execute("DELETE FROM sessions WHERE last_activity < ?", (before,)).rowcount
+        self._session_count -= purged
+        return purged
+
+    async def close(self) -> None:
+        if self._writer_task:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            LOGGER.error(f"Failed to flush session store on close: {e}")
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "sessions": self._session_count,
+            "pending_writes": len(self._pending_meta) + len(self._pending_messages) + len(self._pending_deletes),
+            "batches": self.batches,
+            "messages_written": self.messages_written,
+            "loads": self.loads,
+            "write_errors": self.write_errors,
+        }
+
+
+def create_session_store(kind: str = SESSION_STORE) -> Optional[SessionStore]:
+    """按配置创建会话存储，memory 表示不持久化"""
+    if kind == "sqlite":
+        return SQLiteSessionStore(SESSION_DB_PATH)
+    if kind != "memory":
+        LOGGER.warning(f"Unknown session store {kind!r}, sessions will not be persisted")
+    return None
+
+
+# 全局会话存储实例
+session_store = create_session_store()
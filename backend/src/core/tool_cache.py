@@ -0,0 +1,219 @@
+"""
+Tool Result Cache for Travel Assistant
+工具调用结果缓存：按工具配置 TTL，内存 LRU + 可选 SQLite 持久层
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from mcp.types import CallToolResult
+
+from src.utils.info import TOOL_CACHE_DB_PATH, TOOL_CACHE_ENABLED, TOOL_CACHE_MAX_ENTRIES
+from src.utils.pretty import ALogger
+
+LOGGER = ALogger("[ToolCache]")
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# 各工具的缓存时间（秒），未列出的工具不缓存
+DEFAULT_TOOL_TTLS: Dict[str, int] = {
+    # 地理编码和地点信息极少变化
+    "map_geocode": 7 * DAY,
+    "map_reverse_geocode": 7 * DAY,
+    "map_place_detail": DAY,
+    "map_search_places": DAY,
+    "map_search_nearby": DAY,
+    "map_distance": DAY,
+    # 路线受实时路况影响
+    "map_direction": HOUR,
+    # 天气数据
+    "get_current_weather": 10 * MINUTE,
+    "get_weather_forecast": HOUR,
+    "get_weather_alerts": 10 * MINUTE,
+    "get_weather_batch": HOUR,
+}
+
+
+class ToolResultCache:
+    """工具调用结果缓存
+
+    配置了 db_path 时 SQLite 持久层在 start 时打开，之前只使用内存层
+    """
+
+    def __init__(
+        self,
+        max_entries: int = TOOL_CACHE_MAX_ENTRIES,
+        db_path: str = "",
+        ttls: Optional[Dict[str, int]] = None,
+    ):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.ttls = dict(DEFAULT_TOOL_TTLS if ttls is None else ttls)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    async def start(self) -> None:
+        """打开 SQLite 持久层"""
+        if self.db_path and self._db is None:
+            self._db = await asyncio.to_thread(self._open_db)
+            LOGGER.info(f"Tool cache disk tier enabled: {self.db_path}")
+
+    def _open_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS tool_cache ("
+            "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        db.execute("DELETE FROM tool_cache WHERE expires_at <= ?", (time.time(),))
+        db.commit()
+        return db
+
+    async def close(self) -> None:
+        """关闭 SQLite 持久层"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def get_ttl(self, tool_name: str) -> int:
+        """获取工具的缓存时间，0 表示不缓存"""
+        return self.ttls.get(tool_name, 0)
+
+    @staticmethod
+    def make_key(server: str, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """生成缓存键：参数按键排序后序列化，保证等价参数得到相同的键"""
+        return json.dumps(
+            [server, tool_name, arguments],
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+
+    async def get(self, server: str, tool_name: str, arguments: Dict[str, Any]) -> Optional[CallToolResult]:
+        """查询缓存，未命中返回 None"""
+        if self.get_ttl(tool_name) <= 0:
+            return None
+
+        key = self.make_key(server, tool_name, arguments)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, payload = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return CallToolResult.model_validate_json(payload)
+            del self._entries[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key)
+            if row is not None and row[0] > now:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return CallToolResult.model_validate_json(row[1])
+
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def is_cacheable(result: CallToolResult) -> bool:
+        """结果是否可以缓存
+
+        工具服务器常把失败作为普通文本返回（isError 为 False），因此只缓存能解析为 JSON 的成功结果：
+        非 JSON 文本（如 "获取天气预报失败: ..."）、百度接口的非零状态、带 error 字段的结果
+        以及批量结果中任一条目出错时都不缓存
+        """
+        if result.isError or not result.content or result.content[0].type != "text":
+            return False
+        try:
+            data = json.loads(result.content[0].text)
+        except ValueError:
+            return False
+        if isinstance(data, dict):
+            if data.get("status") not in (None, 0, "0") or "error" in data:
+                return False
+            results = data.get("results")
+            if isinstance(results, list) and any(isinstance(item, dict) and "error" in item for item in results):
+                return False
+        return True
+
+    async def put(self, server: str, tool_name: str, arguments: Dict[str, Any], result: CallToolResult) -> None:
+        """写入缓存，错误结果不缓存"""
+        ttl = self.get_ttl(tool_name)
+        if ttl <= 0:
+            return
+        if not self.is_cacheable(result):
+            self.rejected += 1
+            return
+
+        key = self.make_key(server, tool_name, arguments)
+        expires_at = time.time() + ttl
+        payload = result.model_dump_json()
+        self._remember(key, expires_at, payload)
+
+        if self._db is not None:
+            await asyncio.to_thread(self._db_put, key, expires_at, payload)
+
+    def _remember(self, key: str, expires_at: float, payload: str) -> None:
+        """写入内存层，超出容量时淘汰最久未使用的条目"""
+        self._entries[key] = (expires_at, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _db_get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT expires_at, payload FROM tool_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _db_put(self, key: str, expires_at: float, payload: str) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tool_cache (key, expires_at, payload) VALUES (?, ?, ?)",
+                (key, expires_at, payload),
+            )
+            self._db.commit()
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM tool_cache")
+                self._db.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "disk_tier": self._db is not None,
+        }
+
+
+# 全局工具结果缓存实例
+tool_result_cache = ToolResultCache(db_path=TOOL_CACHE_DB_PATH) if TOOL_CACHE_ENABLED else None
@@ -0,0 +1,80 @@
+"""
+Tool Output Formatting for Travel Assistant
+把 MCP 工具结果转换为写入消息历史的文本：只保留文本内容，
+JSON 压缩为单行，并按工具去掉结果顶层固定的提示类字段和 null 值
+"""
+
+import json
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from mcp.types import CallToolResult
+
+from src.utils.info import TOOL_OUTPUT_MODE, TOOL_OUTPUT_OMIT_KEYS
+
+
+def parse_omit_keys(specs: Iterable[str]) -> Dict[str, FrozenSet[str]]:
+    """解析 "工具名:字段" 列表为 {工具名: 字段集合}"""
+    omit: Dict[str, set] = {}
+    for spec in specs:
+        tool_name, _, key = spec.partition(":")
+        if tool_name.strip() and key.strip():
+            omit.setdefault(tool_name.strip(), set()).add(key.strip())
+    return {tool_name: frozenset(keys) for tool_name, keys in omit.items()}
+
+
+OMIT_KEYS = parse_omit_keys(TOOL_OUTPUT_OMIT_KEYS)
+
+
+def omitted_keys(tool_name: Optional[str], omit: Dict[str, FrozenSet[str]] = OMIT_KEYS) -> FrozenSet[str]:
+    """该工具结果中要省略的顶层字段"""
+    return omit.get("*", frozenset()) | omit.get(tool_name or "", frozenset())
+
+
+def prune_json(value: Any, omit_keys: Iterable[str] = ()) -> Any:
+    """删除顶层的指定字段和各层的 null 值
+
+    只删除已知的顶层固定字段：嵌套对象中的同名字段（例如批量结果中每个城市的 note）
+    可能是对结果的说明，和空列表、空字典一样保留，模型需要知道结果为空的原因
+    """
+    def prune(node: Any) -> Any:
+        if isinstance(node, dict):
+            return {key: prune(child) for key, child in node.items() if child is not None}
+        if isinstance(node, list):
+            return [prune(child) for child in node if child is not None]
+        return node
+
+    if isinstance(value, dict):
+        omit_keys = frozenset(omit_keys)
+        value = {key: child for key, child in value.items() if key not in omit_keys}
+    return prune(value)
+
+
+def compact_text(text: str, omit_keys: Iterable[str] = ()) -> str:
+    """JSON 文本压缩为单行并精简字段，非 JSON 文本原样返回"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text.strip()
+    return json.dumps(prune_json(data, omit_keys), ensure_ascii=False, separators=(",", ":"))
+
+
+def format_tool_output(result: CallToolResult, tool_name: Optional[str] = None, mode: str = TOOL_OUTPUT_MODE) -> str:
+    """生成传给模型的工具输出
+
+    compact: 只保留文本内容并精简 JSON
+    full: 完整的 CallToolResult JSON（旧格式）
+    """
+    if mode != "compact":
+        return result.model_dump_json()
+
+    omit_keys = omitted_keys(tool_name)
+    parts = []
+    for item in result.content:
+        if item.type == "text":
+            parts.append(compact_text(item.text, omit_keys))
+        elif item.type == "resource" and hasattr(item.resource, "text"):
+            parts.append(compact_text(item.resource.text, omit_keys))
+        else:
+            parts.append(f"[{item.type}]")
+    text = "\n".join(parts)
+    return f"[error] {text}" if result.isError else text
@@ -5,20 +5,39 @@ Travel Assistant Agent
 
 import asyncio
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Callable
 
 from rich import print as rprint
 
-from src.core.chat_openai import AsyncChatOpenAI
+from src.core.admission import admission_controller
+from src.core.chat_openai import AsyncChatOpenAI, ToolCall
+from src.core.geo_cache import GeoCache
 from src.core.mcp_client import MCPClient
+from src.core.mcp_pool import MCPClientLease, mcp_server_pool
 from src.core.mcp_tools import TravelMcpTools
+from src.core.tool_cache import ToolResultCache
+from src.core.tool_output import format_tool_output
 from src.utils import pretty
-from src.utils.info import DEFAULT_MODEL_NAME, PROJECT_ROOT_DIR
+from src.utils.info import DEFAULT_MODEL_NAME, PROJECT_ROOT_DIR, TOOL_CALL_CONCURRENCY
 
 LOGGER = pretty.ALogger("[TravelAgent]")
 
+# 请求被取消时，为未完成的工具调用写入的占位结果
+CANCELLED_TOOL_OUTPUT = "[请求已取消，工具调用未完成]"
+
+# 常见目的地，用于识别请求中的目的地信息
+KNOWN_DESTINATIONS = (
+    "北京", "上海", "天津", "重庆", "杭州", "广州", "深圳", "成都", "西安", "南京", "苏州", "武汉",
+    "长沙", "厦门", "青岛", "大连", "哈尔滨", "沈阳", "长春", "济南", "郑州", "洛阳", "开封", "太原",
+    "平遥", "大同", "石家庄", "承德", "秦皇岛", "北戴河", "合肥", "黄山", "南昌", "景德镇", "福州",
+    "泉州", "武夷山", "桂林", "阳朔", "南宁", "北海", "昆明", "大理", "丽江", "西双版纳", "香格里拉",
+    "贵阳", "遵义", "拉萨", "林芝", "西宁", "兰州", "敦煌", "张掖", "银川", "乌鲁木齐", "喀什",
+    "呼和浩特", "三亚", "海口", "珠海", "佛山", "汕头", "潮州", "无锡", "扬州", "宁波", "舟山",
+    "绍兴", "乌镇", "婺源", "凤凰", "张家界", "九寨沟", "峨眉山", "乐山", "宜昌", "香港", "澳门", "台北",
+)
+
 
 @dataclass
 class UserProfile:
@@ -85,18 +104,24 @@ class MCPContextManager:
         
     def get_structured_context(self) -> str:
         """获取结构化的上下文信息"""
-        context_parts = []
-        
-        # 用户配置文件上下文
-        if self.user_profile:
-            context_parts.append(f"""
+        return "\n".join(part for part in (self.get_static_context(), self.get_volatile_context()) if part)
+    
+    def get_static_context(self) -> str:
+        """获取固定的上下文（用户配置文件），在会话内保持不变，放在请求前缀中"""
+        if not self.user_profile:
+            return ""
+        return f"""
 ## 用户配置文件
 - 姓名: {self.user_profile.name}
 - 居住地: {self.user_profile.home_location}
 - 偏好: {', '.join(self.user_profile.preferences)}
 - 预算: {self.user_profile.budget_range}
 - 旅行风格: {self.user_profile.travel_style}
-""")
+"""
+    
+    def get_volatile_context(self) -> str:
+        """获取易变的上下文（时间、会话信息），随每轮用户消息发送"""
+        context_parts = []
         
         # 环境上下文
         if self.environment_context:
@@ -113,7 +138,6 @@ class MCPContextManager:
 ## 会话信息
 - 会话ID: {self.session_context.session_id}
 - 创建时间: {self.session_context.created_at.isoformat()}
-- 当前请求: {self.session_context.current_request}
 """)
         
         return "\n".join(context_parts)
@@ -130,6 +154,12 @@ class TravelAgent:
     mcp_context_manager: MCPContextManager = None
     status_callback: Optional[Callable[[str, str], None]] = None
     stream_callback: Optional[Callable[[str, Any], None]] = None
+    tool_cache: Optional[ToolResultCache] = None
+    geo_cache: Optional[GeoCache] = None
+    tool_index: Dict[str, MCPClient] = field(default_factory=dict, init=False, repr=False)
+    used_tools: set[str] = field(default_factory=set, init=False, repr=False)  # 本次规划调用过的工具
+    interrupted_tool_calls: int = field(default=0, init=False)  # 因请求取消而中断的工具调用数
+    _client_semaphores: Dict[str, asyncio.Semaphore] = field(default_factory=dict, init=False, repr=False)
 
     def __post_init__(self):
         if self.mcp_context_manager is None:
@@ -138,17 +168,18 @@ class TravelAgent:
     async def init(self) -> None:
         """初始化 Agent"""
         LOGGER.title("INIT TRAVEL AGENT")
-        tools = []
         for mcp_client in self.mcp_clients:
+            # 服务器重新连接后工具列表可能变化，需要刷新路由表
+            mcp_client.add_tools_listener(self._rebuild_tool_index)
             await mcp_client.init()
-            tools.extend(mcp_client.get_tools())
+        tools = self._rebuild_tool_index()
         
         # 更新工具上下文
         self.mcp_context_manager.update_tool_context(tools)
         self.mcp_context_manager.update_environment_context()
         
-        # 获取结构化上下文
-        context = self.mcp_context_manager.get_structured_context()
+        # 固定上下文放在系统提示之后，时间等易变信息随每轮用户消息发送
+        context = self.mcp_context_manager.get_static_context()
         
         self.llm = AsyncChatOpenAI(
             self.model,
@@ -162,7 +193,9 @@ class TravelAgent:
         LOGGER.title("CLEANUP TRAVEL AGENT")
         while self.mcp_clients:
             mcp_client = self.mcp_clients.pop()
+            mcp_client.remove_tools_listener(self._rebuild_tool_index)
             await mcp_client.cleanup()
+        self.tool_index = {}
 
     def set_status_callback(self, callback: Callable[[str, str], None]):
         """设置状态回调函数"""
@@ -193,9 +226,12 @@ class TravelAgent:
                 current_request=request
             )
             self.mcp_context_manager.set_session_context(session_context)
+            self.used_tools = set()
             
             # 更新上下文
             self.mcp_context_manager.update_environment_context()
+            if self.llm is not None:
+                self.llm.set_context(self.mcp_context_manager.get_static_context())
             
             return await self._invoke(request)
         except Exception as e:
@@ -237,7 +273,7 @@ class TravelAgent:
             if "预算" in prompt or "元" in prompt or "钱" in prompt:
                 await self.stream_callback("reasoning", "   - 发现预算信息\n")
                 key_info.append("预算")
-            if any(city in prompt for city in ["北京", "上海", "杭州", "广州", "深圳", "成都", "西安"]):
+            if any(city in prompt for city in KNOWN_DESTINATIONS):
                 await self.stream_callback("reasoning", "   - 发现目的地信息\n")
                 key_info.append("目的地")
             if any(keyword in prompt for keyword in ["亲子", "家庭", "孩子", "儿童"]):
@@ -257,7 +293,8 @@ class TravelAgent:
             prompt, 
             print_llm_output=False,
             stream_callback=handle_stream,
-            tool_call_callback=handle_tool_call
+            tool_call_callback=handle_tool_call,
+            volatile_context=self.mcp_context_manager.get_volatile_context()
         )
         
         i = 0
@@ -283,71 +320,12 @@ class TravelAgent:
                     # 暂停reasoning，开始工具调用
                     await self.stream_callback("reasoning", "\n🔧 开始调用工具...\n")
                 
-                for tool_call in chat_resp.tool_calls:
-                    target_mcp_client: MCPClient | None = None
-                    for mcp_client in self.mcp_clients:
-                        if tool_call.function.name in [t.name for t in mcp_client.get_tools()]:
-                            target_mcp_client = mcp_client
-                            break
-                    
-                    if target_mcp_client:
-                        self._emit_status("tool_calling", f"正在调用 {tool_call.function.name}")
-                        LOGGER.title(f"TOOL USE `{tool_call.function.name}`")
-                        LOGGER.info(f"with args: {tool_call.function.arguments}")
-                        
-                        # 发送工具调用详情
-                        if self.stream_callback:
-                            await self.stream_callback("tool_call_detail", {
-                                "tool_call_id": tool_call.id,
-                                "function_name": tool_call.function.name,
-                                "arguments": tool_call.function.arguments,
-                                "status": "calling"
-                            })
-                        
-                        try:
-                            mcp_result = await target_mcp_client.call_tool(
-                                tool_call.function.name,
-                                json.loads(tool_call.function.arguments),
-                            )
-                            LOGGER.success(f"Tool result: {str(mcp_result)[:200]}...")
-                            self.llm.append_tool_result(
-                                tool_call.id, mcp_result.model_dump_json()
-                            )
-                            
-                            # 发送工具调用结果
-                            if self.stream_callback:
-                                await self.stream_callback("tool_call_result", {
-                                    "tool_call_id": tool_call.id,
-                                    "function_name": tool_call.function.name,
-                                    "result": str(mcp_result)[:500] + "..." if len(str(mcp_result)) > 500 else str(mcp_result),
-                                    "status": "success"
-                                })
-                                # 添加reasoning反馈
-                                await self.stream_callback("reasoning", f"✓ {tool_call.function.name} 调用成功，获得了相关信息\n")
-                        except Exception as e:
-                            LOGGER.error(f"Tool call failed: {e}")
-                            self.llm.append_tool_result(tool_call.id, f"工具调用失败: {str(e)}")
-                            
-                            # 发送工具调用错误
-                            if self.stream_callback:
-                                await self.stream_callback("tool_call_result", {
-                                    "tool_call_id": tool_call.id,
-                                    "function_name": tool_call.function.name,
-                                    "error": str(e),
-                                    "status": "error"
-                                })
-                    else:
-                        LOGGER.warning(f"Tool {tool_call.function.name} not found")
-                        self.llm.append_tool_result(tool_call.id, "工具未找到")
-                        
-                        # 发送工具未找到错误
-                        if self.stream_callback:
-                            await self.stream_callback("tool_call_result", {
-                                "tool_call_id": tool_call.id,
-                                "function_name": tool_call.function.name,
-                                "error": "工具未找到",
-                                "status": "not_found"
-                            })
+                # 并发执行本轮所有工具调用，结果按原始顺序写回消息历史
+                tool_outputs = await asyncio.gather(
+                    *(self._execute_tool_call(tool_call) for tool_call in chat_resp.tool_calls)
+                )
+                for tool_call, tool_output in zip(chat_resp.tool_calls, tool_outputs):
+                    self.llm.append_tool_result(tool_call.id, tool_output)
                 
                 self._emit_status("processing", "正在处理工具返回的信息...")
                 # 添加reasoning反馈
@@ -373,6 +351,151 @@ class TravelAgent:
                     await self.stream_callback("reasoning", "✅ 分析完成，开始生成最终的旅行计划\n")
                 return chat_resp.content
 
+    def _rebuild_tool_index(self) -> list[Any]:
+        """重建工具名到 MCP 客户端的路由表，返回去重后的工具列表"""
+        tool_index: Dict[str, MCPClient] = {}
+        tools = []
+        for mcp_client in self.mcp_clients:
+            for tool in mcp_client.get_tools():
+                owner = tool_index.get(tool.name)
+                if owner is not None:
+                    LOGGER.warning(
+                        f"Tool name collision: {tool.name} is provided by both "
+                        f"{owner.name} and {mcp_client.name}, using {owner.name}"
+                    )
+                    continue
+                tool_index[tool.name] = mcp_client
+                tools.append(tool)
+        
+        self.tool_index = tool_index
+        if self.llm is not None:
+            self.llm.set_tools(tools)
+        return tools
+
+    def resolve_tool(self, tool_name: str) -> MCPClient | None:
+        """查找提供指定工具的 MCP 客户端"""
+        return self.tool_index.get(tool_name)
+
+    def _get_client_semaphore(self, mcp_client: MCPClient) -> asyncio.Semaphore:
+        """获取 MCP 客户端的并发限制信号量"""
+        semaphore = self._client_semaphores.get(mcp_client.name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(TOOL_CALL_CONCURRENCY)
+            self._client_semaphores[mcp_client.name] = semaphore
+        return semaphore
+
+    @staticmethod
+    def _make_refresh(mcp_client, tool_name: str, arguments: Dict[str, Any]) -> Optional[Callable]:
+        """生成缓存后台刷新用的调用：刷新可能晚于会话结束，向服务器池租用自己的进程，不使用会话的租约"""
+        if not isinstance(mcp_client, MCPClientLease):
+            return None
+
+        async def refresh():
+            lease = mcp_server_pool.lease(mcp_client.pool.tool_info)
+            await lease.init()
+            try:
+                async with admission_controller.limit_upstream(f"mcp:{lease.name}"):
+                    return await lease.call_tool(tool_name, arguments)
+            finally:
+                await lease.cleanup()
+
+        return refresh
+
+    async def _execute_tool_call(self, tool_call: ToolCall) -> str:
+        """执行单个工具调用，返回写入消息历史的工具输出"""
+        target_mcp_client = self.resolve_tool(tool_call.function.name)
+        
+        if not target_mcp_client:
+            LOGGER.warning(f"Tool {tool_call.function.name} not found")
+            
+            # 发送工具未找到错误
+            if self.stream_callback:
+                await self.stream_callback("tool_call_result", {
+                    "tool_call_id": tool_call.id,
+                    "function_name": tool_call.function.name,
+                    "error": "工具未找到",
+                    "status": "not_found"
+                })
+            return "工具未找到"
+        
+        self.used_tools.add(tool_call.function.name)
+        self._emit_status("tool_calling", f"正在调用 {tool_call.function.name}")
+        LOGGER.title(f"TOOL USE `{tool_call.function.name}`")
+        LOGGER.info(f"with args: {tool_call.function.arguments}")
+        
+        # 发送工具调用详情
+        if self.stream_callback:
+            await self.stream_callback("tool_call_detail", {
+                "tool_call_id": tool_call.id,
+                "function_name": tool_call.function.name,
+                "arguments": tool_call.function.arguments,
+                "status": "calling"
+            })
+        
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+            
+            async def call_mcp_tool():
+                async with self._get_client_semaphore(target_mcp_client), \
+                        admission_controller.limit_upstream(f"mcp:{target_mcp_client.name}"):
+                    return await target_mcp_client.call_tool(tool_call.function.name, arguments)
+            
+            if self.geo_cache and self.geo_cache.handles(tool_call.function.name):
+                # 地理编码和地点检索走持久缓存，过期条目在后台刷新
+                mcp_result, cached = await self.geo_cache.get_or_fetch(
+                    tool_call.function.name, arguments, call_mcp_tool,
+                    refresh=self._make_refresh(target_mcp_client, tool_call.function.name, arguments),
+                )
+            else:
+                mcp_result = None
+                if self.tool_cache:
+                    mcp_result = await self.tool_cache.get(target_mcp_client.name, tool_call.function.name, arguments)
+                cached = mcp_result is not None
+                
+                if not cached:
+                    mcp_result = await call_mcp_tool()
+                    if self.tool_cache:
+                        await self.tool_cache.put(
+                            target_mcp_client.name, tool_call.function.name, arguments, mcp_result
+                        )
+            result_text = str(mcp_result)
+            LOGGER.success(f"Tool result{' (cached)' if cached else ''}: {result_text[:200]}...")
+            
+            # 发送工具调用结果
+            if self.stream_callback:
+                await self.stream_callback("tool_call_result", {
+                    "tool_call_id": tool_call.id,
+                    "function_name": tool_call.function.name,
+                    "result": result_text[:500] + "..." if len(result_text) > 500 else result_text,
+                    "status": "success",
+                    "cached": cached
+                })
+                # 添加reasoning反馈
+                await self.stream_callback("reasoning", f"✓ {tool_call.function.name} 调用成功，获得了相关信息\n")
+            # 模型只需要精简后的文本内容，前端仍收到完整的结果结构
+            return format_tool_output(mcp_result, tool_call.function.name)
+        except asyncio.CancelledError:
+            self.interrupted_tool_calls += 1
+            raise
+        except Exception as e:
+            LOGGER.error(f"Tool call failed: {e}")
+            
+            # 发送工具调用错误
+            if self.stream_callback:
+                await self.stream_callback("tool_call_result", {
+                    "tool_call_id": tool_call.id,
+                    "function_name": tool_call.function.name,
+                    "error": str(e),
+                    "status": "error"
+                })
+            return f"工具调用失败: {str(e)}"
+
+    def repair_after_cancel(self) -> int:
+        """请求被取消后修复消息历史：被中断的工具调用写入占位结果"""
+        if self.llm is None:
+            return 0
+        return self.llm.repair_tool_calls(CANCELLED_TOOL_OUTPUT)
+
     def get_system_prompt(self) -> str:
         """获取系统提示词"""
         return """你是一个专业的旅行规划助手，擅长为用户制定详细的旅行计划。
@@ -0,0 +1,58 @@
+"""
+Vector Store for Travel Assistant
+内存向量库（移植自 augmented.vector_store），增加元数据、相似度分数和删除操作
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Self, Tuple
+
+
+@dataclass
+class VectorStoreItem:
+    embedding: list[float]
+    document: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class VectorStore:
+    items: list[VectorStoreItem] = field(default_factory=list)
+
+    def add(self, item: VectorStoreItem) -> Self:
+        self.items.append(item)
+        return self
+
+    def remove(self, predicate: Callable[[VectorStoreItem], bool]) -> int:
+        """删除满足条件的条目，返回删除数量"""
+        kept = [item for item in self.items if not predicate(item)]
+        removed = len(self.items) - len(kept)
+        self.items = kept
+        return removed
+
+    def search(
+        self, query_embedding: list[float], top_k: int = 5
+    ) -> list[VectorStoreItem]:
+        return [item for item, _ in self.search_with_scores(query_embedding, top_k)]
+
+    def search_with_scores(
+        self,
+        query_embedding: list[float],
+        top_k: int = 5,
+        where: Optional[Callable[[VectorStoreItem], bool]] = None,
+    ) -> List[Tuple[VectorStoreItem, float]]:
+        """按余弦相似度检索，where 用于在计算相似度之前过滤候选条目"""
+        candidates = self.items if where is None else [item for item in self.items if where(item)]
+        scored = [
+            (item, self._cosine_similarity(query_embedding, item.embedding))
+            for item in candidates
+        ]
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return scored[:top_k]
+
+    def _cosine_similarity(self, v1: list[float], v2: list[float]) -> float:
+        dot_product = sum(a * b for a, b in zip(v1, v2))
+        magnitude_v1 = sum(a**2 for a in v1) ** 0.5
+        magnitude_v2 = sum(b**2 for b in v2) ** 0.5
+        if not magnitude_v1 or not magnitude_v2:
+            return 0.0
+        return dot_product / (magnitude_v1 * magnitude_v2)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Fake Baidu Maps MCP Server
+离线替身：提供与百度地图 MCP Server 同名、同参数的工具，返回确定性的模拟数据，
+并模拟上游延迟，用于在没有 API Key 的环境下测试缓存命中率和延迟
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+from mcp.server import Server
+import mcp.types as types
+import mcp.server.stdio
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 模拟的上游延迟（毫秒）
+FAKE_BAIDU_LATENCY_MS = float(os.environ.get("FAKE_BAIDU_LATENCY_MS", 120))
+
+# 常用城市中心坐标，其他地址落在北京附近
+CITY_CENTERS: Dict[str, Tuple[float, float]] = {
+    "北京": (39.9042, 116.4074),
+    "上海": (31.2304, 121.4737),
+    "杭州": (30.2741, 120.1551),
+    "广州": (23.1291, 113.2644),
+    "深圳": (22.5431, 114.0579),
+    "成都": (30.5728, 104.0668),
+    "西安": (34.3416, 108.9398),
+}
+DEFAULT_CENTER = CITY_CENTERS["北京"]
+
+server = Server("fake-baidu-map-server")
+
+# 上游调用次数统计，便于基准测试核对缓存是否生效
+call_counts: Dict[str, int] = {}
+
+
+@server.list_tools()
+async def handle_list_tools() -> list[types.Tool]:
+    """列出与百度地图 MCP Server 一致的工具"""
+    return [
+        types.Tool(
+            name="map_geocode",
+            description="地理编码服务：将地址解析为经纬度坐标",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "address": {"type": "string", "description": "待解析的地址"}
+                },
+                "required": ["address"]
+            }
+        ),
+        types.Tool(
+            name="map_reverse_geocode",
+            description="逆地理编码服务：根据经纬度坐标获取地址信息",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "latitude": {"type": "number", "description": "纬度"},
+                    "longitude": {"type": "number", "description": "经度"}
+                },
+                "required": ["latitude", "longitude"]
+            }
+        ),
+        types.Tool(
+            name="map_search_places",
+            description="地点检索服务：按关键词在城市内或圆形区域内检索地点",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "检索关键词"},
+                    "tag": {"type": "string", "description": "检索分类偏好"},
+                    "region": {"type": "string", "description": "检索的城市名称"},
+                    "location": {"type": "string", "description": "圆形区域检索中心点，格式为 lat,lng"},
+                    "radius": {"type": "integer", "description": "圆形区域检索半径（米）"}
+                },
+                "required": ["query"]
+            }
+        ),
+        types.Tool(
+            name="map_place_detail",
+            description="地点详情检索服务：根据地点 uid 获取详细信息",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "uid": {"type": "string", "description": "地点 uid"},
+                    "scope": {"type": "string", "description": "返回结果详细程度：1 基本信息，2 详细信息"}
+                },
+                "required": ["uid"]
+            }
+        ),
+    ]
+
+
+@server.call_tool()
+async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent]:
+    """处理工具调用"""
+    call_counts[name] = call_counts.get(name, 0) + 1
+    await asyncio.sleep(FAKE_BAIDU_LATENCY_MS / 1000)
+    try:
+        if name == "map_geocode":
+            result = geocode(arguments["address"])
+        elif name == "map_reverse_geocode":
+            result = reverse_geocode(arguments["latitude"], arguments["longitude"])
+        elif name == "map_search_places":
+            result = search_places(arguments)
+        elif name == "map_place_detail":
+            result = place_detail(arguments["uid"], arguments.get("scope", "1"))
+        else:
+            return [types.TextContent(type="text", text=f"未知工具: {name}")]
+    except Exception as e:
+        return [types.TextContent(type="text", text=f"地图工具调用出错: {str(e)}")]
+
+    return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False))]
+
+
+def stable_offset(text: str, scale: float = 0.05) -> Tuple[float, float]:
+    """根据文本生成确定性的坐标偏移"""
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    return (
+        (digest[0] / 255 - 0.5) * scale,
+        (digest[1] / 255 - 0.5) * scale,
+    )
+
+
+def find_city(text: str) -> str:
+    """从文本中识别城市名"""
+    for city in CITY_CENTERS:
+        if city in text:
+            return city
+    return "北京"
+
+
+def fake_location(text: str) -> Dict[str, float]:
+    """生成地址对应的模拟坐标"""
+    lat, lng = CITY_CENTERS.get(find_city(text), DEFAULT_CENTER)
+    d_lat, d_lng = stable_offset(text)
+    return {"lat": round(lat + d_lat, 6), "lng": round(lng + d_lng, 6)}
+
+
+def fake_uid(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:24]
+
+
+def geocode(address: str) -> Dict[str, Any]:
+    """模拟地理编码"""
+    return {
+        "status": 0,
+        "result": {
+            "location": fake_location(address),
+            "precise": 1,
+            "confidence": 80,
+            "comprehension": 100,
+            "level": "旅游景点"
+        }
+    }
+
+
+def reverse_geocode(latitude: float, longitude: float) -> Dict[str, Any]:
+    """模拟逆地理编码：取最近的城市中心"""
+    city = min(
+        CITY_CENTERS,
+        key=lambda name: (CITY_CENTERS[name][0] - latitude) ** 2 + (CITY_CENTERS[name][1] - longitude) ** 2
+    )
+    return {
+        "status": 0,
+        "result": {
+            "location": {"lat": latitude, "lng": longitude},
+            "formatted_address": f"{city}市示例区示例路{int(abs(latitude * 1000)) % 100}号",
+            "addressComponent": {"country": "中国", "province": city, "city": f"{city}市"}
+        }
+    }
+
+
+def search_places(args: dict) -> Dict[str, Any]:
+    """模拟地点检索，每个关键词返回固定的几个结果"""
+    query = args["query"]
+    region = args.get("region") or find_city(args.get("location", "") or query)
+    results: List[Dict[str, Any]] = []
+    for i in range(5):
+        name = f"{region}{query}{i + 1}"
+        results.append({
+            "name": name,
+            "location": fake_location(f"{region}{name}"),
+            "address": f"{region}市示例路{i + 1}号",
+            "uid": fake_uid(name),
+            "detail": 1
+        })
+    return {"status": 0, "message": "ok", "results": results}
+
+
+def place_detail(uid: str, scope: str) -> Dict[str, Any]:
+    """模拟地点详情"""
+    result: Dict[str, Any] = {
+        "uid": uid,
+        "name": f"地点{uid[:6]}",
+        "location": fake_location(uid),
+        "address": f"北京市示例路{int(fake_uid(uid)[:4], 16) % 100}号",
+        "detail": 1
+    }
+    if str(scope) == "2":
+        result["detail_info"] = {
+            "tag": "旅游景点",
+            "overall_rating": "4.6",
+            "shop_hours": "08:30-17:00",
+            "price": "60"
+        }
+    return {"status": 0, "message": "ok", "result": result}
+
+
+async def main():
+    # Run the server using stdin/stdout streams
+    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+        await server.run(
+            read_stream,
+            write_stream,
+            server.create_initialization_options()
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
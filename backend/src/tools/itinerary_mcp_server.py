@@ -22,9 +22,19 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# 输出单行 JSON，减少传给模型的 token
+MCP_COMPACT_OUTPUT = os.environ.get("MCP_COMPACT_OUTPUT", "true").lower() == "true"
+
 server = Server("itinerary-server")
 
 
+def dump_json(data: Any) -> str:
+    """序列化工具结果：默认输出单行 JSON，MCP_COMPACT_OUTPUT=false 时保留缩进便于阅读"""
+    if MCP_COMPACT_OUTPUT:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """列出可用的行程规划工具"""
@@ -382,7 +392,7 @@ async def plan_itinerary(args: dict) -> list[types.TextContent]:
     
     return [types.TextContent(
         type="text",
-        text=json.dumps(result, ensure_ascii=False, indent=2)
+        text=dump_json(result)
     )]
 
 
@@ -495,7 +505,7 @@ async def optimize_route(args: dict) -> list[types.TextContent]:
     
     return [types.TextContent(
         type="text",
-        text=json.dumps(result, ensure_ascii=False, indent=2)
+        text=dump_json(result)
     )]
 
 
@@ -620,7 +630,7 @@ async def suggest_activities(args: dict) -> list[types.TextContent]:
     
     return [types.TextContent(
         type="text",
-        text=json.dumps(result, ensure_ascii=False, indent=2)
+        text=dump_json(result)
     )]
 
 
@@ -751,7 +761,7 @@ async def calculate_budget(args: dict) -> list[types.TextContent]:
     
     return [types.TextContent(
         type="text",
-        text=json.dumps(budget_breakdown, ensure_ascii=False, indent=2)
+        text=dump_json(budget_breakdown)
     )]
 
 
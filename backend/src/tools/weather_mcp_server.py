@@ -7,15 +7,19 @@ Weather MCP Server
 import asyncio
 import json
 import os
-import requests
+import random
+import re
+import time
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
+import httpx
 from mcp.server import NotificationOptions, Server
 from mcp.types import (
     Resource, Tool, TextContent, ImageContent, EmbeddedResource
 )
 import mcp.types as types
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 from pydantic import AnyUrl
 import mcp.server.stdio
 
@@ -27,9 +31,179 @@ load_dotenv()
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY")
 WEATHER_API_URL = "http://api.openweathermap.org/data/2.5"
 
+# HTTP client configuration
+WEATHER_HTTP_TIMEOUT = float(os.environ.get("WEATHER_HTTP_TIMEOUT", 10))
+WEATHER_HTTP_MAX_CONNECTIONS = int(os.environ.get("WEATHER_HTTP_MAX_CONNECTIONS", 20))
+WEATHER_HTTP_RETRIES = int(os.environ.get("WEATHER_HTTP_RETRIES", 2))
+WEATHER_HTTP_RETRY_BACKOFF = float(os.environ.get("WEATHER_HTTP_RETRY_BACKOFF", 0.5))  # 秒
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Cache configuration（秒）
+WEATHER_CACHE_TTL_CURRENT = float(os.environ.get("WEATHER_CACHE_TTL_CURRENT", 600))
+WEATHER_CACHE_TTL_FORECAST = float(os.environ.get("WEATHER_CACHE_TTL_FORECAST", 1800))
+WEATHER_CACHE_TTL_NEGATIVE = float(os.environ.get("WEATHER_CACHE_TTL_NEGATIVE", 60))
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get("WEATHER_CACHE_MAX_ENTRIES", 1000))
+FORECAST_MAX_POINTS = 40  # 免费接口最多返回5天、每3小时一个时间点
+CACHE_STATS_URI = "weather://cache/stats"
+
+# 工具结果序列化为单行 JSON
+MCP_COMPACT_OUTPUT = os.environ.get("MCP_COMPACT_OUTPUT", "true").lower() == "true"
+
 server = Server("weather-server")
 
 
+def dump_json(data: Any) -> str:
+    """序列化天气结果"""
+    if MCP_COMPACT_OUTPUT:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+class WeatherCache:
+    """天气数据 TTL 缓存，同一键的并发未命中只发起一次上游请求（singleflight）"""
+
+    def __init__(self, max_entries: int = WEATHER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # 键 -> (过期时间, 数据, 负缓存的异常)
+        self._entries: Dict[Tuple, Tuple[float, Any, Optional[Exception]]] = {}
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_errors = 0
+
+    async def get_or_fetch(self, key: Tuple, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """读取缓存，未命中时调用 fetch 获取并写入缓存"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            expires_at, data, error = entry
+            if error is not None:
+                self.negative_hits += 1
+                raise error
+            self.hits += 1
+            return data
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, ttl, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield：某个调用方被取消时不影响其他等待同一请求的调用方
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key: Tuple, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            data = await fetch()
+        except httpx.HTTPStatusError as e:
+            self.upstream_errors += 1
+            # 城市不存在等客户端错误短暂缓存，避免反复消耗配额
+            if 400 <= e.response.status_code < 500 and e.response.status_code != 429:
+                self._store(key, (time.monotonic() + WEATHER_CACHE_TTL_NEGATIVE, None, e))
+            raise
+        except Exception:
+            self.upstream_errors += 1
+            raise
+        self._store(key, (time.monotonic() + ttl, data, None))
+        return data
+
+    def _store(self, key: Tuple, entry: Tuple[float, Any, Optional[Exception]]) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        if len(self._entries) > self.max_entries:
+            now = time.monotonic()
+            for expired_key in [k for k, v in self._entries.items() if v[0] <= now]:
+                del self._entries[expired_key]
+            # 仍然超出时淘汰最早写入的条目
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "upstream_requests": self.misses,
+            "upstream_errors": self.upstream_errors,
+            "hit_rate": (self.hits + self.negative_hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+weather_cache = WeatherCache()
+
+
+def normalize_city(city: str) -> str:
+    """规范化城市名作为缓存键：去除多余空白、统一大小写和逗号"""
+    city = city.strip().lower().replace("，", ",")
+    city = re.sub(r"\s*,\s*", ",", city)
+    return re.sub(r"\s+", " ", city)
+
+
+async def fetch_current_data(city: str, units: str, lang: str) -> dict:
+    """获取当前天气原始数据（带缓存）"""
+    key = (normalize_city(city), units, lang, "weather")
+    return await weather_cache.get_or_fetch(
+        key,
+        WEATHER_CACHE_TTL_CURRENT,
+        lambda: fetch_weather_json("weather", {"q": city, "units": units, "lang": lang}),
+    )
+
+
+async def fetch_forecast_data(city: str, units: str, lang: str) -> dict:
+    """获取天气预报原始数据（带缓存），总是请求完整的5天数据以便不同天数的请求共享缓存"""
+    key = (normalize_city(city), units, lang, "forecast")
+    return await weather_cache.get_or_fetch(
+        key,
+        WEATHER_CACHE_TTL_FORECAST,
+        lambda: fetch_weather_json(
+            "forecast", {"q": city, "units": units, "lang": lang, "cnt": FORECAST_MAX_POINTS}
+        ),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的 keep-alive HTTP 客户端"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=WEATHER_API_URL,
+            timeout=httpx.Timeout(WEATHER_HTTP_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=WEATHER_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=WEATHER_HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=30,
+            ),
+        )
+    return _http_client
+
+
+async def fetch_weather_json(endpoint: str, params: dict) -> dict:
+    """请求 OpenWeatherMap 接口，网络错误和 429/5xx 响应按指数退避加随机抖动重试"""
+    params = {**params, "appid": WEATHER_API_KEY}
+    for attempt in range(WEATHER_HTTP_RETRIES + 1):
+        last_attempt = attempt == WEATHER_HTTP_RETRIES
+        try:
+            response = await get_http_client().get(f"/{endpoint}", params=params)
+            if last_attempt or response.status_code not in RETRYABLE_STATUS_CODES:
+                response.raise_for_status()
+                return response.json()
+        except httpx.TransportError:
+            if last_attempt:
+                raise
+        # full jitter，避免并发请求同时重试
+        await asyncio.sleep(random.uniform(0, WEATHER_HTTP_RETRY_BACKOFF * 2 ** attempt))
+
+
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """列出可用的天气工具"""
@@ -107,10 +281,76 @@ async def handle_list_tools() -> list[types.Tool]:
                 },
                 "required": ["city"]
             }
+        ),
+        types.Tool(
+            name="get_weather_batch",
+            description="批量获取多个城市在指定日期范围内的每日天气摘要和天气提醒，一次调用即可替代多次 get_weather_forecast",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "cities": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "city": {
+                                    "type": "string",
+                                    "description": "城市名称，如'杭州'或'Hangzhou,CN'"
+                                },
+                                "start_date": {
+                                    "type": "string",
+                                    "description": "开始日期 YYYY-MM-DD，可选"
+                                },
+                                "end_date": {
+                                    "type": "string",
+                                    "description": "结束日期 YYYY-MM-DD，可选"
+                                }
+                            },
+                            "required": ["city"]
+                        },
+                        "description": "要查询的城市及日期范围列表（最多5天预报）"
+                    },
+                    "units": {
+                        "type": "string",
+                        "description": "温度单位：metric(摄氏度), imperial(华氏度), kelvin",
+                        "default": "metric"
+                    },
+                    "lang": {
+                        "type": "string",
+                        "description": "语言：zh_cn(中文), en(英文)",
+                        "default": "zh_cn"
+                    }
+                },
+                "required": ["cities"]
+            }
         )
     ]
 
 
+@server.list_resources()
+async def handle_list_resources() -> list[types.Resource]:
+    """列出可用的资源"""
+    return [
+        types.Resource(
+            uri=AnyUrl(CACHE_STATS_URI),
+            name="weather-cache-stats",
+            description="天气缓存命中率与上游请求统计",
+            mimeType="application/json",
+        )
+    ]
+
+
+@server.read_resource()
+async def handle_read_resource(uri: AnyUrl) -> list[ReadResourceContents]:
+    """读取资源"""
+    if str(uri) == CACHE_STATS_URI:
+        return [ReadResourceContents(
+            content=json.dumps(weather_cache.get_stats(), ensure_ascii=False),
+            mime_type="application/json",
+        )]
+    raise ValueError(f"未知资源: {uri}")
+
+
 @server.call_tool()
 async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent]:
     """处理工具调用"""
@@ -128,6 +368,8 @@ async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent
             return await get_weather_forecast(arguments)
         elif name == "get_weather_alerts":
             return await get_weather_alerts(arguments)
+        elif name == "get_weather_batch":
+            return await get_weather_batch(arguments)
         else:
             return [types.TextContent(
                 type="text",
@@ -146,18 +388,8 @@ async def get_current_weather(args: dict) -> list[types.TextContent]:
     units = args.get("units", "metric")
     lang = args.get("lang", "zh_cn")
     
-    url = f"{WEATHER_API_URL}/weather"
-    params = {
-        "q": city,
-        "appid": WEATHER_API_KEY,
-        "units": units,
-        "lang": lang
-    }
-    
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = await fetch_current_data(city, units, lang)
         
         # 解析天气数据
         weather_info = {
@@ -190,10 +422,10 @@ async def get_current_weather(args: dict) -> list[types.TextContent]:
         
         return [types.TextContent(
             type="text",
-            text=json.dumps(weather_info, ensure_ascii=False, indent=2)
+            text=dump_json(weather_info)
         )]
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return [types.TextContent(
             type="text",
             text=f"获取天气数据失败: {str(e)}"
@@ -212,19 +444,8 @@ async def get_weather_forecast(args: dict) -> list[types.TextContent]:
     units = args.get("units", "metric")
     lang = args.get("lang", "zh_cn")
     
-    url = f"{WEATHER_API_URL}/forecast"
-    params = {
-        "q": city,
-        "appid": WEATHER_API_KEY,
-        "units": units,
-        "lang": lang,
-        "cnt": days * 8  # 每天8个时间点（3小时间隔）
-    }
-    
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = await fetch_forecast_data(city, units, lang)
         
         # 按天分组预报数据
         daily_forecasts = {}
@@ -286,13 +507,14 @@ async def get_weather_forecast(args: dict) -> list[types.TextContent]:
                 "forecasts": day_data["forecasts"][:4]  # 只显示前4个时间点
             }
             forecast_summary["daily_forecasts"].append(daily_summary)
+        forecast_summary["forecast_days"] = len(forecast_summary["daily_forecasts"])
         
         return [types.TextContent(
             type="text",
-            text=json.dumps(forecast_summary, ensure_ascii=False, indent=2)
+            text=dump_json(forecast_summary)
         )]
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return [types.TextContent(
             type="text",
             text=f"获取天气预报失败: {str(e)}"
@@ -304,6 +526,35 @@ async def get_weather_forecast(args: dict) -> list[types.TextContent]:
         )]
 
 
+def derive_alerts(humidity: float, wind_speed: float, description: str, prefix: str = "当前") -> list[dict]:
+    """根据天气条件生成简单的提醒"""
+    alerts = []
+    description = description.lower()
+    
+    if humidity > 80:
+        alerts.append({
+            "type": "高湿度提醒",
+            "level": "注意",
+            "message": f"{prefix}湿度{humidity}%，较为潮湿，注意防潮"
+        })
+    
+    if wind_speed > 10:
+        alerts.append({
+            "type": "大风提醒", 
+            "level": "注意",
+            "message": f"{prefix}风速{wind_speed}m/s，外出注意安全"
+        })
+    
+    if any(keyword in description for keyword in ["rain", "雨", "snow", "雪"]):
+        alerts.append({
+            "type": "降水提醒",
+            "level": "提醒",
+            "message": "预计有降水，出行请携带雨具"
+        })
+    
+    return alerts
+
+
 async def get_weather_alerts(args: dict) -> list[types.TextContent]:
     """获取天气预警（简化版本，实际需要更高级的API）"""
     city = args["city"]
@@ -312,38 +563,15 @@ async def get_weather_alerts(args: dict) -> list[types.TextContent]:
     # 由于免费版 OpenWeatherMap API 不包含预警信息，我们提供一个简化的实现
     # 实际项目中可以使用更高级的天气服务
     
-    # 先获取当前天气，根据条件给出建议
+    # 直接基于当前天气的原始数据给出建议（与 get_current_weather 共享缓存）
     try:
-        current_weather = await get_current_weather({"city": city, "lang": lang})
-        weather_data = json.loads(current_weather[0].text)
-        
-        alerts = []
-        
-        # 基于天气条件生成简单的提醒
-        humidity = weather_data["humidity"]
-        wind_speed = weather_data["wind"]["speed"]
-        description = weather_data["weather"]["description"].lower()
-        
-        if humidity > 80:
-            alerts.append({
-                "type": "高湿度提醒",
-                "level": "注意",
-                "message": f"当前湿度{humidity}%，较为潮湿，注意防潮"
-            })
-        
-        if wind_speed > 10:
-            alerts.append({
-                "type": "大风提醒", 
-                "level": "注意",
-                "message": f"当前风速{wind_speed}m/s，外出注意安全"
-            })
+        data = await fetch_current_data(city, "metric", lang)
         
-        if any(keyword in description for keyword in ["rain", "雨", "snow", "雪"]):
-            alerts.append({
-                "type": "降水提醒",
-                "level": "提醒",
-                "message": "预计有降水，出行请携带雨具"
-            })
+        alerts = derive_alerts(
+            humidity=data["main"]["humidity"],
+            wind_speed=data["wind"]["speed"],
+            description=data["weather"][0]["description"],
+        )
         
         if not alerts:
             alerts.append({
@@ -353,7 +581,7 @@ async def get_weather_alerts(args: dict) -> list[types.TextContent]:
             })
         
         alert_info = {
-            "city": weather_data["city"],
+            "city": data["name"],
             "check_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "alerts_count": len(alerts),
             "alerts": alerts,
@@ -362,7 +590,7 @@ async def get_weather_alerts(args: dict) -> list[types.TextContent]:
         
         return [types.TextContent(
             type="text",
-            text=json.dumps(alert_info, ensure_ascii=False, indent=2)
+            text=dump_json(alert_info)
         )]
         
     except Exception as e:
@@ -372,14 +600,89 @@ async def get_weather_alerts(args: dict) -> list[types.TextContent]:
         )]
 
 
+def summarize_forecast_days(data: dict) -> list[dict]:
+    """把预报原始数据汇总为每日紧凑摘要，并从同一份数据推导天气提醒"""
+    days: Dict[str, dict] = {}
+    for item in data["list"]:
+        date = datetime.fromtimestamp(item["dt"]).strftime("%Y-%m-%d")
+        day = days.setdefault(date, {
+            "date": date,
+            "min": float("inf"),
+            "max": float("-inf"),
+            "precip_mm": 0.0,
+            "wind_max": 0.0,
+            "humidity_max": 0,
+            "weather_counts": {}
+        })
+        day["min"] = min(day["min"], item["main"]["temp_min"])
+        day["max"] = max(day["max"], item["main"]["temp_max"])
+        day["precip_mm"] += item.get("rain", {}).get("3h", 0) + item.get("snow", {}).get("3h", 0)
+        day["wind_max"] = max(day["wind_max"], item["wind"]["speed"])
+        day["humidity_max"] = max(day["humidity_max"], item["main"]["humidity"])
+        description = item["weather"][0]["description"]
+        day["weather_counts"][description] = day["weather_counts"].get(description, 0) + 1
+    
+    summaries = []
+    for day in days.values():
+        weather_counts = day.pop("weather_counts")
+        day["weather"] = max(weather_counts.items(), key=lambda x: x[1])[0]
+        day["precip_mm"] = round(day["precip_mm"], 1)
+        # 任一时段出现降水即提醒，而不仅看主要天气
+        description = " ".join(weather_counts) if day["precip_mm"] > 0 else day["weather"]
+        day["alerts"] = [
+            alert["message"]
+            for alert in derive_alerts(day["humidity_max"], day["wind_max"], description, prefix="最高")
+        ]
+        summaries.append(day)
+    return summaries
+
+
+async def get_weather_batch(args: dict) -> list[types.TextContent]:
+    """批量获取多个城市在指定日期范围内的每日天气摘要"""
+    city_requests = args["cities"]
+    units = args.get("units", "metric")
+    lang = args.get("lang", "zh_cn")
+    unit_symbol = "°C" if units == "metric" else "°F" if units == "imperial" else "K"
+    
+    async def forecast_for(request: dict) -> dict:
+        city = request["city"]
+        start_date = request.get("start_date", "")
+        end_date = request.get("end_date", "")
+        try:
+            data = await fetch_forecast_data(city, units, lang)
+        except Exception as e:
+            return {"city": city, "error": f"获取天气预报失败: {str(e)}"}
+        
+        days = [
+            day for day in summarize_forecast_days(data)
+            if (not start_date or day["date"] >= start_date) and (not end_date or day["date"] <= end_date)
+        ]
+        result = {"city": data["city"]["name"], "days": days}
+        if not days:
+            result["note"] = "请求的日期超出5天预报范围"
+        return result
+    
+    # 并发获取所有城市，同一城市的重复请求会合并为一次上游请求
+    results = await asyncio.gather(*(forecast_for(request) for request in city_requests))
+    
+    return [types.TextContent(
+        type="text",
+        text=dump_json({"unit": unit_symbol, "results": results})
+    )]
+
+
 async def main():
     # Run the server using stdin/stdout streams
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            server.create_initialization_options()
-        )
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                server.create_initialization_options()
+            )
+    finally:
+        if _http_client is not None:
+            await _http_client.aclose()
 
 
 if __name__ == "__main__":
@@ -12,9 +12,17 @@ load_dotenv()
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
 DEFAULT_MODEL_NAME = os.environ.get("DEFAULT_MODEL_NAME", "gpt-4o-mini")
+LLM_STREAM_USAGE = os.environ.get("LLM_STREAM_USAGE", "true").lower() == "true"  # 流式响应末尾返回 token 用量（含提示缓存命中数）
+
+# Embedding Configuration
+EMBEDDING_KEY = os.environ.get("EMBEDDING_KEY") or OPENAI_API_KEY
+EMBEDDING_BASE_URL = os.environ.get("EMBEDDING_BASE_URL") or OPENAI_BASE_URL
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_TIMEOUT = float(os.environ.get("EMBEDDING_TIMEOUT", 10))
 
 # 百度地图 API 配置
 BAIDU_MAP_API_KEY = os.environ.get("BAIDU_MAP_API_KEY", "")
+BAIDU_MAP_FAKE = os.environ.get("BAIDU_MAP_FAKE", "false").lower() == "true"  # 使用离线模拟的百度地图服务器
 
 # Weather API Configuration
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "")
@@ -22,6 +30,7 @@ WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "")
 # FastAPI Configuration
 HOST = os.environ.get("HOST", "localhost")
 PORT = int(os.environ.get("PORT", 8000))
+WORKERS = int(os.environ.get("WORKERS", 1))  # uvicorn worker 进程数，大于 1 时需要共享的会话存储和事件总线
 
 # CORS Configuration
 CORS_ORIGINS = [
@@ -33,6 +42,103 @@ CORS_ORIGINS = [
 # Session Management Configuration
 MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 100))
 SESSION_TIMEOUT = int(os.environ.get("SESSION_TIMEOUT", 3600))  # 1 hour
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite").lower()  # sqlite: 持久化到 SESSION_DB_PATH; memory: 不持久化
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+SESSION_STORE_FLUSH_INTERVAL_MS = float(os.environ.get("SESSION_STORE_FLUSH_INTERVAL_MS", 200))  # 批量提交间隔
+SESSION_STORE_FLUSH_BATCH = int(os.environ.get("SESSION_STORE_FLUSH_BATCH", 100))  # 队列达到该数量时立即提交
+
+# Event Bus Configuration（多 worker 之间转发会话的状态 / 流式事件）
+EVENT_BUS = os.environ.get("EVENT_BUS", "sqlite" if WORKERS > 1 else "none").lower()  # sqlite: 经 EVENT_BUS_DB_PATH 转发; none: 单进程
+EVENT_BUS_DB_PATH = os.environ.get("EVENT_BUS_DB_PATH", "events.db")
+EVENT_BUS_POLL_INTERVAL_MS = float(os.environ.get("EVENT_BUS_POLL_INTERVAL_MS", 20))  # 轮询新事件和批量写入的间隔
+EVENT_BUS_RETENTION = float(os.environ.get("EVENT_BUS_RETENTION", 60))  # 事件保留时长（秒）
+WORKER_HEARTBEAT_INTERVAL = float(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 5))  # 秒，超过 3 个间隔未更新视为 worker 已退出
+STICKY_SESSIONS = os.environ.get("STICKY_SESSIONS", "false").lower() == "true"  # 会话固定由一个 worker 处理，Agent 实例常驻该 worker
+STICKY_FORWARD_TIMEOUT = float(os.environ.get("STICKY_FORWARD_TIMEOUT", 600))  # 转发给所属 worker 的请求的超时时间（秒）
+EVENT_BUS_DELIVERY_QUEUE = int(os.environ.get("EVENT_BUS_DELIVERY_QUEUE", 1000))  # 每个会话待投递给本地连接的转发事件上限，超出时合并增量、丢弃其他流式数据并通知客户端重连补发
+
+# WebSocket Stream Configuration（content / reasoning 增量合并发送）
+STREAM_FLUSH_INTERVAL_MS = float(os.environ.get("STREAM_FLUSH_INTERVAL_MS", 30))  # 最小发送间隔
+STREAM_FLUSH_MAX_INTERVAL_MS = float(os.environ.get("STREAM_FLUSH_MAX_INTERVAL_MS", 200))  # 客户端接收慢时的最大间隔
+STREAM_FLUSH_MAX_BYTES = int(os.environ.get("STREAM_FLUSH_MAX_BYTES", 4096))  # 缓冲超过该字节数时立即发送
+STREAM_QUEUE_MAX_EVENTS = int(os.environ.get("STREAM_QUEUE_MAX_EVENTS", 256))  # 每个连接待发送事件数上限
+WS_MAX_PENDING_REQUESTS = int(os.environ.get("WS_MAX_PENDING_REQUESTS", 5))  # 每个连接排队的后续请求数上限（0 表示不限制）
+WS_RESUME_GRACE = float(os.environ.get("WS_RESUME_GRACE", 30))  # 连接断开后等待重连的时间（秒），超时后取消正在处理的请求
+EVENT_REPLAY_BUFFER = int(os.environ.get("EVENT_REPLAY_BUFFER", 256))  # 每个会话在内存中保留的最近事件数，用于重连补发
+EVENT_SPILL = os.environ.get("EVENT_SPILL", "true").lower() == "true"  # 超出内存缓冲的事件写入临时文件
+EVENT_SPILL_MAX_EVENTS = int(os.environ.get("EVENT_SPILL_MAX_EVENTS", 5000))  # 每个会话在磁盘上保留的事件数
+
+# MCP Server Pool Configuration
+MCP_POOL_SIZE = int(os.environ.get("MCP_POOL_SIZE", 1))  # 每个 MCP 服务器的进程数
+MCP_POOL_MAX_CONCURRENCY = int(os.environ.get("MCP_POOL_MAX_CONCURRENCY", 32))  # 每个池的最大并发调用数
+MCP_IN_PROCESS = os.environ.get("MCP_IN_PROCESS", "false").lower() == "true"  # 进程内挂载本项目的 MCP Server
+MCP_HEALTH_CHECK_INTERVAL = float(os.environ.get("MCP_HEALTH_CHECK_INTERVAL", 15))  # 健康检查间隔（秒）
+MCP_PING_TIMEOUT = float(os.environ.get("MCP_PING_TIMEOUT", 5))
+MCP_RESTART_BASE_BACKOFF = float(os.environ.get("MCP_RESTART_BASE_BACKOFF", 1))  # 重启退避初始值（秒）
+MCP_RESTART_MAX_BACKOFF = float(os.environ.get("MCP_RESTART_MAX_BACKOFF", 60))
+
+# Admission Control Configuration（0 表示不限制；WORKERS > 1 时前两个上限为所有 worker 合计，按 worker 数平均分配）
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 16))  # 同时处理的旅行规划请求数（所有 worker 合计）
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 64))  # 每个 worker 的排队请求数上限，队列已满时立即返回繁忙
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 120))  # 最长排队时间（秒）
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))  # 同时进行的 LLM 流式请求数（所有 worker 合计）
+TOOL_UPSTREAM_CONCURRENCY = int(os.environ.get("TOOL_UPSTREAM_CONCURRENCY", 16))  # 每个 MCP 服务器同时进行的工具调用数（每个 worker 有自己的服务器进程）
+
+# Async Job Configuration
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 3600))  # 已结束任务（含结果和事件）的保留时间（秒）
+MAX_JOBS = int(os.environ.get("MAX_JOBS", 1000))  # 保留的任务数上限，超出时先清理最早的已结束任务
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", 200))  # 未结束（排队和执行中）的任务数上限，超出时拒绝提交，0 表示不限制
+MAX_PENDING_JOBS_PER_SESSION = int(os.environ.get("MAX_PENDING_JOBS_PER_SESSION", 5))  # 每个会话未结束的任务数上限，0 表示不限制
+JOB_MAX_EVENTS = int(os.environ.get("JOB_MAX_EVENTS", 2000))  # 每个任务记录的事件数上限（未读取的相邻增量会合并），0 表示不限制
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", 15))  # SSE 无事件时的心跳间隔（秒）
+
+# Agent Configuration
+TOOL_CALL_CONCURRENCY = int(os.environ.get("TOOL_CALL_CONCURRENCY", 4))  # 单轮内每个 MCP 客户端的最大并发工具调用数
+
+# Plan Cache Configuration（整份方案的语义缓存，需要可用的 Embedding 接口）
+PLAN_CACHE_ENABLED = os.environ.get("PLAN_CACHE_ENABLED", "false").lower() == "true"
+PLAN_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("PLAN_CACHE_SIMILARITY_THRESHOLD", 0.92))
+PLAN_CACHE_TTL = float(os.environ.get("PLAN_CACHE_TTL", 6 * 3600))  # 秒
+PLAN_CACHE_WEATHER_TTL = float(os.environ.get("PLAN_CACHE_WEATHER_TTL", 3600))  # 使用了天气数据的方案
+PLAN_CACHE_MAX_ENTRIES = int(os.environ.get("PLAN_CACHE_MAX_ENTRIES", 500))
+
+# Tool Output Configuration（写入消息历史的工具输出格式）
+TOOL_OUTPUT_MODE = os.environ.get("TOOL_OUTPUT_MODE", "compact").lower()  # compact: 精简文本; full: 完整 CallToolResult JSON
+# 各工具结果中省略的顶层固定字段，格式为 "工具名:字段"，工具名为 * 表示所有工具
+TOOL_OUTPUT_OMIT_KEYS = [
+    key.strip()
+    for key in os.environ.get(
+        "TOOL_OUTPUT_OMIT_KEYS",
+        "plan_itinerary:travel_tips,optimize_route:route_tips,suggest_activities:general_tips,"
+        "calculate_budget:budget_tips,get_weather_alerts:note,*:generated_at"
+    ).split(",")
+    if ":" in key
+]
+
+# Conversation Compaction Configuration
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 24000))  # 每次请求的提示 token 预算（估算值），0 表示不压缩
+CONTEXT_KEEP_RECENT_TURNS = int(os.environ.get("CONTEXT_KEEP_RECENT_TURNS", 2))  # 保持原文的最近轮数
+CONTEXT_TOOL_OUTPUT_MAX_CHARS = int(os.environ.get("CONTEXT_TOOL_OUTPUT_MAX_CHARS", 1500))  # 较早工具输出精简后的最大长度
+
+# Tool Result Cache Configuration
+TOOL_CACHE_ENABLED = os.environ.get("TOOL_CACHE_ENABLED", "true").lower() == "true"
+TOOL_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_CACHE_MAX_ENTRIES", 2048))
+TOOL_CACHE_DB_PATH = os.environ.get("TOOL_CACHE_DB_PATH", "")  # 为空时不启用 SQLite 持久层
+
+# Geo Cache Configuration（百度地图地理编码 / 地点检索的持久缓存，时间单位为秒）
+GEO_CACHE_ENABLED = os.environ.get("GEO_CACHE_ENABLED", "true").lower() == "true"
+GEO_CACHE_DB_PATH = os.environ.get("GEO_CACHE_DB_PATH", "geo_cache.db")
+GEO_CACHE_GEOCODE_TTL = float(os.environ.get("GEO_CACHE_GEOCODE_TTL", 30 * 86400))  # 地理编码新鲜期
+GEO_CACHE_PLACE_TTL = float(os.environ.get("GEO_CACHE_PLACE_TTL", 7 * 86400))  # 地点详情新鲜期
+GEO_CACHE_SEARCH_TTL = float(os.environ.get("GEO_CACHE_SEARCH_TTL", 86400))  # 地点检索新鲜期
+GEO_CACHE_STALE_TTL = float(os.environ.get("GEO_CACHE_STALE_TTL", 30 * 86400))  # 过期后继续使用并后台刷新的时长
+GEO_CACHE_REVERSE_RADIUS = float(os.environ.get("GEO_CACHE_REVERSE_RADIUS", 50))  # 逆地理编码复用半径（米）
+
+# Logging Configuration（日志由后台线程输出，调用方只入队）
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "rich").lower()  # rich：开发环境彩色输出；json：生产环境每行一条 JSON
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG" if LOG_FORMAT == "rich" else "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1.0))  # DEBUG / INFO 日志的采样比例，WARNING 及以上始终输出
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # 待输出日志数上限，队列已满时丢弃并计数
 
 # Project Paths
 PROJECT_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
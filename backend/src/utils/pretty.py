@@ -1,7 +1,27 @@
+"""
+Logging for Travel Assistant
+日志输出：调用方只做级别过滤、采样并把记录放入队列，格式化和控制台 I/O 都在后台线程中完成；
+开发环境（LOG_FORMAT=rich）用 Rich 渲染，生产环境（LOG_FORMAT=json）每行输出一条 JSON
+"""
+
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
 from rich.console import Console
 from rich.theme import Theme
 from rich.text import Text
 from rich.panel import Panel
+from rich.traceback import Traceback
+
+from src.utils.info import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE
 
 # 自定义主题
 custom_theme = Theme({
@@ -16,38 +36,182 @@ custom_theme = Theme({
 
 RICH_CONSOLE = Console(theme=custom_theme)
 
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# 低于该级别的日志直接丢弃
+MIN_LEVEL = LEVELS.get(LOG_LEVEL, LEVELS["INFO"])
+
+# 后台线程每批最多输出的记录数
+WRITE_BATCH = 256
+
+# (时间, 级别, 类型, 前缀, 内容, 附加参数, 异常信息)
+LogRecord = Tuple[float, str, str, str, Any, Tuple[Any, ...], Optional[tuple]]
+
+
+class LogWriter:
+    """日志队列和后台输出线程
+
+    队列已满时丢弃新记录并计数，不阻塞调用方；进程退出时输出剩余记录
+    """
+
+    def __init__(self, fmt: str = LOG_FORMAT, max_queue: int = LOG_QUEUE_SIZE):
+        self.fmt = fmt
+        self._queue: "queue.Queue[Optional[LogRecord]]" = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def submit(self, record: LogRecord) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            batch: List[LogRecord] = []
+            record = self._queue.get()
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= WRITE_BATCH:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                sys.stderr.write(f"Failed to write log records: {e}\n")
+            if record is None:
+                return
+
+    def _write(self, batch: List[LogRecord]) -> None:
+        if self.dropped > self._reported_dropped:
+            batch.append((
+                time.time(), "WARNING", "warning", "[Logging]",
+                f"Dropped {self.dropped - self._reported_dropped} log records (queue full)", (), None
+            ))
+            self._reported_dropped = self.dropped
+        if self.fmt == "json":
+            sys.stdout.write("".join(self._format_json(record) for record in batch))
+            sys.stdout.flush()
+        else:
+            for record in batch:
+                self._print_rich(record)
+        self.written += len(batch)
+
+    @staticmethod
+    def _format_json(record: LogRecord) -> str:
+        created, level, kind, prefix, text, extra, exc_info = record
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(created).isoformat(timespec="milliseconds"),
+            "level": level,
+            "logger": prefix.strip("[]"),
+            "kind": kind,
+        }
+        if kind == "tool_call":
+            entry["tool"], entry["args"] = text, str(extra[0])
+        else:
+            entry["msg"] = str(text)
+        if exc_info is not None:
+            entry["exc"] = "".join(traceback.format_exception(*exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+
+    @staticmethod
+    def _print_rich(record: LogRecord) -> None:
+        _, _, kind, prefix, text, extra, exc_info = record
+        if kind == "title":
+            RICH_CONSOLE.rule(f"{prefix} {text}", style=extra[0])
+        elif kind == "thinking":
+            RICH_CONSOLE.print(Panel(text, title="🤔 思考中", style="thinking"))
+        elif kind == "tool_call":
+            RICH_CONSOLE.print(Panel(
+                f"工具: {text}\n参数: {extra[0]}",
+                title="🔧 调用工具",
+                style="tool"
+            ))
+        elif kind == "agent_response":
+            RICH_CONSOLE.print(Panel(text, title="🤖 Agent 回复", style="agent"))
+        else:
+            RICH_CONSOLE.print(f"{prefix} {text}", style=kind)
+        if exc_info is not None:
+            RICH_CONSOLE.print(Traceback.from_exception(*exc_info))
+
+    def close(self, timeout: float = 2.0) -> None:
+        """输出剩余记录并停止后台线程"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "format": self.fmt,
+            "level": LOG_LEVEL,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+# 全局日志输出实例
+LOG_WRITER = LogWriter()
+
 
 class ALogger:
     def __init__(self, prefix: str):
         self.prefix = prefix
 
+    def _log(self, level: str, kind: str, text: Any, *extra: Any, exc_info: Optional[tuple] = None):
+        if LEVELS[level] < MIN_LEVEL:
+            return
+        if LEVELS[level] < LEVELS["WARNING"] and LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE:
+            return
+        LOG_WRITER.submit((time.time(), level, kind, self.prefix, text, extra, exc_info))
+
     def title(self, text: str, rule_style: str = "bright_cyan"):
-        RICH_CONSOLE.rule(f"{self.prefix} {text}", style=rule_style)
+        self._log("DEBUG", "title", text, rule_style)
 
     def info(self, text: str):
-        RICH_CONSOLE.print(f"{self.prefix} {text}", style="info")
+        self._log("INFO", "info", text)
 
     def warning(self, text: str):
-        RICH_CONSOLE.print(f"{self.prefix} {text}", style="warning")
+        self._log("WARNING", "warning", text)
 
     def error(self, text: str):
-        RICH_CONSOLE.print(f"{self.prefix} {text}", style="error")
+        self._log("ERROR", "error", text)
+
+    def exception(self, text: str):
+        """记录错误和当前正在处理的异常堆栈"""
+        self._log("ERROR", "error", text, exc_info=sys.exc_info())
 
     def success(self, text: str):
-        RICH_CONSOLE.print(f"{self.prefix} {text}", style="success")
+        self._log("INFO", "success", text)
 
     def tool(self, text: str):
-        RICH_CONSOLE.print(f"{self.prefix} {text}", style="tool")
+        self._log("INFO", "tool", text)
 
     def thinking(self, text: str):
-        RICH_CONSOLE.print(Panel(text, title="🤔 思考中", style="thinking"))
+        self._log("DEBUG", "thinking", text)
 
-    def tool_call(self, tool_name: str, args: str):
-        RICH_CONSOLE.print(Panel(
-            f"工具: {tool_name}\n参数: {args}",
-            title="🔧 调用工具",
-            style="tool"
-        ))
+    def tool_call(self, tool_name: str, args: Any):
+        # 参数在后台线程中转换为字符串
+        self._log("DEBUG", "tool_call", tool_name, args)
 
     def agent_response(self, text: str):
-        RICH_CONSOLE.print(Panel(text, title="🤖 Agent 回复", style="agent")) 
\ No newline at end of file
+        self._log("DEBUG", "agent_response", text)
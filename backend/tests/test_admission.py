@@ -0,0 +1,147 @@
+"""FairLimiter：按 key 轮转分配名额，取消和排队超时后名额与计数保持一致"""
+
+import asyncio
+
+import pytest
+
+from src.core.admission import AdmissionRejectedError, FairLimiter
+
+
+async def hold(limiter: FairLimiter, key: str, release: asyncio.Event, order: list):
+    async with limiter.acquire(key):
+        order.append(key)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_queued_keys_are_served_round_robin():
+    limiter = FairLimiter("test", limit=1)
+    order: list = []
+    gate = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, "holder", gate, order))
+    await settle()
+
+    # a 先排了三个请求，b 后排一个：b 不需要等 a 的请求全部完成
+    done = asyncio.Event()
+    done.set()
+    waiters = [asyncio.create_task(hold(limiter, key, done, order)) for key in ("a", "a", "a", "b")]
+    await settle()
+    assert limiter.waiting == 4
+
+    gate.set()
+    await asyncio.gather(holder, *waiters)
+    assert order == ["holder", "a", "b", "a", "a"]
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+async def test_queue_positions_follow_round_robin_order():
+    limiter = FairLimiter("test", limit=1)
+    gate = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, "holder", gate, []))
+    await settle()
+
+    positions: dict = {}
+
+    async def wait(name: str, key: str):
+        async with limiter.acquire(key, lambda position, total: positions.__setitem__(name, position)):
+            pass
+
+    tasks = [asyncio.create_task(wait(name, key)) for name, key in (("a1", "a"), ("a2", "a"), ("b1", "b"))]
+    await settle()
+    assert positions == {"a1": 1, "a2": 3, "b1": 2}
+
+    gate.set()
+    await asyncio.gather(holder, *tasks)
+
+
+async def test_cancelled_waiter_leaves_the_queue():
+    limiter = FairLimiter("test", limit=1)
+    order: list = []
+    gate = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, "holder", gate, order))
+    await settle()
+
+    done = asyncio.Event()
+    done.set()
+    cancelled = asyncio.create_task(hold(limiter, "a", done, order))
+    waiting = asyncio.create_task(hold(limiter, "b", done, order))
+    await settle()
+    cancelled.cancel()
+    await settle()
+    assert limiter.waiting == 1
+    assert limiter.active == 1
+
+    gate.set()
+    await asyncio.gather(holder, waiting)
+    assert cancelled.cancelled()
+    assert order == ["holder", "b"]
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+async def test_cancel_after_slot_was_granted_returns_the_slot():
+    limiter = FairLimiter("test", limit=1)
+    gate = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, "holder", gate, []))
+    await settle()
+
+    waiter = asyncio.create_task(hold(limiter, "a", asyncio.Event(), []))
+    await settle()
+    # 释放名额时已分配给 waiter，但 waiter 还没来得及运行就被取消
+    gate.set()
+    await holder
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert limiter.active == 0 and limiter.waiting == 0
+
+    async with limiter.acquire("b"):
+        assert limiter.active == 1
+
+
+async def test_queue_timeout_rejects_and_keeps_counts():
+    limiter = FairLimiter("test", limit=1, queue_timeout=0.05)
+    gate = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, "holder", gate, []))
+    await settle()
+
+    with pytest.raises(AdmissionRejectedError) as info:
+        async with limiter.acquire("a"):
+            pass
+    assert info.value.retry_after >= 1
+    assert limiter.timeouts == 1
+    assert limiter.waiting == 0
+    assert limiter.active == 1
+
+    gate.set()
+    await holder
+    assert limiter.active == 0
+
+
+async def test_full_queue_rejects_immediately():
+    limiter = FairLimiter("test", limit=1, max_queue=1)
+    gate = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, "holder", gate, []))
+    await settle()
+    queued = asyncio.create_task(hold(limiter, "a", asyncio.Event(), []))
+    await settle()
+
+    with pytest.raises(AdmissionRejectedError):
+        async with limiter.acquire("b"):
+            pass
+    assert limiter.rejected == 1
+    assert limiter.waiting == 1
+
+    queued.cancel()
+    gate.set()
+    await asyncio.gather(holder, queued, return_exceptions=True)
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+async def test_zero_limit_does_not_limit():
+    limiter = FairLimiter("test", limit=0)
+    async with limiter.acquire("a"), limiter.acquire("a"), limiter.acquire("b"):
+        assert limiter.active == 3
+        assert limiter.waiting == 0
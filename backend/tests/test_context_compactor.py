@@ -0,0 +1,117 @@
+"""ConversationCompactor：超出预算时依次标记被取代的结果、精简工具输出、整轮丢弃，工具调用始终成对"""
+
+import json
+
+from src.core.context_compactor import (
+    SUPERSEDED_PLACEHOLDER, ConversationCompactor, estimate_tokens
+)
+
+SYSTEM = {"role": "system", "content": "你是旅行助手"}
+
+
+def turn(index: int, tool: str, arguments: dict, output: str) -> list:
+    """一轮对话：用户提问、工具调用、工具结果、最终回复"""
+    call_id = f"call_{index}"
+    return [
+        {"role": "user", "content": f"问题 {index}"},
+        {
+            "role": "assistant",
+            "content": "",
+            "tool_calls": [{
+                "type": "function",
+                "id": call_id,
+                "function": {"name": tool, "arguments": json.dumps(arguments)},
+            }],
+        },
+        {"role": "tool", "tool_call_id": call_id, "content": output},
+        {"role": "assistant", "content": f"回答 {index}"},
+    ]
+
+
+def assert_tool_calls_paired(messages: list):
+    calls = {
+        tool_call["id"] for message in messages for tool_call in message.get("tool_calls") or []
+    }
+    results = {message["tool_call_id"] for message in messages if message.get("role") == "tool"}
+    assert calls == results
+
+
+def test_under_budget_is_untouched():
+    messages = [SYSTEM, *turn(1, "map_geocode", {"address": "北京"}, "x" * 100)]
+    original = json.loads(json.dumps(messages))
+    report = ConversationCompactor(token_budget=10_000).compact(messages, pinned=1)
+    assert not report.changed
+    assert messages == original
+
+
+def test_superseded_results_go_first():
+    big = json.dumps({"result": "天气" * 500})
+    messages = [
+        SYSTEM,
+        *turn(1, "get_weather_forecast", {"city": "北京"}, big),
+        *turn(2, "get_weather_forecast", {"city": "北京"}, big),
+        *turn(3, "map_geocode", {"address": "上海"}, "{}"),
+    ]
+    budget = estimate_tokens(messages) - 100
+    compactor = ConversationCompactor(token_budget=budget, keep_recent_turns=1, tool_output_max_chars=50)
+    report = compactor.compact(messages, pinned=1)
+
+    # 第一轮的结果被第二轮相同的调用取代，取代之后已在预算内，不再精简或丢弃
+    assert (report.superseded, report.summarized, report.dropped_turns) == (1, 0, 0)
+    assert messages[3]["content"] == SUPERSEDED_PLACEHOLDER
+    assert messages[7]["content"] == big
+    assert report.tokens_after <= budget
+
+
+def test_summarizes_old_tool_output_before_dropping_turns():
+    big = json.dumps({"content": [{"type": "text", "text": json.dumps({"items": list(range(2000))}, indent=2)}]})
+    messages = [
+        SYSTEM,
+        *turn(1, "map_search_places", {"query": "景点"}, big),
+        *turn(2, "map_geocode", {"address": "上海"}, "{}"),
+    ]
+    budget = estimate_tokens(messages) - 100
+    compactor = ConversationCompactor(token_budget=budget, keep_recent_turns=1, tool_output_max_chars=200)
+    report = compactor.compact(messages, pinned=1)
+
+    assert (report.superseded, report.summarized, report.dropped_turns) == (0, 1, 0)
+    assert len(messages[3]["content"]) < 300
+    assert messages[1]["content"] == "问题 1"
+
+
+def test_drops_oldest_whole_turns_and_keeps_recent_ones():
+    messages = [SYSTEM]
+    for index in range(1, 6):
+        messages += turn(index, "map_geocode", {"address": f"城市{index}"}, "地址" * 200)
+    recent = messages[-4:]
+    budget = estimate_tokens([SYSTEM] + messages[-8:]) + 10
+    compactor = ConversationCompactor(token_budget=budget, keep_recent_turns=2, tool_output_max_chars=10_000)
+    report = compactor.compact(messages, pinned=1)
+
+    assert report.dropped_turns == 3
+    assert messages[0] is SYSTEM
+    assert messages[1]["content"] == "问题 4"
+    assert messages[-4:] == recent
+    assert_tool_calls_paired(messages)
+    assert report.tokens_after == estimate_tokens(messages)
+    assert report.tokens_after <= budget
+
+
+def test_reserved_tokens_count_against_budget():
+    messages = [SYSTEM, *turn(1, "a", {}, "x"), *turn(2, "b", {}, "y")]
+    budget = estimate_tokens(messages) + 50
+    compactor = ConversationCompactor(token_budget=budget, keep_recent_turns=1)
+    assert not compactor.compact(messages, pinned=1).changed
+
+    report = compactor.compact(messages, pinned=1, reserved_tokens=100)
+    assert report.dropped_turns == 1
+    assert report.tokens_after == estimate_tokens(messages) + 100
+
+
+def test_current_turn_is_never_dropped():
+    messages = [SYSTEM, *turn(1, "map_geocode", {}, "地址" * 500)]
+    compactor = ConversationCompactor(token_budget=10, keep_recent_turns=1, tool_output_max_chars=10_000)
+    report = compactor.compact(messages, pinned=1)
+    assert report.dropped_turns == 0
+    assert len(messages) == 5
+    assert report.tokens_after > 10
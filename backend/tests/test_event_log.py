@@ -0,0 +1,103 @@
+"""EventLog：序号分配、溢出到磁盘后的补发，以及 since 对缺失事件的判断"""
+
+import pytest
+
+from src.core.event_log import EventLog
+
+
+def status(n: int) -> dict:
+    return {"type": "status", "status": "processing", "details": str(n)}
+
+
+@pytest.fixture
+async def spill_log():
+    log = EventLog(capacity=3, spill=True, spill_max=100, max_sessions=10)
+    await log.start()
+    yield log
+    await log.close()
+
+
+async def test_seq_is_consecutive_per_session():
+    log = EventLog(capacity=10, spill=False)
+    assert [log.record("a", status(i))["seq"] for i in range(3)] == [1, 2, 3]
+    assert log.record("b", status(0))["seq"] == 1
+    assert log.last_seq("a") == 3
+    assert log.last_seq("missing") == 0
+
+
+async def test_relayed_seq_is_renumbered_on_collision():
+    log = EventLog(capacity=10, spill=False)
+    log.record("a", status(0))
+    # 其他 worker 分配的序号与本地冲突时按本地顺序重新编号
+    assert log.record("a", status(1), seq=1)["seq"] == 2
+    assert log.record("a", status(2), seq=3)["seq"] == 3
+    assert log.renumbered == 1
+
+
+async def test_since_returns_buffered_events_after_last_seq():
+    log = EventLog(capacity=10, spill=False)
+    for i in range(5):
+        log.record("a", status(i))
+    events, complete = await log.since("a", 2)
+    assert complete
+    assert [event["seq"] for event in events] == [3, 4, 5]
+
+
+async def test_since_reports_gap_when_events_were_evicted_without_spill():
+    log = EventLog(capacity=3, spill=False)
+    for i in range(6):
+        log.record("a", status(i))
+    events, complete = await log.since("a", 1)
+    assert not complete
+    assert [event["seq"] for event in events] == [4, 5, 6]
+    assert log.gaps == 1
+
+
+async def test_since_replays_spilled_events_from_disk(spill_log):
+    for i in range(8):
+        spill_log.record("a", status(i))
+    events, complete = await spill_log.since("a", 0)
+    assert complete
+    assert [event["seq"] for event in events] == list(range(1, 9))
+    assert [event["details"] for event in events] == [str(i) for i in range(8)]
+    assert spill_log.spilled == 5
+
+
+async def test_since_reports_gap_beyond_spill_limit():
+    log = EventLog(capacity=2, spill=True, spill_max=3, max_sessions=10)
+    await log.start()
+    try:
+        for i in range(10):
+            log.record("a", status(i))
+        # 内存中保留 9、10，磁盘上保留 6~8，更早的已丢弃：有缺失时只返回内存中的事件
+        events, complete = await log.since("a", 2)
+        assert not complete
+        assert [event["seq"] for event in events] == [9, 10]
+
+        events, complete = await log.since("a", 5)
+        assert complete
+        assert [event["seq"] for event in events] == [6, 7, 8, 9, 10]
+    finally:
+        await log.close()
+
+
+async def test_since_after_restart_is_incomplete():
+    log = EventLog(capacity=10, spill=False)
+    log.record("a", status(0))
+    # 客户端带着重启前更大的序号重连
+    assert await log.since("a", 5) == ([], False)
+    assert await log.since("unknown", 3) == ([], False)
+    assert await log.since("unknown", 0) == ([], True)
+
+
+async def test_dropped_session_is_not_replayed(spill_log):
+    for i in range(6):
+        spill_log.record("a", status(i))
+    await spill_log.flush()
+    spill_log.drop("a")
+    await spill_log.flush()
+
+    spill_log.record("a", status(0))
+    events, complete = await spill_log.since("a", 0)
+    assert complete
+    assert [event["seq"] for event in events] == [1]
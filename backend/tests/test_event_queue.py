@@ -0,0 +1,127 @@
+"""SessionEventQueue：增量合并、队列已满时的丢弃 / 等待策略，以及写入顺序"""
+
+import asyncio
+import json
+
+from src.api.event_queue import SessionEventQueue
+from src.api.stream_buffer import StreamBuffer
+
+
+class Client:
+    """记录发送的帧"""
+
+    def __init__(self):
+        self.frames: list = []
+
+    async def send_text(self, text: str):
+        self.frames.append(json.loads(text))
+
+
+def make_queue(max_events: int = 3, client: Client = None) -> SessionEventQueue:
+    client = client or Client()
+    return SessionEventQueue(StreamBuffer(client.send_text, min_interval=0, max_bytes=1), max_events=max_events)
+
+
+def queued(queue: SessionEventQueue) -> list:
+    return list(queue._events)
+
+
+async def test_deltas_coalesce_into_tail_with_newest_seq():
+    queue = make_queue()
+    await queue.put_stream("content", "你", 1)
+    await queue.put_stream("content", "好", 2)
+    await queue.put_stream("reasoning", "想", 3)
+    await queue.put_stream("content", "！", 4)
+    assert queued(queue) == [
+        ("stream", "content", "你好", 2),
+        ("stream", "reasoning", "想", 3),
+        ("stream", "content", "！", 4),
+    ]
+    assert queue.coalesced == 1
+
+
+async def test_deltas_coalesce_even_when_full():
+    queue = make_queue(max_events=1)
+    await queue.put_stream("content", "a", 1)
+    await asyncio.wait_for(queue.put_stream("content", "b", 2), 0.1)
+    assert queued(queue) == [("stream", "content", "ab", 2)]
+
+
+async def test_non_final_status_is_dropped_when_full():
+    queue = make_queue(max_events=2)
+    queue.put_status("thinking", seq=1)
+    queue.put_status("processing", seq=2)
+    # 最早的中间状态让位给新的中间状态
+    queue.put_status("tool_calling", seq=3)
+    assert [event[1]["status"] for event in queued(queue)] == ["processing", "tool_calling"]
+    assert queue.dropped == 1
+
+
+async def test_final_status_is_never_dropped():
+    queue = make_queue(max_events=1)
+    await queue.put_stream("tool_call_detail", {"name": "x"}, 1)
+    queue.put_status("thinking", seq=2)
+    queue.put_status("completed", seq=3)
+    queue.put_message({"type": "travel_plan", "content": "plan"})
+    kinds = [event[1] if event[0] == "stream" else event[1].get("status", event[1]["type"]) for event in queued(queue)]
+    assert kinds == ["tool_call_detail", "completed", "travel_plan"]
+    assert queue.dropped == 1
+    assert queue.overflow == 2
+
+
+async def test_other_stream_events_wait_for_space():
+    client = Client()
+    queue = make_queue(max_events=1, client=client)
+    await queue.put_stream("tool_call_detail", {"n": 1}, 1)
+    pending = asyncio.create_task(queue.put_stream("tool_call_result", {"n": 2}, 2))
+    await asyncio.sleep(0.01)
+    assert not pending.done()
+
+    queue.start()
+    await asyncio.wait_for(pending, 1)
+    await asyncio.sleep(0.01)
+    assert [frame["stream_type"] for frame in client.frames] == ["tool_call_detail", "tool_call_result"]
+    queue.discard()
+
+
+async def test_discard_wakes_blocked_producer():
+    queue = make_queue(max_events=1)
+    await queue.put_stream("tool_call_detail", {}, 1)
+    pending = asyncio.create_task(queue.put_stream("tool_call_result", {}, 2))
+    await asyncio.sleep(0.01)
+    queue.discard()
+    await asyncio.wait_for(pending, 1)
+    assert queue.depth == 0
+
+
+async def test_urgent_message_jumps_the_queue():
+    queue = make_queue(max_events=10)
+    queue.put_status("thinking", seq=1)
+    queue.put_urgent({"type": "pong"})
+    assert queued(queue)[0][1] == {"type": "pong"}
+
+
+async def test_replay_merges_adjacent_deltas_and_keeps_everything():
+    queue = make_queue(max_events=1)
+    queue.put_replay([
+        {"type": "stream", "stream_type": "content", "data": "a", "seq": 1},
+        {"type": "stream", "stream_type": "content", "data": "b", "seq": 2},
+        {"type": "status", "status": "thinking", "seq": 3},
+        {"type": "stream", "stream_type": "content", "data": "c", "seq": 4},
+    ])
+    messages = [event[1] for event in queued(queue)]
+    assert [(m.get("data"), m["seq"]) for m in messages] == [("ab", 2), (None, 3), ("c", 4)]
+
+
+async def test_writer_sends_in_order():
+    client = Client()
+    queue = make_queue(max_events=10, client=client)
+    queue.start()
+    queue.put_status("thinking", seq=1)
+    await queue.put_stream("content", "hi", 2)
+    queue.put_status("completed", seq=3)
+    await asyncio.sleep(0.05)
+    frames = client.frames
+    assert [frame.get("seq") for frame in frames] == [1, 2, 3]
+    assert frames[1]["data"] == "hi"
+    queue.discard()
@@ -0,0 +1,180 @@
+"""GeoCache：新鲜期 / 可用期、后台刷新、邻近坐标命中、并发未命中合并，以及错误结果不缓存"""
+
+import asyncio
+import json
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+from src.core import geo_cache as geo_cache_module
+from src.core.geo_cache import GeoCache, normalize_address
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+class Upstream:
+    """记录调用次数的上游"""
+
+    def __init__(self, payload=None):
+        self.calls = 0
+        self.payload = payload
+
+    async def __call__(self) -> CallToolResult:
+        self.calls += 1
+        payload = self.payload or {"status": 0, "result": {"location": {"lat": 39.9, "lng": 116.4}}, "n": self.calls}
+        text = payload if isinstance(payload, str) else json.dumps(payload)
+        return CallToolResult(content=[TextContent(type="text", text=text)])
+
+
+def payload_of(result: CallToolResult):
+    return json.loads(result.content[0].text)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geo_cache_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+async def cache(tmp_path, clock):
+    cache = GeoCache(
+        str(tmp_path / "geo.db"),
+        ttls={"map_geocode": 100, "map_reverse_geocode": 100, "map_search_places": 100},
+        stale_ttl=50,
+        reverse_radius=50,
+    )
+    await cache.start()
+    yield cache
+    await cache.close()
+
+
+def test_addresses_are_normalized():
+    assert normalize_address("中国 北京市，天安门") == normalize_address("北京市天安门")
+    assert normalize_address("ＡＢＣ") == "abc"
+
+
+async def test_fresh_entry_is_served_from_cache(cache, clock):
+    upstream = Upstream()
+    result, cached = await cache.get_or_fetch("map_geocode", {"address": "北京市"}, upstream)
+    assert not cached
+    result, cached = await cache.get_or_fetch("map_geocode", {"address": " 北京市 "}, upstream)
+    assert cached
+    assert payload_of(result)["n"] == 1
+    assert upstream.calls == 1
+    assert cache.get_stats()["entries"] == 1
+
+
+async def test_stale_entry_is_returned_and_refreshed_in_background(cache, clock):
+    fetch, refresh = Upstream(), Upstream()
+    await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch)
+
+    clock.now += 120
+    result, cached = await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch, refresh=refresh)
+    assert cached and payload_of(result)["n"] == 1
+    await asyncio.gather(*cache._refreshing.values())
+    # 刷新使用 refresh，不使用调用方的 fetch
+    assert (fetch.calls, refresh.calls) == (1, 1)
+    assert cache.stale_hits == 1 and cache.refreshes == 1
+
+    result, cached = await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch)
+    assert cached and payload_of(result)["n"] == 1
+    assert cache.hits == 1
+
+
+async def test_stale_entry_without_refresh_is_a_miss(cache, clock):
+    fetch = Upstream()
+    await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch)
+    clock.now += 120
+    _, cached = await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch)
+    assert not cached
+    assert fetch.calls == 2
+
+
+async def test_entry_past_stale_window_is_a_miss(cache, clock):
+    fetch, refresh = Upstream(), Upstream()
+    await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch)
+    clock.now += 151
+    _, cached = await cache.get_or_fetch("map_geocode", {"address": "北京"}, fetch, refresh=refresh)
+    assert not cached
+    assert (fetch.calls, refresh.calls) == (2, 0)
+    assert cache.get_stats()["entries"] == 1
+
+
+@pytest.mark.parametrize("payload", ["地理编码失败: timeout", {"status": 240, "message": "APP 服务被禁用"}])
+async def test_error_results_are_not_cached(cache, payload):
+    upstream = Upstream(payload)
+    for _ in range(2):
+        _, cached = await cache.get_or_fetch("map_geocode", {"address": "不存在的地方"}, upstream)
+        assert not cached
+    assert upstream.calls == 2
+    assert cache.get_stats()["entries"] == 0
+
+
+async def test_concurrent_misses_share_one_upstream_call(cache):
+    gate = asyncio.Event()
+    upstream = Upstream()
+
+    async def slow():
+        await gate.wait()
+        return await upstream()
+
+    tasks = [asyncio.create_task(cache.get_or_fetch("map_geocode", {"address": "上海"}, slow)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    gate.set()
+    results = await asyncio.gather(*tasks)
+    assert upstream.calls == 1
+    assert {payload_of(result)["n"] for result, _ in results} == {1}
+    assert cache.coalesced == 2
+
+
+async def test_reverse_geocode_hits_nearby_coordinates(cache):
+    upstream = Upstream()
+    await cache.get_or_fetch("map_reverse_geocode", {"latitude": 39.9, "longitude": 116.4}, upstream)
+    # 约 10 米外
+    _, cached = await cache.get_or_fetch("map_reverse_geocode", {"latitude": 39.90009, "longitude": 116.4}, upstream)
+    assert cached and cache.nearby_hits == 1
+    # 约 1 公里外
+    _, cached = await cache.get_or_fetch("map_reverse_geocode", {"latitude": 39.91, "longitude": 116.4}, upstream)
+    assert not cached
+    assert upstream.calls == 2
+
+
+async def test_entries_are_isolated_by_source(tmp_path, clock):
+    db_path = str(tmp_path / "geo.db")
+    real, fake = GeoCache(db_path, source="baidu"), GeoCache(db_path, source="fake")
+    await real.start()
+    await fake.start()
+    try:
+        await fake.get_or_fetch("map_geocode", {"address": "北京"}, Upstream())
+        _, cached = await real.get_or_fetch("map_geocode", {"address": "北京"}, Upstream())
+        assert not cached
+        assert (real.get_stats()["entries"], fake.get_stats()["entries"]) == (1, 1)
+    finally:
+        await real.close()
+        await fake.close()
+
+
+async def test_entry_count_survives_restart_and_clear(tmp_path, clock):
+    db_path = str(tmp_path / "geo.db")
+    cache = GeoCache(db_path, ttls={"map_geocode": 100}, stale_ttl=50)
+    await cache.start()
+    for address in ("北京", "上海", "北京"):
+        await cache.get_or_fetch("map_geocode", {"address": address}, Upstream())
+    await cache.close()
+
+    restarted = GeoCache(db_path, ttls={"map_geocode": 100}, stale_ttl=50)
+    await restarted.start()
+    try:
+        assert restarted.get_stats()["entries"] == 2
+        restarted.clear()
+        assert restarted.get_stats()["entries"] == 0
+    finally:
+        await restarted.close()
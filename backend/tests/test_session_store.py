@@ -0,0 +1,127 @@
+"""SQLiteSessionStore：批量写入整批提交或整批回滚，失败的批次放回队列时写入期间的新操作优先"""
+
+import pytest
+
+from src.core.session_store import SQLiteSessionStore
+
+
+@pytest.fixture
+async def store(tmp_path):
+    # 写入任务的间隔很长，只在测试调用 flush 时提交
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=3600, flush_batch=1000)
+    await store.start()
+    yield store
+    await store.close()
+
+
+def fail_once(store: SQLiteSessionStore, during=None):
+    """下一次批量写入失败；during 在失败的写入进行期间执行（模拟并发的新写操作）"""
+    write = store._db_write
+
+    def failing(*args):
+        store._db_write = write
+        if during is not None:
+            during()
+        raise OSError("disk full")
+
+    store._db_write = failing
+
+
+async def test_batch_is_committed_together(store):
+    store.save_session("a", {"v": 1}, 1.0)
+    store.append_message("a", {"role": "user", "content": "hi"})
+    store.save_session("b", {"v": 1}, 1.0)
+    await store.flush()
+    assert await store.load_session("a") == ({"v": 1}, [{"role": "user", "content": "hi"}])
+    assert store.get_stats()["sessions"] == 2
+    assert store.batches == 1
+
+
+async def test_failed_transaction_writes_nothing(store):
+    store.save_session("a", {"v": 1}, 1.0)
+    store.append_message("a", {"content": "ok"})
+    # message 列不允许为空：元数据已写入后插入消息失败，整批回滚
+    store._pending_messages.append(("a", None, 1.0))
+    with pytest.raises(Exception):
+        await store.flush()
+
+    assert store.write_errors == 1
+    assert store.get_stats()["sessions"] == 0
+    assert store._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+
+    # 放回队列的写操作在下一批重试
+    store._pending_messages = [item for item in store._pending_messages if item[1] is not None]
+    await store.flush()
+    assert await store.load_session("a") == ({"v": 1}, [{"content": "ok"}])
+    assert store.get_stats()["sessions"] == 1
+
+
+async def test_failed_batch_is_retried_in_order(store):
+    store.save_session("a", {"v": 1}, 1.0)
+    store.append_message("a", {"n": 1})
+    fail_once(store, during=lambda: store.append_message("a", {"n": 2}))
+    with pytest.raises(OSError):
+        await store.flush()
+
+    await store.flush()
+    assert await store.load_session("a") == ({"v": 1}, [{"n": 1}, {"n": 2}])
+
+
+async def test_newer_meta_wins_over_failed_batch(store):
+    store.save_session("a", {"v": 1}, 1.0)
+    fail_once(store, during=lambda: store.save_session("a", {"v": 2}, 2.0))
+    with pytest.raises(OSError):
+        await store.flush()
+
+    await store.flush()
+    meta, _ = await store.load_session("a")
+    assert meta == {"v": 2}
+
+
+async def test_resaved_session_is_not_deleted_by_retry(store):
+    store.save_session("a", {"v": 1}, 1.0)
+    await store.flush()
+
+    store.delete_session("a")
+
+    def resave():
+        store.save_session("a", {"v": 2}, 2.0)
+        store.append_message("a", {"n": 2})
+
+    fail_once(store, during=resave)
+    with pytest.raises(OSError):
+        await store.flush()
+    assert "a" not in store._pending_deletes
+
+    await store.flush()
+    assert await store.load_session("a") == ({"v": 2}, [{"n": 2}])
+    assert store.get_stats()["sessions"] == 1
+
+
+async def test_session_deleted_during_failed_batch_stays_deleted(store):
+    store.save_session("a", {"v": 1}, 1.0)
+    store.append_message("a", {"n": 1})
+    store.save_session("b", {"v": 1}, 1.0)
+    fail_once(store, during=lambda: store.delete_session("a"))
+    with pytest.raises(OSError):
+        await store.flush()
+    assert "a" not in store._pending_meta
+    assert all(item[0] != "a" for item in store._pending_messages)
+
+    await store.flush()
+    assert await store.load_session("a") is None
+    assert await store.load_session("b") == ({"v": 1}, [])
+    assert store.get_stats()["sessions"] == 1
+
+
+async def test_session_count_tracks_deletes_and_purge(store):
+    for session_id, last_activity in (("a", 1.0), ("b", 2.0), ("c", 3.0)):
+        store.save_session(session_id, {}, last_activity)
+    await store.flush()
+    store.save_session("a", {"v": 2}, 1.0)
+    store.delete_session("b")
+    await store.flush()
+    assert store.get_stats()["sessions"] == 2
+
+    assert await store.purge_expired(2.5) == 1
+    assert store.get_stats()["sessions"] == 1
@@ -0,0 +1,115 @@
+"""ToolResultCache：按工具的 TTL、内存 LRU、SQLite 持久层，以及错误结果不缓存"""
+
+import json
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+from src.core import tool_cache as tool_cache_module
+from src.core.tool_cache import ToolResultCache
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def result(data, is_error: bool = False) -> CallToolResult:
+    text = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    return CallToolResult(content=[TextContent(type="text", text=text)], isError=is_error)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tool_cache_module, "time", clock)
+    return clock
+
+
+async def test_hit_until_ttl_expires(clock):
+    cache = ToolResultCache(max_entries=10, ttls={"get_current_weather": 600})
+    await cache.put("weather", "get_current_weather", {"city": "北京"}, result({"temp": 20}))
+
+    clock.now += 599
+    cached = await cache.get("weather", "get_current_weather", {"city": "北京"})
+    assert json.loads(cached.content[0].text) == {"temp": 20}
+
+    clock.now += 2
+    assert await cache.get("weather", "get_current_weather", {"city": "北京"}) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+async def test_equivalent_arguments_share_an_entry(clock):
+    cache = ToolResultCache(max_entries=10, ttls={"map_direction": 60})
+    await cache.put("map", "map_direction", {"origin": "a", "destination": "b"}, result({"ok": 1}))
+    assert await cache.get("map", "map_direction", {"destination": "b", "origin": "a"}) is not None
+    assert await cache.get("other", "map_direction", {"origin": "a", "destination": "b"}) is None
+
+
+async def test_tools_without_ttl_are_not_cached(clock):
+    cache = ToolResultCache(max_entries=10, ttls={})
+    await cache.put("map", "map_geocode", {}, result({"ok": 1}))
+    assert await cache.get("map", "map_geocode", {}) is None
+    assert cache.get_stats()["entries"] == 0
+
+
+async def test_least_recently_used_entry_is_evicted(clock):
+    cache = ToolResultCache(max_entries=2, ttls={"map_geocode": 60})
+    for address in ("a", "b"):
+        await cache.put("map", "map_geocode", {"address": address}, result({"address": address}))
+    # 访问 a 之后 b 成为最久未使用的条目
+    assert await cache.get("map", "map_geocode", {"address": "a"}) is not None
+    await cache.put("map", "map_geocode", {"address": "c"}, result({"address": "c"}))
+
+    assert await cache.get("map", "map_geocode", {"address": "b"}) is None
+    assert await cache.get("map", "map_geocode", {"address": "a"}) is not None
+    assert await cache.get("map", "map_geocode", {"address": "c"}) is not None
+    assert cache.evictions == 1
+
+
+@pytest.mark.parametrize("failed", [
+    result({"status": 0}, is_error=True),
+    result("获取天气预报失败: timeout"),
+    result({"status": 302, "message": "配额超限"}),
+    result({"error": "city not found"}),
+    result({"results": [{"city": "北京", "temp": 20}, {"city": "火星", "error": "not found"}]}),
+    CallToolResult(content=[]),
+])
+async def test_error_results_are_not_cached(clock, failed):
+    cache = ToolResultCache(max_entries=10, ttls={"get_weather_batch": 600})
+    await cache.put("weather", "get_weather_batch", {}, failed)
+    assert await cache.get("weather", "get_weather_batch", {}) is None
+    assert cache.rejected == 1
+
+
+async def test_disk_tier_survives_restart(tmp_path, clock):
+    db_path = str(tmp_path / "tool_cache.db")
+    cache = ToolResultCache(max_entries=10, db_path=db_path, ttls={"map_geocode": 60})
+    await cache.start()
+    await cache.put("map", "map_geocode", {"address": "北京"}, result({"lat": 39.9}))
+    await cache.close()
+
+    restarted = ToolResultCache(max_entries=10, db_path=db_path, ttls={"map_geocode": 60})
+    await restarted.start()
+    try:
+        assert await restarted.get("map", "map_geocode", {"address": "北京"}) is not None
+        assert restarted.disk_hits == 1
+        # 读回后进入内存层
+        assert await restarted.get("map", "map_geocode", {"address": "北京"}) is not None
+        assert restarted.hits == 1
+
+        clock.now += 61
+        assert await restarted.get("map", "map_geocode", {"address": "北京"}) is None
+    finally:
+        await restarted.close()
+
+
+async def test_disk_tier_is_not_opened_before_start(tmp_path, clock):
+    db_path = tmp_path / "tool_cache.db"
+    cache = ToolResultCache(max_entries=10, db_path=str(db_path), ttls={"map_geocode": 60})
+    await cache.put("map", "map_geocode", {}, result({"ok": 1}))
+    assert not db_path.exists()
+    assert await cache.get("map", "map_geocode", {}) is not None